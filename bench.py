@@ -0,0 +1,530 @@
+"""
+Offline benchmark: run main.py against a local Dropbox stand-in server.
+
+The server mimics the shared-folder markup the resolver relies on
+(sl-grid-body, file cards, grid-link, the cookie consent button) and serves
+`dl=1` downloads with configurable size, latency, bandwidth and error rate.
+A synthetic UPC / IMAGES LINK / CATEGORY sheet is generated, main.py is run
+once per thread count, and throughput, per-item latency (from the run's
+journal) and peak memory are reported.
+
+Examples:
+  python bench.py --items 200 --threads 1,2,4,8
+  python bench.py --items 500 --engine http --folders 0 --threads 1 --downloads 4,16
+  python bench.py --serve 8765          # only run the stand-in server
+  python bench.py --check-resolver      # HTML resolver vs. the rendered grid
+"""
+
+import argparse
+import base64
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from concurrency import percentile
+
+FOLDER_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>{folder} - Dropbox</title></head>
+<body>
+<div id="consent" style="position:fixed;bottom:0">
+  <button data-testid="accept_all_cookies_button" onclick="document.getElementById('consent').remove()">Accept all</button>
+</div>
+<div id="app">{prerendered}</div>
+<script>
+{script}
+</script>
+</body>
+</html>
+"""
+
+# How folder pages deliver their file list, from easiest to hardest to read
+# without rendering:
+#   markup  grid cards already in the served HTML
+#   script  grid markup in a JSON string that a script inserts
+#   json    file entries in embedded JSON that a script turns into cards
+#   opaque  file list encoded so only running the script reveals it
+PAGE_STYLES = ("markup", "script", "json", "opaque")
+
+RENDER_GRID = """setTimeout(function () {{
+  document.getElementById("app").innerHTML = {grid};
+}}, {render_ms});"""
+
+RENDER_ENTRIES = """var preload = {entries};
+setTimeout(function () {{
+  var cards = preload.entries.map(function (e) {{
+    return '<li class="_sl-card_to1nz_25"><a data-testid="grid-link" href="' + e.href + '">' + e.filename + '</a></li>';
+  }});
+  document.getElementById("app").innerHTML = '<div data-testid="sl-grid-body"><ul>' + cards.join("") + '</ul></div>';
+}}, {render_ms});"""
+
+RENDER_OPAQUE = """setTimeout(function () {{
+  document.getElementById("app").innerHTML = atob("{encoded}");
+}}, {render_ms});"""
+
+CARD = (
+    '<li class="_sl-card_to1nz_25">'
+    '<img src="/thumb/{name}.jpg" width="160" height="160">'
+    '<a data-testid="grid-link" href="{href}">{name}</a>'
+    '</li>'
+)
+
+
+def folder_page(key, folder, config):
+    """HTML of a stand-in shared folder in the configured page style"""
+    entries = [
+        {"filename": f"{folder}_{n}.jpg", "href": f"/scl/fi/{key}/{folder}_{n}.jpg?rlkey=bench&dl=0", "is_dir": False}
+        for n in range(1, config.cards + 1)
+    ]
+    cards = "".join(CARD.format(name=e["filename"], href=e["href"]) for e in entries)
+    grid = f'<div data-testid="sl-grid-body"><ul>{cards}</ul></div>'
+    prerendered = ""
+    if config.page_style == "markup":
+        prerendered, script = grid, ""
+    elif config.page_style == "json":
+        script = RENDER_ENTRIES.format(entries=json.dumps({"entries": entries}), render_ms=config.render_ms)
+    elif config.page_style == "opaque":
+        encoded = base64.b64encode(grid.encode()).decode()
+        script = RENDER_OPAQUE.format(encoded=encoded, render_ms=config.render_ms)
+    else:
+        script = RENDER_GRID.format(grid=json.dumps(grid), render_ms=config.render_ms)
+    return FOLDER_PAGE.format(folder=folder, prerendered=prerendered, script=script)
+
+
+class StandInConfig:
+    """Knobs for the stand-in server"""
+    def __init__(self, file_size=200 * 1024, latency=0.05, bandwidth=0, error_rate=0.0,
+                 render_ms=100, cards=5, seed=1, page_style="script"):
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth  # bytes/second per transfer, 0 = unlimited
+        self.error_rate = error_rate
+        self.render_ms = render_ms
+        self.page_style = page_style
+        self.cards = cards
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _fail_randomly(self):
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            fail = config.random.random() < config.error_rate
+            status = config.random.choice([429, 500, 503]) if fail else None
+            if fail:
+                config.errors += 1
+        if fail:
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send(status, f"stand-in error {status}".encode(), headers=headers)
+        return fail
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        config = self.config
+        if config.latency:
+            time.sleep(config.latency)
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split("/") if s]
+        query = parse_qs(parts.query)
+
+        if segments[:1] == ["thumb"]:
+            return self._send(200, b"\xff\xd8" + b"\0" * 4096, "image/jpeg")
+        if len(segments) < 4 or segments[0] != "scl" or segments[1] not in ("fo", "fi"):
+            return self._send(404, b"not found")
+        if self._fail_randomly():
+            return
+
+        if segments[1] == "fo":
+            return self._send(200, folder_page(segments[2], segments[3], config).encode())
+
+        name = segments[3]
+        if query.get("dl") != ["1"]:
+            return self._send(200, f"<html><body>Preview of {name}</body></html>".encode())
+        self._send_file(name)
+
+    def _send_file(self, name):
+        config = self.config
+        seed = hashlib.sha1(name.encode()).digest()
+        etag = f'"{seed.hex()[:16]}-{config.file_size}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, headers={"ETag": etag})
+        body = (seed * (config.file_size // len(seed) + 1))[:config.file_size]
+        status = 200
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            if start >= len(body):
+                return self._send(416, headers={"Content-Range": f"bytes */{len(body)}"})
+            status = 206
+            content_range = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            body = body[start:]
+        self.send_response(status)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", content_range)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        chunk = 64 * 1024
+        for offset in range(0, len(body), chunk):
+            started = time.monotonic()
+            self.wfile.write(body[offset:offset + chunk])
+            if config.bandwidth:
+                spare = chunk / config.bandwidth - (time.monotonic() - started)
+                if spare > 0:
+                    time.sleep(spare)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (retries, shutdown) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_server(config, port=0):
+    """
+    Start the stand-in server in a background thread.
+
+    Returns:
+        Tuple of (server, base URL)
+    """
+    handler = type("Handler", (StandInHandler,), {"config": config})
+    server = StandInServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def write_sheet(path, base_url, items, folder_ratio=1.0, duplicate_ratio=0.0, categories=4, seed=1):
+    """
+    Write a synthetic UPC / IMAGES LINK / CATEGORY sheet.
+
+    Args:
+        folder_ratio: Share of rows linking a shared folder (the rest link a file)
+        duplicate_ratio: Share of rows reusing an earlier row's link
+        categories: Number of distinct categories (0 for no CATEGORY column)
+    """
+    rng = random.Random(seed)
+    links = []
+    rows = []
+    for n in range(items):
+        upc = f"{800000000000 + n}"
+        if links and rng.random() < duplicate_ratio:
+            link = rng.choice(links)
+        elif rng.random() < folder_ratio:
+            link = f"{base_url}/scl/fo/k{n}/F{upc}?rlkey=bench&dl=0"
+        else:
+            link = f"{base_url}/scl/fi/k{n}/{upc}.jpg?rlkey=bench&dl=0"
+        links.append(link)
+        row = {'UPC': upc, 'IMAGES LINK': link}
+        if categories:
+            row['CATEGORY'] = f"Category {n % categories + 1}"
+        rows.append(row)
+
+    path = Path(path)
+    columns = ['UPC', 'IMAGES LINK'] + (['CATEGORY'] if categories else [])
+    if path.suffix.lower() == ".xlsx":
+        import pandas as pd
+        pd.DataFrame(rows, columns=columns).to_excel(path, index=False)
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    return path
+
+
+def _process_tree_rss(root_pid):
+    """Resident memory of a process and all its descendants, in bytes (Linux)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after the last ")"
+        fields = stat[stat.rfind(")") + 2:].split()
+        parents.setdefault(int(fields[1]), []).append(int(entry))
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        pending.extend(parents.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except OSError:
+            pass
+    return total
+
+
+def read_journal(output_dir):
+    """Per-item durations and state counts from a run's journal"""
+    conn = sqlite3.connect(str(Path(output_dir) / ".journal.sqlite"))
+    try:
+        durations = [d for (d,) in conn.execute("SELECT duration FROM rows WHERE state = 'done' AND duration IS NOT NULL")]
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM rows GROUP BY state").fetchall())
+    finally:
+        conn.close()
+    return durations, counts
+
+
+def run_main(sheet, output_dir, threads, extra_args=(), sample_interval=0.2):
+    """
+    Run main.py once and measure it.
+
+    Returns:
+        Dict with wall time, peak RSS and the journal's durations and counts
+    """
+    shutil.rmtree(output_dir, ignore_errors=True)
+    command = [sys.executable, str(Path(__file__).with_name("main.py")), str(sheet), str(output_dir),
+               "--threads", str(threads)] + list(extra_args)
+    started = time.monotonic()
+    # Answer "N" to the interactive retry prompt so failures end the run
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.stdin.write(b"N\n")
+    process.stdin.close()
+
+    peak_tree = 0
+    can_sample = sys.platform.startswith("linux")
+    while True:
+        if can_sample:
+            peak_tree = max(peak_tree, _process_tree_rss(process.pid))
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            break
+        time.sleep(sample_interval)
+    wall = time.monotonic() - started
+
+    # ru_maxrss is in KiB on Linux; it only covers main.py itself, not Chrome
+    peak = max(peak_tree, usage.ru_maxrss * 1024)
+    durations, counts = read_journal(output_dir)
+    return {
+        "threads": threads,
+        "wall": wall,
+        "exit": process.returncode,
+        "peak_rss": peak,
+        "durations": durations,
+        "counts": counts,
+    }
+
+
+def format_result(label, result):
+    finished = result["counts"].get("done", 0)
+    failed = result["counts"].get("failed", 0)
+    p50, p95, p99 = (percentile(result["durations"], p) for p in (50, 95, 99))
+
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "-"
+    return (f"{label:<16} {finished:>6} {failed:>6} {result['wall']:>8.1f} "
+            f"{finished / result['wall'] if result['wall'] else 0:>8.2f} "
+            f"{ms(p50):>7} {ms(p95):>7} {ms(p99):>7} {result['peak_rss'] / (1024 * 1024):>8.0f}")
+
+
+HEADER = (f"{'Run':<16} {'Done':>6} {'Failed':>6} {'Wall s':>8} {'Items/s':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'RSS MB':>8}")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def check_resolver(config, base_url, folders=10):
+    """
+    Resolve stand-in folders in every page style with the HTML resolver and
+    compare with the first card of the rendered grid: the card the stand-in
+    puts first and, when Chrome can be started, what resolve_first_file
+    reads from the live page. Styles the resolver cannot read must fall
+    back (return None) rather than guess.
+
+    Returns:
+        Number of mismatches
+    """
+    from download_dropbox import launch_chrome, resolve_first_file, to_download_url
+    from html_resolver import HtmlResolver
+
+    resolver = HtmlResolver()
+    driver = None
+    try:
+        driver = launch_chrome(tempfile.mkdtemp(prefix="chrome-check-"), log=lambda msg: None, profile="lean")
+    except Exception as e:
+        print(f"⊘ Chrome not available ({type(e).__name__}); comparing with the stand-in's own first card only")
+
+    mismatches = 0
+    try:
+        for style in PAGE_STYLES:
+            config.page_style = style
+            agreed = fallbacks = 0
+            for n in range(folders):
+                url = f"{base_url}/scl/fo/c{n}/F{n}?rlkey=bench&dl=0"
+                expected = (f"F{n}_1.jpg", to_download_url(f"{base_url}/scl/fi/c{n}/F{n}_1.jpg?rlkey=bench&dl=0"))
+                if driver is not None:
+                    expected = resolve_first_file(driver, url, log=lambda msg: None)
+                got = resolver.resolve(url, log=lambda msg: None)
+                if got is None:
+                    fallbacks += 1
+                elif got == expected:
+                    agreed += 1
+                else:
+                    mismatches += 1
+                    print(f"✗ {style}: {url} resolved to {got[0]}, the grid shows {expected[0]} first")
+            mark = "✓" if agreed + fallbacks == folders else "✗"
+            print(f"{mark} {style:<7} {agreed}/{folders} read from HTML, {fallbacks} left to Chrome")
+    finally:
+        resolver.close()
+        if driver is not None:
+            driver.quit()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark main.py against a local Dropbox stand-in server',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__[__doc__.index("Examples:"):]
+    )
+    parser.add_argument('--items', type=int, default=100, help='Rows in the synthetic sheet (default: 100)')
+    parser.add_argument('--threads', type=_int_list, default=[1, 2, 4], metavar='N,N,...',
+                       help='Thread counts to benchmark (default: 1,2,4)')
+    parser.add_argument('--downloads', type=_int_list, default=[8], metavar='N,N,...',
+                       help='--downloads values to benchmark with the http engine (default: 8)')
+    parser.add_argument('--engine', choices=['browser', 'http'], default='browser',
+                       help='Engine passed to main.py (default: browser)')
+    parser.add_argument('--folders', type=float, default=1.0, metavar='RATIO',
+                       help='Share of rows linking a folder rather than a file (default: 1.0)')
+    parser.add_argument('--duplicates', type=float, default=0.0, metavar='RATIO',
+                       help='Share of rows repeating an earlier link (default: 0)')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help='Sheet format (default: csv)')
+    parser.add_argument('--size', type=int, default=200, metavar='KB', help='File size served (default: 200)')
+    parser.add_argument('--latency', type=float, default=50, metavar='MS', help='Added latency per request (default: 50)')
+    parser.add_argument('--bandwidth', type=int, default=0, metavar='KB/S',
+                       help='Per-transfer bandwidth limit, 0 for unlimited (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar='RATIO',
+                       help='Share of requests answered with 429/500/503 (default: 0)')
+    parser.add_argument('--render-ms', type=int, default=100, help='Delay before the folder grid appears (default: 100)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the sheet and errors (default: 1)')
+    parser.add_argument('--page-style', choices=PAGE_STYLES, default='script',
+                       help='How folder pages deliver their file list (default: script)')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Only run the stand-in server on PORT')
+    parser.add_argument('--check-resolver', action='store_true',
+                       help='Check that the HTML resolver picks the same first file as the rendered grid, then exit')
+    parser.add_argument('--report', metavar='FILE', help='Also append the results table to FILE')
+    parser.add_argument('main_args', nargs=argparse.REMAINDER,
+                       help='Extra arguments for main.py, after "--" (e.g. -- --dedupe off)')
+    args = parser.parse_args()
+
+    config = StandInConfig(
+        file_size=args.size * 1024,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024,
+        error_rate=args.error_rate,
+        render_ms=args.render_ms,
+        seed=args.seed,
+        page_style=args.page_style,
+    )
+    server, base_url = start_server(config, port=args.serve or 0)
+
+    if args.check_resolver:
+        try:
+            mismatches = check_resolver(config, base_url)
+        finally:
+            server.shutdown()
+        sys.exit(1 if mismatches else 0)
+
+    if args.serve:
+        print(f"📋 Stand-in server on {base_url} (Ctrl+C to stop)")
+        print(f"   Folder: {base_url}/scl/fo/k1/F1?rlkey=bench&dl=0")
+        print(f"   File:   {base_url}/scl/fi/k1/F1_1.jpg?rlkey=bench&dl=1")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    extra_args = [a for a in args.main_args if a != "--"]
+    work_dir = Path(tempfile.mkdtemp(prefix="dropbox-bench-"))
+    lines = []
+    try:
+        sheet = write_sheet(work_dir / f"bench.{args.format}", base_url, args.items,
+                            folder_ratio=args.folders, duplicate_ratio=args.duplicates, seed=args.seed)
+        print(f"📋 {args.items} rows, {args.size} KB files, {args.latency:.0f} ms latency, "
+              f"{args.error_rate:.0%} errors, engine={args.engine}")
+        print(HEADER)
+        lines.append(HEADER)
+
+        downloads = args.downloads if args.engine == "http" else [None]
+        for threads in args.threads:
+            for download_slots in downloads:
+                run_args = ["--engine", args.engine] + extra_args
+                label = f"threads={threads}"
+                if download_slots is not None:
+                    run_args += ["--downloads", str(download_slots)]
+                    label += f" dl={download_slots}"
+                result = run_main(sheet, work_dir / "out", threads, run_args)
+                line = format_result(label, result)
+                if result["exit"] not in (0, None):
+                    line += f"  (exit {result['exit']})"
+                print(line)
+                lines.append(line)
+
+        print(f"\nServer: {config.requests} requests, {config.errors} injected errors")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.report:
+        with open(args.report, "a") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {' '.join(sys.argv[1:])}\n")
+            f.write("\n".join(lines) + "\n\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Content-addressed store of downloaded files, shared by every UPC that uses them"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from fileops import link_or_copy
+
+# Hash used for blob names; HttpDownloader computes it while streaming
+HASH_NAME = "sha256"
+
+# Unlinked blobs younger than this are left alone by prune(): another
+# process may have stored one and not linked it into place yet
+PRUNE_MIN_AGE = 3600
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Hex digest of a file's contents"""
+    digest = hashlib.new(HASH_NAME)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Keep each distinct file once under <output>/.blobs/<ab>/<hash> and place
+    it at <category>/<UPC><ext> as a hardlink.
+
+    An index (SQLite, so shard processes can share it) maps hash -> size and
+    when the blob was stored. A download whose hash is already stored is
+    dropped instead of written again, in this run or any later one.
+
+    Hardlinks share their contents: editing a placed file in place changes
+    the blob too, as with --dedupe link. On filesystems without hardlinks
+    the file is reflinked or copied instead.
+
+    A blob goes away with the last file linked to it: when place() replaces
+    a file or a caller release()s one that is about to be deleted, and in
+    prune() for files deleted outside the tool.
+    """
+    def __init__(self, output_dir):
+        self.root = Path(output_dir) / ".blobs"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.stored = 0
+        self.reused = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def blob_path(self, digest):
+        return self.root / digest[:2] / digest
+
+    def _known(self, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return row is not None and self.blob_path(digest).exists()
+
+    def _record(self, digest, size):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (hash, size, stored_at) VALUES (?, ?, ?)",
+                (digest, size, time.time()),
+            )
+            self._conn.commit()
+
+    def _forget(self, digest):
+        self.blob_path(digest).unlink(missing_ok=True)
+        with self._lock:
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            self._conn.commit()
+
+    def release(self, path, digest=None):
+        """
+        Remove the blob behind a placed file that is about to be replaced or
+        deleted, if that file is the only one still linked to it.
+
+        Args:
+            path: Placed file
+            digest: Its hex digest, if known (it is hashed otherwise)
+
+        Returns:
+            True if a blob was removed
+        """
+        try:
+            placed = os.stat(path)
+        except FileNotFoundError:
+            return False
+        # The blob and this file, nothing else (a copy or reflink has 1)
+        if placed.st_nlink != 2:
+            return False
+        digest = digest or hash_file(path)
+        try:
+            blob = self.blob_path(digest).stat()
+        except FileNotFoundError:
+            return False
+        if (blob.st_ino, blob.st_dev) != (placed.st_ino, placed.st_dev):
+            return False
+        self._forget(digest)
+        return True
+
+    def _hardlinks_work(self):
+        probe = self.root / f".probe-{uuid.uuid4().hex[:8]}"
+        try:
+            probe.touch()
+            os.link(probe, probe.with_suffix(".link"))
+            probe.with_suffix(".link").unlink()
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.unlink(missing_ok=True)
+
+    def prune(self):
+        """
+        Remove blobs no placed file links to any more (their files were
+        deleted or replaced outside the tool). Only where hardlinks work:
+        otherwise every placed file is a copy and each blob looks unused.
+
+        Returns:
+            Number of blobs removed
+        """
+        if not self._hardlinks_work():
+            return 0
+        with self._lock:
+            digests = [digest for (digest,) in self._conn.execute("SELECT hash FROM blobs")]
+        cutoff = time.time() - PRUNE_MIN_AGE
+        removed = 0
+        for digest in digests:
+            try:
+                blob = self.blob_path(digest).stat()
+            except FileNotFoundError:
+                self._forget(digest)
+                continue
+            if blob.st_nlink == 1 and blob.st_mtime < cutoff:
+                self._forget(digest)
+                removed += 1
+        return removed
+
+    def place(self, downloaded_file, final_path, digest=None):
+        """
+        Store a finished download and link it into place.
+
+        Args:
+            downloaded_file: File in a temp directory; it is moved or deleted
+            final_path: Where the file should appear; replaced if it exists
+            digest: Hex digest if already computed while downloading
+
+        Returns:
+            Tuple of (final path, True if the contents were already stored)
+        """
+        downloaded_file = Path(downloaded_file)
+        digest = digest or hash_file(downloaded_file)
+        size = downloaded_file.stat().st_size
+        blob = self.blob_path(digest)
+        reused = self._known(digest)
+        if reused:
+            downloaded_file.unlink()
+        else:
+            blob.parent.mkdir(exist_ok=True)
+            # Another process may store the same bytes at the same time; either copy is fine
+            os.replace(downloaded_file, blob)
+            self._record(digest, size)
+
+        final_path = Path(final_path)
+        temp_path = final_path.with_name(f".{final_path.name}.{uuid.uuid4().hex[:8]}")
+        link_or_copy(blob, temp_path)
+        # The file being replaced may have been the last one using its blob
+        self.release(final_path)
+        os.replace(temp_path, final_path)
+        with self._lock:
+            if reused:
+                self.reused += 1
+                self.bytes_saved += size
+            else:
+                self.stored += 1
+        return final_path, reused
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
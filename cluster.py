@@ -0,0 +1,373 @@
+"""
+Coordinator / worker mode: one process hands out leases on batches of rows
+over HTTP, any number of worker processes (on any machine) download them.
+
+Protocol (JSON over HTTP POST):
+  /lease      {"worker", "max"}           -> {"lease", "items", "lease_timeout"}
+                                              or {"items": [], "wait": s} / {"done": true}
+  /report     {"lease", "results": [...]} -> {"ok": true}
+  /heartbeat  {"leases": [...]}           -> {"ok": true}
+  GET /status                             -> row counts
+
+A lease that is not reported on or kept alive with heartbeats within
+`lease_timeout` seconds expires, and its unfinished rows are handed out
+again. Reports are idempotent: the first result for a row wins.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+from journal import DONE, SKIPPED, FAILED
+from pipeline import Item
+
+
+def _item_to_dict(item):
+    return {"index": item.index, "upc": item.upc, "url": item.url, "category": item.category}
+
+
+class Coordinator:
+    """
+    Lease rows of one sheet to workers and collect their results.
+
+    Rows are kept as light (index, UPC, link, category) Items; the full row
+    data lives in the journal, which also records every result so the
+    coordinator can be restarted with --resume.
+
+    Args:
+        journal: Journal for the run (rows are added to it as they load)
+        stats: DownloadStats updated as results arrive
+        progress_bar: Optional tqdm bar advanced per result
+        batch_size: Rows per lease unless the worker asks for fewer
+        lease_timeout: Seconds before an unreported lease is re-issued
+    """
+    def __init__(self, journal, stats, progress_bar=None, batch_size=50, lease_timeout=300):
+        self.journal = journal
+        self.stats = stats
+        self.progress_bar = progress_bar
+        self.batch_size = batch_size
+        self.lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._leases = {}  # lease id -> {"worker", "expires", "items": {index: Item}}
+        self._owner = {}  # row index -> id of the lease it is out on
+        self._finished = set()
+        self._loaded = False
+        self._workers = {}  # worker name -> [told we are done, last seen]
+        self.finished = threading.Event()
+        self.reissued = 0
+
+    def _write(self, msg):
+        if self.progress_bar is not None:
+            self.progress_bar.write(msg)
+        else:
+            print(msg)
+
+    def load(self, items):
+        """Queue rows for leasing, recording them in the journal as pending"""
+        for item in items:
+            with self._lock:
+                self.journal.add_pending(item)
+                self._pending.append(Item(item.index, item.upc, item.url, item.category))
+        with self._lock:
+            self.journal.commit()
+            self._loaded = True
+            self._check_finished()
+
+    def _expire(self, now):
+        for lease_id, lease in list(self._leases.items()):
+            if lease["expires"] > now:
+                continue
+            del self._leases[lease_id]
+            unfinished = [item for index, item in lease["items"].items() if index not in self._finished]
+            for item in unfinished:
+                self._owner.pop(item.index, None)
+            if unfinished:
+                self.reissued += len(unfinished)
+                self._write(f"🔄 Lease from {lease['worker']} expired, re-issuing {len(unfinished)} rows")
+                self._pending.extendleft(reversed(unfinished))
+
+    def _check_finished(self):
+        if self._loaded and not self._pending and not self._leases:
+            self.finished.set()
+
+    def lease(self, worker, max_items=None):
+        now = time.monotonic()
+        with self._lock:
+            self._workers[worker] = [self._workers.get(worker, [False])[0], now]
+            self._expire(now)
+            batch = {}
+            limit = min(max_items or self.batch_size, self.batch_size)
+            while self._pending and len(batch) < limit:
+                item = self._pending.popleft()
+                if item.index not in self._finished:
+                    batch[item.index] = item
+                    self.journal.mark_running(item)
+            if not batch:
+                self._check_finished()
+                if self.finished.is_set():
+                    self._workers[worker][0] = True
+                    return {"done": True}
+                # Rows are still out on other leases and may come back
+                return {"items": [], "wait": 2}
+            lease_id = uuid.uuid4().hex
+            for index in batch:
+                self._owner[index] = lease_id
+            self._leases[lease_id] = {"worker": worker, "expires": now + self.lease_timeout, "items": batch}
+            return {
+                "lease": lease_id,
+                "lease_timeout": self.lease_timeout,
+                "items": [_item_to_dict(item) for item in batch.values()],
+            }
+
+    def report(self, lease_id, results):
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is not None:
+                lease["expires"] = now + self.lease_timeout
+            for result in results:
+                index = result["index"]
+                # The row may have been re-issued to another lease meanwhile
+                owner = self._leases.get(self._owner.pop(index, None))
+                item = owner["items"].pop(index, None) if owner is not None else None
+                if index in self._finished:
+                    continue
+                if item is None:
+                    item = Item(index, result.get("upc"), result.get("url"))
+                state = result["state"]
+                self._finished.add(index)
+                self.journal.mark_finished(item, state, result.get("error"))
+                if state == DONE:
+                    self.stats.add_completed()
+                elif state == SKIPPED:
+                    self.stats.add_skipped()
+                elif state == FAILED:
+                    self.stats.add_failed(item.upc, item.url, result.get("error") or "Failed")
+                if self.progress_bar is not None:
+                    self.progress_bar.update(1)
+            for emptied in [lid for lid, open_lease in self._leases.items() if not open_lease["items"]]:
+                del self._leases[emptied]
+            self._check_finished()
+        return {"ok": True}
+
+    def heartbeat(self, lease_ids):
+        expires = time.monotonic() + self.lease_timeout
+        with self._lock:
+            for lease_id in lease_ids:
+                if lease_id in self._leases:
+                    self._leases[lease_id]["expires"] = expires
+        return {"ok": True}
+
+    def status(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "leased": sum(len(lease["items"]) for lease in self._leases.values()),
+                "finished": len(self._finished),
+                "reissued": self.reissued,
+                "workers": len(self._workers),
+            }
+
+    def all_workers_told(self):
+        """True once every worker still alive has been told the run is over"""
+        cutoff = time.monotonic() - self.lease_timeout
+        with self._lock:
+            return all(told or last_seen < cutoff for told, last_seen in self._workers.values())
+
+    def serve(self, port, items, host="0.0.0.0", linger=15):
+        """
+        Load items and serve the lease API until every row has a result.
+        Leasing starts while the sheet is still loading. Keeps answering for
+        up to `linger` seconds afterwards so polling workers learn the run
+        is over.
+        """
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    return self._reply(coordinator.status())
+                self._reply({"error": "not found"}, 404)
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    if self.path == "/lease":
+                        reply = coordinator.lease(payload.get("worker", "unknown"), payload.get("max"))
+                    elif self.path == "/report":
+                        reply = coordinator.report(payload["lease"], payload.get("results", []))
+                    elif self.path == "/heartbeat":
+                        reply = coordinator.heartbeat(payload.get("leases", []))
+                    else:
+                        return self._reply({"error": "not found"}, 404)
+                except (KeyError, ValueError) as e:
+                    return self._reply({"error": f"bad request: {e}"}, 400)
+                self._reply(reply)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name="coordinator", daemon=True)
+        thread.start()
+        try:
+            self.load(items)
+            while not self.finished.wait(1):
+                with self._lock:
+                    self._expire(time.monotonic())
+                    self._check_finished()
+            deadline = time.monotonic() + linger
+            while time.monotonic() < deadline and not self.all_workers_told():
+                time.sleep(0.5)
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.journal.commit()
+
+
+class CoordinatorClient:
+    """Worker-side client for the coordinator's lease API"""
+    def __init__(self, url, worker=None, timeout=30):
+        self.url = url.rstrip("/")
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self.http = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=10, read=timeout),
+            retries=urllib3.Retry(total=5, backoff_factor=1, allowed_methods=None),
+        )
+
+    def _post(self, path, payload):
+        response = self.http.request(
+            "POST", self.url + path, body=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        if response.status >= 400:
+            raise RuntimeError(f"Coordinator answered {response.status} to {path}: {response.data[:200]!r}")
+        return json.loads(response.data)
+
+    def lease(self, max_items=None):
+        return self._post("/lease", {"worker": self.worker, "max": max_items})
+
+    def report(self, lease_id, results):
+        return self._post("/report", {"lease": lease_id, "results": results})
+
+    def heartbeat(self, lease_ids):
+        return self._post("/heartbeat", {"leases": lease_ids})
+
+
+class LeaseReporter:
+    """
+    Journal stand-in for a worker's pipeline: results are buffered and sent
+    to the coordinator in the background, and open leases are kept alive
+    with heartbeats while their rows are still being worked on.
+    """
+    def __init__(self, client, flush_interval=2.0):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.lease_timeout = None
+        self._lock = threading.Lock()
+        self._lease_of = {}  # row index -> lease id
+        self._open = collections.Counter()  # lease id -> rows not yet reported
+        self._results = collections.defaultdict(list)
+        self._last_heartbeat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-reporter", daemon=True)
+        self._thread.start()
+
+    def add_lease(self, lease_id, items, lease_timeout):
+        with self._lock:
+            self.lease_timeout = lease_timeout
+            for item in items:
+                self._lease_of[item.index] = lease_id
+            self._open[lease_id] += len(items)
+
+    def is_finished(self, item):
+        return False
+
+    def mark_running(self, item):
+        pass
+
+    def mark_retry(self, item, error):
+        pass
+
+    def mark_finished(self, item, state, error=None):
+        with self._lock:
+            lease_id = self._lease_of.pop(item.index, None)
+            if lease_id is None:
+                return
+            self._results[lease_id].append({"index": item.index, "upc": item.upc, "url": item.url,
+                                            "state": state, "error": error})
+            self._open[lease_id] -= 1
+            if self._open[lease_id] <= 0:
+                del self._open[lease_id]
+
+    def commit(self):
+        """Send every buffered result now"""
+        with self._lock:
+            results, self._results = self._results, collections.defaultdict(list)
+            heartbeat = []
+            if self.lease_timeout and time.monotonic() - self._last_heartbeat > self.lease_timeout / 3:
+                heartbeat = list(self._open)
+                self._last_heartbeat = time.monotonic()
+        try:
+            for lease_id in list(results):
+                self.client.report(lease_id, results[lease_id])
+                del results[lease_id]
+            if heartbeat:
+                self.client.heartbeat(heartbeat)
+        finally:
+            if results:
+                # Not delivered; keep them for the next attempt
+                with self._lock:
+                    for lease_id, lease_results in results.items():
+                        self._results[lease_id][:0] = lease_results
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.commit()
+            except Exception:
+                pass  # Coordinator unreachable for now; results stay buffered
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.commit()
+
+
+async def leased_items(client, reporter, batch_size=None, log=print):
+    """
+    Async generator of Items leased from the coordinator; ends when the
+    coordinator reports that every row has a result.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        reply = await loop.run_in_executor(None, client.lease, batch_size)
+        if reply.get("done"):
+            return
+        if not reply.get("items"):
+            await asyncio.sleep(reply.get("wait", 2))
+            continue
+        items = [Item(d["index"], d["upc"], d["url"], d.get("category")) for d in reply["items"]]
+        reporter.add_lease(reply["lease"], items, reply.get("lease_timeout"))
+        log(f"📋 Leased {len(items)} rows")
+        for item in items:
+            yield item
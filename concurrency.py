@@ -0,0 +1,135 @@
+"""AIMD concurrency limits for pipeline stages, tuned from latency and error signals"""
+
+import asyncio
+import math
+import time
+
+from errors import classify
+
+
+def is_overload(error):
+    """True for errors that suggest too much concurrency: timeouts and rate limits"""
+    return classify(error).overload
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class AdaptiveLimit:
+    """
+    asyncio concurrency limit whose size follows AIMD (additive increase,
+    multiplicative decrease), like TCP congestion control.
+
+    Use `async with limit:` around a stage and call record() with each
+    operation's latency and error before leaving the block. Every window
+    of `limit` completions is judged:
+
+    - any timeout / 429 / rate-limit page: the limit is halved at once
+      (at most once per window, so one burst counts as one signal)
+    - failure rate <= `max_failure_rate` and p95 latency within
+      `latency_factor` x the best p95 seen so far: the limit grows by one
+    - anything else: the limit holds
+
+    With adaptive=False this is a plain fixed-size limit. Changes are kept
+    in `history` as (seconds since start, new limit, reason).
+    """
+    def __init__(self, name, maximum, start=None, minimum=1, adaptive=True,
+                 max_failure_rate=0.1, latency_factor=2.0, min_window=4):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.adaptive = adaptive
+        self.limit = maximum if not adaptive else max(self.minimum, min(maximum, start or max(1, maximum // 4)))
+        self.max_failure_rate = max_failure_rate
+        self.latency_factor = latency_factor
+        self.min_window = min_window
+        self.in_use = 0
+        self.started = time.monotonic()
+        self.history = [(0.0, self.limit, "start")]
+        self.best_p95 = None
+        self._window = []
+        self._cut_this_window = False
+        self._condition = None
+
+    async def __aenter__(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.in_use -= 1
+            self._condition.notify_all()
+
+    def _set(self, limit, reason):
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self.limit:
+            self.limit = limit
+            self.history.append((time.monotonic() - self.started, limit, reason))
+
+    def record(self, latency, error=None):
+        """Feed one finished operation into the controller"""
+        if not self.adaptive:
+            return
+        overload = error is not None and is_overload(error)
+        self._window.append((latency, error is not None))
+        if overload and not self._cut_this_window:
+            self._cut_this_window = True
+            self._set(self.limit // 2, classify(error).kind)
+
+        if len(self._window) < max(self.limit, self.min_window):
+            return
+        latencies = [lat for lat, failed in self._window if not failed]
+        failure_rate = sum(1 for _, failed in self._window if failed) / len(self._window)
+        p95 = percentile(latencies, 95)
+        if p95 is not None and (self.best_p95 is None or p95 < self.best_p95):
+            self.best_p95 = p95
+        healthy = (
+            not self._cut_this_window
+            and failure_rate <= self.max_failure_rate
+            and p95 is not None
+            and p95 <= self.best_p95 * self.latency_factor
+        )
+        if healthy:
+            self._set(self.limit + 1, "healthy")
+        self._window = []
+        self._cut_this_window = False
+
+    def mean_limit(self):
+        """Time-weighted average limit since start"""
+        now = time.monotonic() - self.started
+        if now <= 0:
+            return float(self.limit)
+        total = 0.0
+        for (at, limit, _), (next_at, _, _) in zip(self.history, self.history[1:] + [(now, None, None)]):
+            total += limit * (next_at - at)
+        return total / now
+
+    def summary_lines(self, max_changes=12):
+        """Lines describing how the limit moved, for the run summary"""
+        lines = [f"  {self.name:<9} start {self.history[0][1]}, final {self.limit}, "
+                 f"max {max(limit for _, limit, _ in self.history)}/{self.maximum}, "
+                 f"mean {self.mean_limit():.1f}"]
+        changes = self.history[1:]
+        if changes:
+            shown = changes if len(changes) <= max_changes else changes[:max_changes // 2] + [None] + changes[-max_changes // 2:]
+            steps = []
+            for change in shown:
+                if change is None:
+                    steps.append("...")
+                    continue
+                at, limit, reason = change
+                minutes, seconds = divmod(int(at), 60)
+                note = "" if reason == "healthy" else f" ({reason})"
+                steps.append(f"{minutes}:{seconds:02d}→{limit}{note}")
+            lines.append("    " + ", ".join(steps))
+        return lines
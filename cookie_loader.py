@@ -1,87 +1,244 @@
 """Cookie and storage loading utilities for Selenium WebDriver"""
 
 import json
+import os
+import threading
 
 
-def load_json_cookies(driver, cookie_file):
-    """Load cookies from JSON format file into Selenium driver"""
-    with open(cookie_file, "r") as f:
-        cookies = json.load(f)
-    
+# Parsed session files by path, reused while the file is unchanged
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+def _read_json_cached(path):
+    """
+    Parse a JSON file once and reuse the result until its size or mtime
+    changes. Missing files raise FileNotFoundError as usual.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _parsed_lock:
+        cached = _parsed.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    with open(path, "r") as f:
+        data = json.load(f)
+    with _parsed_lock:
+        _parsed[path] = (key, data)
+    return data
+
+
+# Chrome extension exports use these sameSite names; CDP wants the others
+_SAME_SITE = {"no_restriction": "None", "none": "None", "lax": "Lax", "strict": "Strict"}
+
+
+def to_cdp_cookie(cookie):
+    """
+    Convert one exported cookie to a CDP Network.CookieParam.
+
+    Raises:
+        ValueError: If Chrome would reject the cookie (no name, value or
+            domain); one bad cookie must not fail a whole Network.setCookies
+    """
+    if not isinstance(cookie, dict) or not isinstance(cookie.get("name"), str) or not isinstance(cookie.get("value"), str):
+        raise ValueError("cookie has no name or value")
+    domain = cookie.get("domain") or ""
+    if not isinstance(domain, str) or not domain.lstrip("."):
+        raise ValueError(f"cookie {cookie['name']} has no domain")
+    path = cookie.get("path") or "/"
+    param = {
+        "name": cookie["name"],
+        "value": cookie["value"],
+        "path": path,
+        "secure": cookie.get("secure", False),
+        "httpOnly": cookie.get("httpOnly", False),
+    }
+    if cookie["name"].startswith("__Host-") or cookie.get("hostOnly", False):
+        # Host-only cookies are set through a URL so no domain attribute is stored
+        scheme = "https" if param["secure"] or cookie["name"].startswith("__Host-") else "http"
+        param["url"] = f"{scheme}://{domain.lstrip('.')}{path}"
+    else:
+        param["domain"] = domain
+    if cookie.get("expirationDate"):
+        param["expires"] = float(cookie["expirationDate"])
+    same_site = _SAME_SITE.get(str(cookie.get("sameSite", "")).lower())
+    # Chrome refuses SameSite=None without Secure; leave it to the browser default instead
+    if same_site and not (same_site == "None" and not param["secure"]):
+        param["sameSite"] = same_site
+    return param
+
+
+def set_cookies(driver, cookies, log=print):
+    """
+    Put a whole cookie jar into Chrome with one Network.setCookies call.
+    Works before the browser has visited the cookies' site.
+
+    Cookies Chrome would reject are skipped and logged. If the bulk call
+    still fails, each cookie is set on its own with Network.setCookie so
+    the rest of the jar gets in.
+
+    Returns:
+        Number of cookies set
+    """
+    params = []
     for cookie in cookies:
         try:
-            # Build cookie dict with required fields
-            cookie_dict = {
-                "name": cookie["name"],
-                "value": cookie["value"],
-                "path": cookie.get("path", "/"),
-                "secure": cookie.get("secure", False),
-            }
-            
-            # __Host- and __Secure- prefixed cookies have special requirements
-            # __Host- cookies must NOT have a domain attribute
-            # For other cookies, include domain if not hostOnly
-            if cookie["name"].startswith("__Host-"):
-                # Do not add domain for __Host- cookies
-                pass
-            elif cookie.get("hostOnly", False):
-                # For hostOnly cookies, don't set domain (let browser infer it)
-                pass
-            else:
-                # Regular cookies can have domain
-                cookie_dict["domain"] = cookie["domain"]
-            
-            # Add optional fields if present
-            if "expirationDate" in cookie and cookie["expirationDate"]:
-                # Convert to int, handling float timestamps
-                cookie_dict["expiry"] = int(cookie["expirationDate"])
-            
-            if "httpOnly" in cookie:
-                cookie_dict["httpOnly"] = cookie["httpOnly"]
-            
-            # Remove sameSite to avoid compatibility issues
-            # Selenium can be picky about sameSite values
-            
-            driver.add_cookie(cookie_dict)
-            
+            params.append(to_cdp_cookie(cookie))
+        except ValueError as e:
+            log(f"⊘ Skipped cookie: {e}")
+    if not params:
+        return 0
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": params})
+        return len(params)
+    except Exception as e:
+        log(f"⚠ Setting all cookies at once failed ({e}), setting them one by one")
+    count = 0
+    for param in params:
+        try:
+            result = driver.execute_cdp_cmd("Network.setCookie", param)
         except Exception as e:
-            print(f"Error loading cookie '{cookie.get('name', 'unknown')}': {e}")
+            log(f"⊘ Skipped cookie {param['name']}: {e}")
             continue
+        if result.get("success", True):
+            count += 1
+        else:
+            log(f"⊘ Skipped cookie {param['name']}: Chrome did not accept it")
+    return count
 
 
-def load_local_storage(driver, storage_file):
-    """Load local storage from JSON file into Selenium driver"""
+def load_json_cookies(driver, cookie_file):
+    """Load cookies from JSON format file into Selenium driver"""
+    cookies = _read_json_cached(cookie_file)
+    try:
+        count = set_cookies(driver, cookies)
+    except Exception as e:
+        print(f"Error loading cookies: {e}")
+        return
+    print(f"Loaded {count} cookies")
+
+
+# Sets every key of a storage map in one round trip; values that are not
+# strings are stored as JSON, like the page itself would have written them
+_STORAGE_SCRIPT = """
+const [items, session] = arguments;
+const storage = session ? window.sessionStorage : window.localStorage;
+for (const [key, value] of Object.entries(items)) {
+    storage.setItem(key, typeof value === "string" ? value : JSON.stringify(value));
+}
+return Object.keys(items).length;
+"""
+
+
+def _load_storage(driver, storage_file, session, label):
     try:
-        with open(storage_file, "r") as f:
-            local_storage = json.load(f)
-        
-        for key, value in local_storage.items():
-            # Escape single quotes in key and value to prevent JS injection issues
-            safe_key = key.replace("'", "\\'")
-            safe_value = str(value).replace("'", "\\'")
-            driver.execute_script(f"window.localStorage.setItem('{safe_key}', '{safe_value}');")
-        
-        print(f"Loaded {len(local_storage)} local storage items")
+        items = _read_json_cached(storage_file)
+        count = driver.execute_script(_STORAGE_SCRIPT, items, session)
+        print(f"Loaded {count} {label} items")
     except FileNotFoundError:
-        print(f"Local storage file not found: {storage_file}")
+        print(f"{label.capitalize()} file not found: {storage_file}")
     except Exception as e:
-        print(f"Error loading local storage: {e}")
+        print(f"Error loading {label}: {e}")
+
+
+def load_local_storage(driver, storage_file):
+    """Load local storage from JSON file into Selenium driver"""
+    _load_storage(driver, storage_file, False, "local storage")
 
 
 def load_session_storage(driver, storage_file):
     """Load session storage from JSON file into Selenium driver"""
+    _load_storage(driver, storage_file, True, "session storage")
+
+
+def read_session(cookie_file="cookies.txt", local_storage_file="localstorage.json",
+                 session_storage_file="sessionstorage.json"):
+    """
+    Parsed session files as {"cookies", "local", "session"}; missing or
+    invalid files give empty values. Cached in memory between calls.
+    """
+    session = {}
+    for key, path, empty in (("cookies", cookie_file, []), ("local", local_storage_file, {}),
+                             ("session", session_storage_file, {})):
+        try:
+            session[key] = _read_json_cached(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            session[key] = empty
+    return session
+
+
+# Seeds storage on every new Dropbox document, without overwriting keys the
+# page has set since
+_SEED_STORAGE_SCRIPT = """
+(() => {
+    if (!/(^|\\.)dropbox\\.com$/.test(location.hostname)) return;
+    const seed = %s;
+    for (const [name, items] of [["localStorage", seed.local], ["sessionStorage", seed.session]]) {
+        const storage = window[name];
+        for (const [key, value] of Object.entries(items)) {
+            if (storage.getItem(key) === null) {
+                storage.setItem(key, typeof value === "string" ? value : JSON.stringify(value));
+            }
+        }
+    }
+})();
+"""
+
+
+def inject_session(driver, session, log=print):
+    """
+    Give a freshly launched Chrome the exported session without loading a
+    page first: one CDP call for all cookies and one that seeds local and
+    session storage as soon as a Dropbox page starts loading.
+
+    Args:
+        driver: Chrome WebDriver
+        session: Dict from read_session()
+        log: Callable for cookies that were skipped
+
+    Returns:
+        Number of cookies set
+    """
+    count = set_cookies(driver, session["cookies"], log=log) if session["cookies"] else 0
+    if session["local"] or session["session"]:
+        seed = json.dumps({"local": session["local"], "session": session["session"]})
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument",
+                               {"source": _SEED_STORAGE_SCRIPT % seed})
+    return count
+
+
+def read_json_cookies(cookie_file):
+    """
+    Read cookies from a JSON export without a browser.
+    Returns an empty list if the file is missing or not valid JSON.
+    """
     try:
-        with open(storage_file, "r") as f:
-            session_storage = json.load(f)
-        
-        for key, value in session_storage.items():
-            # Escape single quotes in key and value to prevent JS injection issues
-            safe_key = key.replace("'", "\\'")
-            safe_value = str(value).replace("'", "\\'")
-            driver.execute_script(f"window.sessionStorage.setItem('{safe_key}', '{safe_value}');")
-        
-        print(f"Loaded {len(session_storage)} session storage items")
-    except FileNotFoundError:
-        print(f"Session storage file not found: {storage_file}")
-    except Exception as e:
-        print(f"Error loading session storage: {e}")
+        cookies = _read_json_cached(cookie_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+    return [c for c in cookies if isinstance(c, dict) and "name" in c and "value" in c]
+
+
+def cookie_header(cookies, host, secure=True):
+    """
+    Build a Cookie header value for requests to the given host.
+    Applies the same domain rules a browser would: host-only cookies must
+    match exactly, domain cookies match the domain and its subdomains.
+    """
+    host = host.lower()
+    pairs = []
+    for cookie in cookies:
+        if cookie.get("secure", False) and not secure:
+            continue
+        domain = cookie.get("domain", "").lower()
+        if not domain:
+            continue
+        if cookie.get("hostOnly", False) or cookie["name"].startswith("__Host-"):
+            matches = host == domain.lstrip(".")
+        else:
+            domain = domain.lstrip(".")
+            matches = host == domain or host.endswith("." + domain)
+        if matches:
+            pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
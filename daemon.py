@@ -0,0 +1,405 @@
+"""
+Serve mode: keep browsers, HTTP connections, the resolution cache and the
+output index warm in one long-running process, and download jobs
+submitted over a local HTTP API or dropped into an inbox directory.
+
+API (JSON over HTTP):
+  POST /jobs       {"sheet": "/path/to/sheet.xlsx"}
+                   or {"rows": [{"upc", "url", "category"}, ...]}  -> the new job
+  GET  /jobs                                                       -> every job, newest first
+  GET  /jobs/<id>                                                  -> one job with its failures
+  GET  /status                                                     -> queue and warm resource counters
+
+Inbox: a sheet (any input format) or a .json list of rows dropped into the
+inbox becomes a job. When the job ends the file is moved to inbox/done/,
+with the job as <name>.result.json next to it; files that cannot be read
+go to inbox/failed/.
+"""
+
+import asyncio
+import collections
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from pipeline import Item
+from row_source import RowSource, RowSourceError, SUPPORTED_SUFFIXES, clean_value
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+ERROR = "error"
+
+# Finished jobs kept for GET /jobs; older ones are forgotten
+KEEP_JOBS = 500
+
+# Failed rows listed per job; the rest are only counted
+JOB_FAILURES = 100
+
+
+def rows_to_items(rows):
+    """
+    Items from a list of row dicts. Keys may be upc/url/category or the
+    sheet headers UPC / IMAGES LINK / CATEGORY.
+
+    Raises:
+        ValueError: If it is not a list of rows, a row lacks a UPC or link,
+            or a value is not a string or number
+    """
+    if not isinstance(rows, list):
+        raise ValueError("rows must be a list")
+    items = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise ValueError(f"row {index} is not an object")
+        for key in ("upc", "UPC", "url", "IMAGES LINK", "category", "CATEGORY"):
+            value = row.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+                raise ValueError(f"row {index}: {key} must be a string or number")
+        upc = clean_value(row.get("upc", row.get("UPC")))
+        url = clean_value(row.get("url", row.get("IMAGES LINK")))
+        if not upc or not url:
+            raise ValueError(f"row {index} needs a upc and a url")
+        category = clean_value(row.get("category", row.get("CATEGORY")))
+        items.append(Item(index, upc, url, category, row_data=row))
+    return items
+
+
+class Job:
+    """
+    One submitted sheet or row list, and its progress.
+
+    Stands in for the progress bar of the pipeline running it: update()
+    counts finished rows and write() passes messages on, tagged with the
+    job id.
+    """
+    def __init__(self, stats, sheet=None, items=None, name=None, log=print, quiet=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.stats = stats
+        self.sheet = sheet
+        self.items = items
+        self.name = name or (Path(sheet).name if sheet else f"{len(items)} rows")
+        self.state = QUEUED
+        self.error = None
+        self.total = len(items) if items is not None else None
+        self.finished = 0
+        self.failures = []
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self.source_file = None  # inbox file the job came from
+        self._log = log
+        self._quiet = quiet
+
+    def rows(self):
+        """Items of the job; a sheet is opened and read lazily"""
+        if self.items is not None:
+            return iter(self.items)
+        source = RowSource(self.sheet)
+        self.total = source.total_hint
+        return iter(source)
+
+    def update(self, n=1):
+        self.finished += n
+
+    def write(self, msg):
+        if msg.startswith("✗ ") and len(self.failures) < JOB_FAILURES:
+            self.failures.append(msg[2:])
+        if not self._quiet:
+            self._log(f"[{self.id}] {msg}")
+
+    def set_postfix(self, refresh=True, **counts):
+        pass
+
+    def to_dict(self, details=False):
+        stats = self.stats
+        job = {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "error": self.error,
+            "total": self.total,
+            "finished": self.finished,
+            "completed": stats.completed,
+            "skipped": stats.skipped,
+            "failed": stats.failed,
+            "retried": sum(stats.retried.values()),
+            "created": self.created,
+            "started": self.started,
+            "ended": self.ended,
+        }
+        if details:
+            job["failed_kinds"] = stats.failed_kinds
+            # With --quiet the pipeline writes nothing; fall back to the stats' sample
+            job["failures"] = self.failures or [f"{f['upc']}: {f['error']}" for f in stats.failures]
+        return job
+
+
+class JobEvents:
+    """EventLog wrapper that tags every event with a job id"""
+    def __init__(self, events, job_id):
+        self.events = events
+        self.job_id = job_id
+
+    def emit(self, event, **fields):
+        self.events.emit(event, job=self.job_id, **fields)
+
+
+class JobServer:
+    """
+    Run submitted jobs one at a time over a shared, long-lived RunResources.
+
+    Jobs queue in submission order. Each gets its own Pipeline and
+    DownloadStats, while browsers, connection pools, caches, the blob
+    store and the output index carry over from job to job. After an idle
+    spell the output index is rescanned before the next job, so files
+    removed meanwhile are downloaded again.
+
+    Args:
+        resources: Open RunResources for the output directory
+        new_stats: Callable returning a fresh DownloadStats
+        inbox: Optional directory watched for dropped-in jobs
+        poll_interval: Seconds between inbox scans
+        rescan_after: Idle seconds after which the output index is rescanned
+        log: Callable for messages
+        quiet: Do not print a line per row
+    """
+    def __init__(self, resources, new_stats, inbox=None, poll_interval=2.0, rescan_after=300, log=print, quiet=False):
+        self.resources = resources
+        self.new_stats = new_stats
+        self.inbox = Path(inbox) if inbox else None
+        self.poll_interval = poll_interval
+        self.rescan_after = rescan_after
+        self.log = log
+        self.quiet = quiet
+        self.started = time.time()
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+        self._current = None
+        self._idle_since = time.monotonic()
+
+    def submit(self, sheet=None, rows=None, name=None, source_file=None):
+        """
+        Queue a job; safe to call from any thread once serve() is running.
+
+        Raises:
+            ValueError: If the sheet is missing or unsupported, the rows are
+                malformed, or the sheet or name is not a string
+        """
+        if sheet is not None and not isinstance(sheet, (str, Path)):
+            raise ValueError("sheet must be a path")
+        if name is not None and not isinstance(name, str):
+            raise ValueError("name must be a string")
+        if sheet is not None:
+            sheet = Path(sheet).expanduser()
+            if sheet.suffix.lower() not in SUPPORTED_SUFFIXES:
+                raise ValueError(f"input must be one of: {', '.join(SUPPORTED_SUFFIXES)}")
+            if not sheet.is_file():
+                raise ValueError(f"input file not found: {sheet}")
+            job = Job(self.new_stats(), sheet=str(sheet.resolve()), name=name, log=self.log, quiet=self.quiet)
+        elif rows is not None:
+            job = Job(self.new_stats(), items=rows_to_items(rows), name=name, log=self.log, quiet=self.quiet)
+        else:
+            raise ValueError("a job needs a sheet or rows")
+        job.source_file = source_file
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [jid for jid, j in self._jobs.items() if j.state in (FINISHED, ERROR)]
+            for jid in finished[:max(0, len(finished) - KEEP_JOBS)]:
+                del self._jobs[jid]
+        self.log(f"📋 Job {job.id} queued: {job.name}")
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def status(self):
+        jobs = self.jobs()
+        counts = collections.Counter(job.state for job in jobs)
+        return {
+            "uptime": round(time.time() - self.started),
+            "queued": counts[QUEUED],
+            "running": self._current.id if self._current else None,
+            "finished": counts[FINISHED],
+            "errors": counts[ERROR],
+            "indexed_files": len(self.resources.index),
+            "resources": self.resources.counters(),
+        }
+
+    async def _run_job(self, job):
+        resources = self.resources
+        if time.monotonic() - self._idle_since > self.rescan_after:
+            await asyncio.get_running_loop().run_in_executor(None, resources.index.scan)
+        job.state = RUNNING
+        job.started = time.time()
+        self._current = job
+        self.log(f"🔄 Job {job.id} started: {job.name}")
+        events = JobEvents(resources.events, job.id) if resources.events is not None else None
+        try:
+            def rows():
+                for item in job.rows():
+                    job.stats.total += 1
+                    yield item
+            if events is not None:
+                events.emit("job_start", name=job.name)
+            pipeline = resources.pipeline(job.stats, job, events=events)
+            await pipeline.run(rows())
+            job.state = FINISHED
+        except RowSourceError as e:
+            job.state = ERROR
+            job.error = str(e)
+        except Exception as e:
+            job.state = ERROR
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            job.ended = time.time()
+            job.total = job.stats.total
+            self._current = None
+            self._idle_since = time.monotonic()
+            resources.commit()
+            if events is not None:
+                events.emit("job_end", state=job.state, completed=job.stats.completed,
+                            skipped=job.stats.skipped, failed=job.stats.failed)
+        stats = job.stats
+        if job.state == ERROR:
+            self.log(f"✗ Job {job.id} could not run: {job.error}")
+        else:
+            self.log(f"✓ Job {job.id} finished in {job.ended - job.started:.1f}s: {stats.completed} downloaded, "
+                     f"{stats.skipped} skipped, {stats.failed} failed")
+        if job.source_file is not None:
+            self._file_result(job)
+
+    def _file_result(self, job):
+        """Move an inbox job's file out of the way and write its result next to it"""
+        source = Path(job.source_file)
+        name = Path(source.name.split("-", 1)[-1])  # without the claim prefix
+        dest_dir = self.inbox / ("failed" if job.state == ERROR else "done")
+        dest_dir.mkdir(exist_ok=True)
+        dest = dest_dir / name.name
+        if dest.exists():
+            dest = dest_dir / f"{name.stem}-{job.id}{name.suffix}"
+        try:
+            source.replace(dest)
+            (dest_dir / f"{dest.name}.result.json").write_text(json.dumps(job.to_dict(details=True), indent=2))
+        except OSError as e:
+            self.log(f"⚠ Could not move {source.name} out of the inbox: {e}")
+
+    def _scan_inbox(self, seen):
+        """
+        Submit inbox files that have not changed since the last scan.
+        `seen` maps file name -> (size, mtime) from the previous scan, so a
+        file still being written is left for the next one.
+        """
+        claimed = self.inbox / ".claimed"
+        current = {}
+        for path in sorted(self.inbox.iterdir()):
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            if path.suffix.lower() not in SUPPORTED_SUFFIXES + [".json"]:
+                continue
+            stat = path.stat()
+            current[path.name] = (stat.st_size, stat.st_mtime)
+            if seen.get(path.name) != current[path.name]:
+                continue
+            # Claim it so the next scan does not submit it again
+            target = claimed / f"{uuid.uuid4().hex[:8]}-{path.name}"
+            path.replace(target)
+            try:
+                if target.suffix.lower() == ".json":
+                    self.submit(rows=json.loads(target.read_text()), name=path.name, source_file=target)
+                else:
+                    self.submit(sheet=target, name=path.name, source_file=target)
+            except (ValueError, TypeError) as e:
+                self.log(f"✗ {path.name}: {e}")
+                failed = self.inbox / "failed"
+                failed.mkdir(exist_ok=True)
+                target.replace(failed / path.name)
+        return current
+
+    async def _watch_inbox(self):
+        claimed = self.inbox / ".claimed"
+        claimed.mkdir(parents=True, exist_ok=True)
+        # Jobs claimed by a server that stopped before they ended run again
+        for path in claimed.iterdir():
+            path.replace(self.inbox / path.name.split("-", 1)[-1])
+        loop = asyncio.get_running_loop()
+        seen = {}
+        while True:
+            try:
+                seen = await loop.run_in_executor(None, self._scan_inbox, seen)
+            except OSError as e:
+                self.log(f"⚠ Could not scan the inbox: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _start_http(self, port, host):
+        server_ref = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0].rstrip("/")
+                if path == "/status":
+                    return self._reply(server_ref.status())
+                if path == "/jobs":
+                    return self._reply({"jobs": [job.to_dict() for job in server_ref.jobs()]})
+                if path.startswith("/jobs/"):
+                    job = server_ref.job(path[len("/jobs/"):])
+                    if job is not None:
+                        return self._reply(job.to_dict(details=True))
+                self._reply({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/jobs":
+                    return self._reply({"error": "not found"}, 404)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(payload, dict):
+                        raise ValueError("expected a JSON object")
+                    job = server_ref.submit(sheet=payload.get("sheet"), rows=payload.get("rows"),
+                                            name=payload.get("name"))
+                except (ValueError, TypeError) as e:
+                    return self._reply({"error": f"bad request: {e}"}, 400)
+                self._reply(job.to_dict(), 202)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="job-api", daemon=True).start()
+        return server
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve the API (and watch the inbox) and run jobs until cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        server = self._start_http(port, host)
+        watcher = asyncio.create_task(self._watch_inbox()) if self.inbox else None
+        try:
+            while True:
+                job = await self._queue.get()
+                await self._run_job(job)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            server.shutdown()
+            server.server_close()
@@ -10,38 +10,43 @@ import time
 from pathlib import Path
 import os
 import argparse
+import shutil
 import sys
 from tqdm import tqdm
+from download_events import drain_events, has_download_events, wait_for_download_events, InotifyWatcher
+from metrics import metrics
+from errors import (ChromeLaunchError, GridTimeoutError, NoCardsError, DownloadTimeoutError,
+                    RateLimitedError, AuthExpiredError, classify)
 
-def download_first_file(url, output_dir, debug=False, use_alt_method=False, user_data_dir="/tmp/chrome-debug", progress_bar=None, file_label=""):
+# Requests blocked while resolving folders with the lean profile. Only the
+# grid DOM is needed, so thumbnails, fonts, media and analytics are dropped.
+# File downloads come from dl.dropboxusercontent.com and are never matched.
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.png?*", "*.jpg", "*.jpg?*", "*.jpeg", "*.jpeg?*", "*.gif", "*.gif?*", "*.webp", "*.webp?*", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.mp3",
+    "*previews.dropboxusercontent.com*", "*/thumbnail*", "*/get_thumbnail*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*bing.com*",
+    "*linkedin.com*", "*twitter.com*", "*demdex.net*", "*adsrvr.org*",
+]
+
+
+def build_chrome_options(user_data_dir, output_dir=None, log=print, profile="full"):
     """
-    Download the first file from a Dropbox shared folder.
+    Build the Chrome options shared by every download session.
     
     Args:
-        url: Dropbox shared folder URL
-        output_dir: Directory to save the downloaded file
-        debug: If True, print verbose debug messages
-        use_alt_method: If True, use button-click method instead of URL-based download
         user_data_dir: Chrome user data directory for session persistence
-        progress_bar: Optional tqdm progress bar instance
-        file_label: Label for the file being downloaded (e.g., UPC)
+        output_dir: Optional initial download directory
+        log: Callable used for warnings
+        profile: "full" renders pages normally; "lean" uses the eager
+            page-load strategy, a smaller window and no image rendering,
+            which is all folder resolution needs
         
     Returns:
-        Path to downloaded file or None if failed
+        Configured selenium Options instance
     """
-    def log(msg):
-        if debug:
-            if progress_bar:
-                progress_bar.write(msg)
-            else:
-                print(msg)
-    
-    def update_progress(msg):
-        """Update progress bar description"""
-        if progress_bar:
-            progress_bar.set_description(f"{file_label}: {msg}")
-    
-    # Set up Chrome options
     chrome_options = Options()
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     
@@ -59,7 +64,12 @@ def download_first_file(url, output_dir, debug=False, use_alt_method=False, user
     chrome_options.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
     chrome_options.add_argument("--disable-gpu")  # Disable GPU hardware acceleration
     chrome_options.add_argument("--disable-software-rasterizer")
-    chrome_options.add_argument("--window-size=1920,1080")  # Set window size for headless
+    if profile == "lean":
+        chrome_options.page_load_strategy = "eager"  # Return at DOMContentLoaded
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--window-size=1280,800")
+    else:
+        chrome_options.add_argument("--window-size=1920,1080")  # Set window size for headless
     chrome_options.add_argument("--disable-extensions")
     chrome_options.add_argument("--disable-dev-tools")
     chrome_options.add_argument("--remote-debugging-port=0")  # Use random port to avoid conflicts
@@ -67,49 +77,158 @@ def download_first_file(url, output_dir, debug=False, use_alt_method=False, user
     # Use unique user data directory to prevent conflicts between threads
     chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
     
-    # Configure download directory and preferences
-    output_path = Path(output_dir).resolve()
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    chrome_options.add_experimental_option("prefs", {
-        "download.default_directory": str(output_path),
+    # Configure download preferences
+    prefs = {
         "download.prompt_for_download": False,
         "safebrowsing.enabled": True,
-    })
+    }
+    if profile == "lean":
+        prefs["profile.managed_default_content_settings.images"] = 2
+    if output_dir:
+        output_path = Path(output_dir).resolve()
+        output_path.mkdir(parents=True, exist_ok=True)
+        prefs["download.default_directory"] = str(output_path)
+    chrome_options.add_experimental_option("prefs", prefs)
     
     # Suppress Selenium logs
     chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
     
+    # Log page-level DevTools events so download completion can be read from them
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False, "enablePage": True})
+    
+    return chrome_options
+
+
+def launch_chrome(user_data_dir, output_dir=None, log=print, max_retries=3, profile="full"):
+    """
+    Start a headless Chrome instance, retrying failed launches.
+    
+    Args:
+        user_data_dir: Chrome user data directory for session persistence
+        output_dir: Optional initial download directory
+        log: Callable used for progress and warning messages
+        max_retries: Number of launch attempts before giving up
+        profile: "full" or "lean", see build_chrome_options
+        
+    Returns:
+        selenium WebDriver instance
+        
+    Raises:
+        ChromeLaunchError: If every attempt failed
+    """
+    chrome_options = build_chrome_options(user_data_dir, output_dir, log=log, profile=profile)
+    
     # Set up Chrome service with explicit log configuration
     service = Service()
     service.log_path = os.devnull  # Suppress ChromeDriver logs
     
-    driver = None
-    max_retries = 3
     for attempt in range(max_retries):
         try:
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            break
+            with metrics.timer("chrome_launch"):
+                return webdriver.Chrome(service=service, options=chrome_options)
         except Exception as e:
             if attempt < max_retries - 1:
                 log(f"Chrome launch attempt {attempt + 1} failed, retrying...")
                 time.sleep(2)  # Wait before retry
             else:
                 log(f"Failed to launch Chrome after {max_retries} attempts: {e}")
-                raise
+                raise ChromeLaunchError(f"Chrome failed to start after {max_retries} attempts: {e}") from e
+
+
+def block_heavy_resources(driver, enabled=True):
+    """
+    Block (or stop blocking) LEAN_BLOCKED_URLS in a running browser.
+    Enabled while resolving folders, disabled again before downloading.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS if enabled else []})
+
 
+def set_download_dir(driver, output_dir, behavior="allow"):
+    """
+    Point an already running Chrome instance at a new download directory.
+    
+    Chrome only reads the download preference at launch, so reused drivers
+    switch directories through the DevTools protocol instead. With
+    behavior="allowAndName" files are saved under their download GUID.
+    """
+    output_path = Path(output_dir).resolve()
+    output_path.mkdir(parents=True, exist_ok=True)
+    driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+        "behavior": behavior,
+        "downloadPath": str(output_path),
+        "eventsEnabled": True,
+    })
+    return output_path
+
+
+def to_download_url(preview_url):
+    """Turn a file preview link (dl=0) into its direct download link (dl=1)"""
+    if 'dl=0' in preview_url:
+        return preview_url.replace('dl=0', 'dl=1')
+    if 'dl=1' in preview_url:
+        return preview_url
+    separator = '&' if '?' in preview_url else '?'
+    return f"{preview_url}{separator}dl=1"
+
+
+# Text Dropbox shows instead of the folder when links are being throttled
+RATE_LIMIT_MARKERS = ("too many requests", "generating too much traffic", "error (429)")
+
+
+def is_rate_limit_page(driver):
+    """Check whether the current page is Dropbox's rate-limit notice"""
     try:
-        update_progress("Loading page")
-        log(f"Navigating to: {url}")
-        driver.get(url)
+        text = (driver.title + " " + driver.find_element(By.TAG_NAME, "body").text).lower()
+    except Exception:
+        return False
+    return any(marker in text for marker in RATE_LIMIT_MARKERS)
+
+
+def is_login_page(driver):
+    """Check whether Dropbox redirected to its login page"""
+    try:
+        return "/login" in driver.current_url
+    except Exception:
+        return False
+
 
-        update_progress("Waiting for content")
-        log("Waiting for Dropbox grid to load...")
-        WebDriverWait(driver, 60).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, '[data-testid="sl-grid-body"]'))
-        )
+def find_first_card(driver, url, log=print, update_progress=lambda msg: None):
+    """
+    Open a Dropbox shared folder and locate the first file card in the grid.
+    
+    Args:
+        driver: Running WebDriver instance
+        url: Dropbox shared folder URL
+        log: Callable used for debug messages
+        update_progress: Callable used for short status updates
         
-        # Handle cookie consent banner if present
+    Returns:
+        Tuple of (card element, file name, preview URL). The name and URL are
+        "unknown" and None when the card has no readable link.
+    """
+    update_progress("Loading page")
+    log(f"Navigating to: {url}")
+    with metrics.timer("page_load"):
+        driver.get(url)
+
+    update_progress("Waiting for content")
+    log("Waiting for Dropbox grid to load...")
+    with metrics.timer("grid_wait"):
+        try:
+            WebDriverWait(driver, 60).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, '[data-testid="sl-grid-body"]'))
+            )
+        except TimeoutException as e:
+            if is_rate_limit_page(driver):
+                raise RateLimitedError("Dropbox is rate limiting this link") from e
+            if is_login_page(driver):
+                raise AuthExpiredError("Dropbox asked to log in; refresh the session with setup_session.py") from e
+            raise GridTimeoutError("The folder's file grid did not load within 60s") from e
+
+    # Handle cookie consent banner if present
+    with metrics.timer("cookie_wait"):
         try:
             log("Checking for cookie consent banner...")
             consent_btn = WebDriverWait(driver, 5).until(
@@ -120,19 +239,23 @@ def download_first_file(url, output_dir, debug=False, use_alt_method=False, user
             time.sleep(1)
         except TimeoutException:
             log("No cookie banner detected")
-        
-        # Locate the first file card
-        update_progress("Locating file")
-        log("Locating the first file in the grid...")
+
+    # Locate the first file card
+    update_progress("Locating file")
+    log("Locating the first file in the grid...")
+    with metrics.timer("card_lookup"):
         grid = driver.find_element(By.CSS_SELECTOR, '[data-testid="sl-grid-body"]')
-        
+
         # Wait for at least one card to appear
-        WebDriverWait(driver, 10).until(
-            lambda d: len(grid.find_elements(By.CSS_SELECTOR, 'li._sl-card_to1nz_25')) > 0
-        )
-        
+        try:
+            WebDriverWait(driver, 10).until(
+                lambda d: len(grid.find_elements(By.CSS_SELECTOR, 'li._sl-card_to1nz_25')) > 0
+            )
+        except TimeoutException as e:
+            raise NoCardsError("The folder has no files") from e
+
         first_card = grid.find_elements(By.CSS_SELECTOR, 'li._sl-card_to1nz_25')[0]
-        
+
         # Get file name and link for logging
         try:
             file_link = first_card.find_element(By.CSS_SELECTOR, '[data-testid="grid-link"]')
@@ -143,90 +266,261 @@ def download_first_file(url, output_dir, debug=False, use_alt_method=False, user
             file_name = "unknown"
             preview_url = None
             log("First file found (name could not be retrieved)")
+    
+    return first_card, file_name, preview_url
+
+
+def resolve_first_file(driver, url, log=print, update_progress=lambda msg: None):
+    """
+    Work out which file comes first in a shared folder without downloading it.
+    
+    Returns:
+        Tuple of (file name, direct download URL)
         
-        # Download using URL-based method or button click
-        update_progress("Starting download")
-        if use_alt_method:
-            # Button-click method (alternative)
-            log("Using button-click download method...")
-            
-            # Hover over the card to reveal download controls
-            log("Hovering over file card to reveal download button...")
-            ActionChains(driver).move_to_element(first_card).pause(0.5).perform()
-            
-            # Wait for and click the download button
-            log("Clicking download button...")
+    Raises:
+        NoCardsError: If the folder is empty or the first card has no usable link
+    """
+    _, file_name, preview_url = find_first_card(driver, url, log, update_progress)
+    if not preview_url:
+        raise NoCardsError("First file link could not be read")
+    return file_name, to_download_url(preview_url)
+
+
+def wait_for_download(output_path, initial_files, log=print, update_progress=lambda msg: None, stall_timeout=60):
+    """
+    Wait for Chrome to finish a download into output_path.
+    
+    Args:
+        output_path: Download directory being watched
+        initial_files: Names of files present before the download started
+        log: Callable used for debug messages
+        update_progress: Callable used for short status updates
+        stall_timeout: Seconds without the partial file growing before
+            giving up; slow downloads that keep progressing are not cut off
+        
+    Returns:
+        Path to the new file, or None if the download stalled
+    """
+    update_progress("Downloading")
+    log("Waiting for download to complete...")
+    start_time = time.time()
+    last_progress = start_time
+    last_size = -1
+    
+    while time.time() - last_progress < stall_timeout:
+        elapsed = int(time.time() - start_time)
+        
+        # Check if any .crdownload files exist (Chrome's in-progress download extension)
+        crdownload_files = list(output_path.glob("*.crdownload"))
+        if crdownload_files:
+            # Try to get file size for progress indication
             try:
-                download_btn = WebDriverWait(first_card, 10).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, './/button[.//svg[@aria-label="Download"]]')
-                    )
-                )
-                download_btn.click()
-            except ElementClickInterceptedException:
-                # Fallback to JavaScript click if regular click is intercepted
-                log("Regular click intercepted, using JavaScript click...")
-                download_btn = first_card.find_element(By.XPATH, './/button[.//svg[@aria-label="Download"]]')
-                driver.execute_script("arguments[0].click();", download_btn)
-            
-            log(f"Download initiated for: {file_name}")
-        else:
-            # URL-based download: replace dl=0 with dl=1 (default)
-            log("Using URL-based download method...")
-            download_url = preview_url.replace('dl=0', 'dl=1')
-            log(f"Navigating to download URL: {download_url}")
-            driver.get(download_url)
-            log(f"Download initiated for: {file_name}")
+                size = crdownload_files[0].stat().st_size
+                if size > last_size:
+                    last_size = size
+                    last_progress = time.time()
+                update_progress(f"Downloading ({size / (1024 * 1024):.1f} MB, {elapsed}s)")
+            except:
+                update_progress(f"Downloading ({elapsed}s)")
+            log("Download in progress...")
+            time.sleep(1)
+            continue
+        
+        # Check if any new files were downloaded
+        current_files = set(f.name for f in output_path.iterdir() if f.is_file())
+        new_files = current_files - initial_files
+        
+        if new_files:
+            downloaded_file = output_path / list(new_files)[0]
+            update_progress("Complete")
+            log(f"Download complete: {downloaded_file}")
+            return downloaded_file
         
-        # Wait for download to complete
-        update_progress("Downloading")
-        log("Waiting for download to complete...")
-        timeout = 120
-        start_time = time.time()
-        downloaded_file = None
+        time.sleep(1)
+    
+    update_progress("Timeout")
+    log(f"Download stalled - no progress for {stall_timeout}s")
+    return None
+
+
+def run_download(driver, output_dir, start_download, log=print, update_progress=lambda msg: None, stall_timeout=60):
+    """
+    Trigger a download with start_download() and wait until it finishes.
+    
+    Completion is taken from Chrome's DevTools download events once the
+    driver has been seen logging them for an earlier download (the file is
+    saved under its GUID, then renamed to the suggested name). Until then
+    inotify is used on Linux, and directory polling everywhere else, and
+    the events logged meanwhile decide how the next download is waited on.
+    Each waits as long as the download keeps progressing and gives up after
+    `stall_timeout` seconds without progress.
+    
+    Returns:
+        Path to the downloaded file, or None if the download stalled
+    """
+    drain_events(driver)
+    if has_download_events(driver):
+        output_path = set_download_dir(driver, output_dir, behavior="allowAndName")
+        start_download()
+        return wait_for_download_events(driver, output_path, log, update_progress, stall_timeout)
+    
+    output_path = set_download_dir(driver, output_dir)
+    try:
+        if InotifyWatcher.available():
+            with InotifyWatcher(output_path) as watcher:
+                start_download()
+                return watcher.wait(log, update_progress, stall_timeout)
         
-        # Get initial file list
         initial_files = set(f.name for f in output_path.iterdir() if f.is_file())
+        start_download()
+        return wait_for_download(output_path, initial_files, log, update_progress, stall_timeout)
+    finally:
+        # Did this download log events? If so, the next one waits on them
+        drain_events(driver)
+
+
+def fetch_with_browser(driver, download_url, output_dir, log=print, update_progress=lambda msg: None):
+    """
+    Download a direct (dl=1) link with a running browser.
+    
+    Returns:
+        Path to the downloaded file
         
-        while time.time() - start_time < timeout:
-            elapsed = int(time.time() - start_time)
-            
-            # Check if any .crdownload files exist (Chrome's in-progress download extension)
-            crdownload_files = list(output_path.glob("*.crdownload"))
-            if crdownload_files:
-                # Try to get file size for progress indication
+    Raises:
+        DownloadTimeoutError: If the download stops making progress
+    """
+    def start_download():
+        log(f"Navigating to download URL: {download_url}")
+        driver.get(download_url)
+    
+    downloaded_file = run_download(driver, output_dir, start_download, log, update_progress)
+    if downloaded_file is None:
+        raise DownloadTimeoutError("Download stopped making progress")
+    return downloaded_file
+
+
+def download_first_file(url, output_dir, debug=False, use_alt_method=False, user_data_dir="/tmp/chrome-debug", progress_bar=None, file_label="", driver=None):
+    """
+    Download the first file from a Dropbox shared folder.
+    
+    Args:
+        url: Dropbox shared folder URL
+        output_dir: Directory to save the downloaded file
+        debug: If True, print verbose debug messages
+        use_alt_method: If True, use button-click method instead of URL-based download
+        user_data_dir: Chrome user data directory for session persistence
+        progress_bar: Optional tqdm progress bar instance
+        file_label: Label for the file being downloaded (e.g., UPC)
+        driver: Optional running WebDriver to reuse. When given, the browser
+            is left open and user_data_dir is ignored.
+        
+    Returns:
+        Path to downloaded file or None if failed
+    """
+    def log(msg):
+        if debug:
+            if progress_bar:
+                progress_bar.write(msg)
+            else:
+                print(msg)
+    
+    def update_progress(msg):
+        """Update progress bar description"""
+        if progress_bar:
+            progress_bar.set_description(f"{file_label}: {msg}")
+    
+    owns_driver = driver is None
+    if owns_driver:
+        driver = launch_chrome(user_data_dir, output_dir, log=log)
+
+    try:
+        first_card, file_name, preview_url = find_first_card(driver, url, log, update_progress)
+        
+        # Download using URL-based method or button click
+        update_progress("Starting download")
+        if use_alt_method:
+            def start_download():
+                # Button-click method (alternative)
+                log("Using button-click download method...")
+                
+                # Hover over the card to reveal download controls
+                log("Hovering over file card to reveal download button...")
+                ActionChains(driver).move_to_element(first_card).pause(0.5).perform()
+                
+                # Wait for and click the download button
+                log("Clicking download button...")
                 try:
-                    size_mb = crdownload_files[0].stat().st_size / (1024 * 1024)
-                    update_progress(f"Downloading ({size_mb:.1f} MB, {elapsed}s)")
-                except:
-                    update_progress(f"Downloading ({elapsed}s)")
-                log("Download in progress...")
-                time.sleep(1)
-                continue
-            
-            # Check if any new files were downloaded
-            current_files = set(f.name for f in output_path.iterdir() if f.is_file())
-            new_files = current_files - initial_files
-            
-            if new_files:
-                downloaded_file = output_path / list(new_files)[0]
-                update_progress("Complete")
-                log(f"Download complete: {downloaded_file}")
-                break
-            
-            time.sleep(1)
+                    download_btn = WebDriverWait(first_card, 10).until(
+                        EC.element_to_be_clickable(
+                            (By.XPATH, './/button[.//svg[@aria-label="Download"]]')
+                        )
+                    )
+                    download_btn.click()
+                except ElementClickInterceptedException:
+                    # Fallback to JavaScript click if regular click is intercepted
+                    log("Regular click intercepted, using JavaScript click...")
+                    download_btn = first_card.find_element(By.XPATH, './/button[.//svg[@aria-label="Download"]]')
+                    driver.execute_script("arguments[0].click();", download_btn)
+                
+                log(f"Download initiated for: {file_name}")
         else:
-            update_progress("Timeout")
-            log("Download timeout - file may still be downloading")
-            return None
+            def start_download():
+                # URL-based download: replace dl=0 with dl=1 (default)
+                log("Using URL-based download method...")
+                download_url = to_download_url(preview_url)
+                log(f"Navigating to download URL: {download_url}")
+                driver.get(download_url)
+                log(f"Download initiated for: {file_name}")
         
-        return downloaded_file
+        # Start the download and wait for it to complete
+        return run_download(driver, output_dir, start_download, log, update_progress)
 
     except Exception as e:
-        log(f"Error during download: {str(e)}")
+        log(f"Error during download ({classify(e).kind}): {str(e)}")
         return None
     finally:
-        driver.quit()
+        if owns_driver:
+            driver.quit()
+
+
+def measure_resolve(url, runs=3, debug=False):
+    """
+    Compare the full and lean page profiles on one shared folder.
+    
+    Each profile gets its own browser and resolves the folder `runs` times.
+    Bytes are summed from the page's resource timing entries, so blocked
+    requests count as zero.
+    
+    Returns:
+        Dict of profile -> (average seconds, average bytes transferred)
+    """
+    def log(msg):
+        if debug:
+            print(msg)
+    
+    results = {}
+    for profile in ("full", "lean"):
+        user_data_dir = f"/tmp/chrome-measure-{profile}"
+        driver = launch_chrome(user_data_dir, log=log, profile=profile)
+        try:
+            if profile == "lean":
+                block_heavy_resources(driver)
+            timings = []
+            transferred = []
+            for _ in range(runs):
+                driver.get("about:blank")
+                start = time.time()
+                resolve_first_file(driver, url, log=log)
+                timings.append(time.time() - start)
+                transferred.append(driver.execute_script(
+                    "return performance.getEntries()"
+                    ".reduce((total, e) => total + (e.transferSize || 0), 0);"
+                ) or 0)
+            results[profile] = (sum(timings) / runs, sum(transferred) / runs)
+        finally:
+            driver.quit()
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+    return results
 
 
 def main():
@@ -240,8 +534,21 @@ def main():
                        help='Enable verbose debug output')
     parser.add_argument('--output', default='downloads',
                        help='Output directory for downloaded files (default: downloads)')
+    parser.add_argument('--measure', type=int, metavar='RUNS', default=0,
+                       help='Instead of downloading, time folder resolution with the full and lean page profiles')
     args = parser.parse_args()
     
+    if args.measure:
+        results = measure_resolve(args.url, runs=args.measure, debug=args.debug)
+        print(f"{'Profile':<8} {'Avg resolve':>12} {'Avg transferred':>16}")
+        for profile, (seconds, size) in results.items():
+            print(f"{profile:<8} {seconds:>11.2f}s {size / 1024:>13.0f} KB")
+        full, lean = results["full"], results["lean"]
+        if full[0]:
+            print(f"\nLean profile: {100 * (1 - lean[0] / full[0]):.0f}% less time, "
+                  f"{100 * (1 - lean[1] / full[1]) if full[1] else 0:.0f}% fewer bytes")
+        return
+    
     result = download_first_file(
         url=args.url,
         output_dir=args.output,
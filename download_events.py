@@ -0,0 +1,210 @@
+"""Download completion signals: Chrome DevTools download events, or inotify"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+import weakref
+from pathlib import Path
+
+from errors import BrowserError
+
+# Chrome's in-progress download suffix, never a finished file
+PARTIAL_SUFFIX = ".crdownload"
+
+# Drivers that have logged Page./Browser. download events for a download
+_EVENT_DRIVERS = weakref.WeakSet()
+
+
+def _download_event(entry):
+    """(event name, params) of a download event log entry, or None"""
+    try:
+        message = json.loads(entry["message"])["message"]
+    except (KeyError, TypeError, ValueError):
+        return None
+    method = message.get("method", "")
+    if method.endswith(".downloadWillBegin") or method.endswith(".downloadProgress"):
+        return method.rsplit(".", 1)[1], message.get("params", {})
+    return None
+
+
+def drain_events(driver):
+    """
+    Discard buffered DevTools events and report whether a download event
+    (downloadWillBegin / downloadProgress) was among them.
+
+    Readable performance logs (see build_chrome_options) are not enough:
+    not every Chrome logs download events, so only a driver that has
+    actually logged one is waited on through events (see has_download_events).
+    """
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return False
+    seen = any(_download_event(entry) is not None for entry in entries)
+    if seen:
+        _EVENT_DRIVERS.add(driver)
+    return seen
+
+
+def has_download_events(driver):
+    """Whether this driver logged download events for an earlier download"""
+    return driver in _EVENT_DRIVERS
+
+
+def _download_events(driver):
+    for entry in driver.get_log("performance"):
+        event = _download_event(entry)
+        if event is not None:
+            yield event
+
+
+def wait_for_download_events(driver, output_path, log=print, update_progress=lambda msg: None, stall_timeout=60, poll_interval=0.1):
+    """
+    Wait for a download using Chrome's downloadWillBegin / downloadProgress
+    events. The download directory must have been set with the
+    "allowAndName" behavior so the file is saved under its GUID.
+
+    There is no cap on the total time: the wait only gives up after
+    `stall_timeout` seconds without any new bytes arriving.
+
+    Returns:
+        Path to the finished file, renamed to Chrome's suggested file name,
+        or None if the download stalled
+
+    Raises:
+        BrowserError: If Chrome reports the download as canceled
+    """
+    update_progress("Downloading")
+    log("Waiting for download events...")
+    guid = None
+    suggested = None
+    start_time = time.time()
+    last_progress = start_time
+    received = 0
+
+    while time.time() - last_progress < stall_timeout:
+        for event, params in _download_events(driver):
+            if event == "downloadWillBegin" and guid is None:
+                last_progress = time.time()
+                guid = params.get("guid")
+                suggested = Path(params.get("suggestedFilename") or guid).name
+                log(f"Download started: {suggested}")
+            elif event == "downloadProgress" and params.get("guid") == guid:
+                state = params.get("state")
+                if state == "completed":
+                    downloaded_file = output_path / guid
+                    final_path = output_path / suggested
+                    downloaded_file.replace(final_path)
+                    update_progress("Complete")
+                    log(f"Download complete: {final_path}")
+                    return final_path
+                if state == "canceled":
+                    raise BrowserError("Download was canceled by the browser")
+                if params.get("receivedBytes", 0) > received:
+                    received = params["receivedBytes"]
+                    last_progress = time.time()
+                update_progress(f"Downloading ({received / (1024 * 1024):.1f} MB, {int(time.time() - start_time)}s)")
+        time.sleep(poll_interval)
+
+    update_progress("Timeout")
+    log(f"Download stalled - no progress for {stall_timeout}s")
+    return None
+
+
+class InotifyWatcher:
+    """
+    Block on Linux inotify until a finished file appears in a directory.
+
+    Use as a context manager around the navigation that starts the download,
+    so no event can be missed between starting it and waiting for it.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0x00000800
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith("linux"):
+            return False
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                cls._libc.inotify_init1
+            except (OSError, AttributeError):
+                cls._libc = False
+        return bool(cls._libc)
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(str(self.path)), self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        self.fd = None
+
+    def _finished(self, name):
+        """
+        True once `name` is a real file with content and no download is
+        still in progress. Chrome may create a 0-byte placeholder under the
+        final name before the .crdownload file is renamed over it.
+        """
+        try:
+            if (self.path / name).stat().st_size == 0:
+                return False
+        except OSError:
+            return False
+        return not any(self.path.glob(f"*{PARTIAL_SUFFIX}"))
+
+    def wait(self, log=print, update_progress=lambda msg: None, stall_timeout=60):
+        """
+        Writes to the in-progress file count as progress; the wait only gives
+        up after `stall_timeout` seconds without any.
+
+        Returns:
+            Path to the first finished (non-empty, non-.crdownload) file once
+            no .crdownload is left, or None if the download stalled
+        """
+        update_progress("Downloading")
+        log("Waiting for download (inotify)...")
+        deadline = time.time() + stall_timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                update_progress("Timeout")
+                log(f"Download stalled - no progress for {stall_timeout}s")
+                return None
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                continue
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_len = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += self._EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                if mask & self.IN_MODIFY:
+                    deadline = time.time() + stall_timeout
+                    continue
+                if name and not name.endswith(PARTIAL_SUFFIX) and self._finished(name):
+                    update_progress("Complete")
+                    log(f"Download complete: {name}")
+                    return self.path / name
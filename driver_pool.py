@@ -0,0 +1,167 @@
+"""Pool of long-lived Chrome drivers shared by the download workers"""
+
+import queue
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from cookie_loader import inject_session, read_session
+from download_dropbox import launch_chrome
+from metrics import metrics
+from profile_template import TEMPLATE_DIR, prepare_profile, read_stamp
+
+
+class DriverPool:
+    """
+    Keep one Chrome instance per worker slot and reuse it across downloads.
+
+    Each slot launches its browser lazily on first use, serves many URLs and
+    is recycled after `max_uses` items or as soon as the browser stops
+    responding. Call shutdown() once all work is done.
+
+    `page_profile` is passed to launch_chrome ("lean" or "full").
+
+    When setup_session.py has saved a profile template, each slot's profile
+    is a clone of it and survives recycling and later runs, keeping the
+    session, cookie consent and HTTP cache; it is recloned only when the
+    template changes or the browser crashed. Without a template, slots get
+    an empty profile that is deleted when the browser closes.
+
+    With `inject_session`, every new browser also gets the exported session
+    (cookies.txt, localstorage.json, sessionstorage.json) through CDP before
+    its first page load.
+
+    With `debug`, launches, recycles and session injection are reported
+    through `log` (e.g. a progress bar's write, so the bar is not broken up).
+    """
+    def __init__(self, size, max_uses=50, debug=False, profile_prefix="chrome-download", page_profile="lean",
+                 template_dir=TEMPLATE_DIR, inject_session=True, log=print):
+        self.size = size
+        self.page_profile = page_profile
+        self.inject_session = inject_session
+        self.template_dir = template_dir if template_dir is not None and read_stamp(template_dir) else None
+        self.max_uses = max_uses
+        self.debug = debug
+        self.log = log
+        self.profile_prefix = profile_prefix
+        # Most recently used slot first, so a lower adaptive limit keeps
+        # reusing warm browsers instead of launching every slot
+        self._free = queue.LifoQueue()
+        for slot in range(size):
+            self._free.put(slot)
+        self._drivers = {}
+        self._uses = {}
+        self._lock = threading.Lock()
+        self.launches = 0
+        self.recycles = 0
+
+    def _log(self, msg):
+        if self.debug:
+            self.log(msg)
+
+    def profile_dir(self, slot):
+        """Chrome user data directory owned by a worker slot"""
+        return Path(tempfile.gettempdir()) / f"{self.profile_prefix}-{slot}"
+
+    def _launch(self, slot):
+        self._log(f"[pool] Launching Chrome for slot {slot}")
+        if self.template_dir is not None and prepare_profile(self.profile_dir(slot), self.template_dir):
+            self._log(f"[pool] Cloned profile template into slot {slot}")
+        driver = launch_chrome(str(self.profile_dir(slot)), log=self._log, profile=self.page_profile)
+        if self.inject_session:
+            self._inject(slot, driver)
+        with self._lock:
+            self._drivers[slot] = driver
+            self._uses[slot] = 0
+            self.launches += 1
+        return driver
+
+    def _inject(self, slot, driver):
+        session = read_session()
+        if not (session["cookies"] or session["local"] or session["session"]):
+            return
+        try:
+            with metrics.timer("session_inject"):
+                count = inject_session(driver, session, log=self._log)
+            self._log(f"[pool] Injected session into slot {slot} ({count} cookies)")
+        except Exception as e:
+            # Without the session every page is fetched logged out; say so even without -d
+            self.log(f"⚠ [pool] Could not inject session into slot {slot}: {e}")
+            return
+        if count < len(session["cookies"]):
+            self.log(f"⚠ [pool] Chrome in slot {slot} accepted {count} of {len(session['cookies'])} cookies "
+                     f"(run with -d to see which were skipped)")
+
+    def _close(self, slot, keep_profile=True):
+        with self._lock:
+            driver = self._drivers.pop(slot, None)
+            self._uses.pop(slot, None)
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception as e:
+                self._log(f"[pool] Error closing Chrome for slot {slot}: {e}")
+        if self.template_dir is None or not keep_profile:
+            shutil.rmtree(self.profile_dir(slot), ignore_errors=True)
+
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            driver.current_window_handle
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def driver(self):
+        """
+        Borrow a running driver for the duration of a with-block.
+
+        Blocks until a slot is free. The driver is checked after use and
+        relaunched on the next borrow if it crashed or hit its use limit.
+        """
+        slot = self._free.get()
+        try:
+            driver = self._drivers.get(slot) or self._launch(slot)
+            try:
+                yield driver
+            finally:
+                self._uses[slot] += 1
+                if not self._is_alive(driver):
+                    self._log(f"[pool] Chrome in slot {slot} stopped responding, recycling")
+                    self.recycles += 1
+                    # A crash can leave the profile half-written; reclone it
+                    self._close(slot, keep_profile=False)
+                elif self.max_uses and self._uses[slot] >= self.max_uses:
+                    self._log(f"[pool] Slot {slot} reached {self.max_uses} items, recycling")
+                    self.recycles += 1
+                    self._close(slot)
+        finally:
+            self._free.put(slot)
+
+    def warm(self, count=1):
+        """
+        Launch browsers for up to `count` idle slots now instead of on first
+        use. Slots that already have a browser count towards `count`.
+        """
+        slots = []
+        try:
+            while len(slots) < min(count, self.size):
+                try:
+                    slot = self._free.get_nowait()
+                except queue.Empty:
+                    break
+                slots.append(slot)
+                if slot not in self._drivers:
+                    self._launch(slot)
+        finally:
+            # Back in the order taken, so the warm slots are borrowed first
+            for slot in reversed(slots):
+                self._free.put(slot)
+
+    def shutdown(self):
+        """Quit every browser (and remove the slot profiles if not cloned)"""
+        for slot in list(self._drivers):
+            self._close(slot)
@@ -0,0 +1,92 @@
+"""Download engines: how a shared link is resolved and how its file is fetched"""
+
+from download_dropbox import resolve_first_file, fetch_with_browser, to_download_url, block_heavy_resources
+from http_download import is_file_link
+
+
+class BrowserEngine:
+    """
+    Resolve and download with pooled Chrome instances.
+
+    With an HtmlResolver, folders are first resolved from their HTML over
+    plain HTTP; Chrome renders only the pages it cannot read.
+    """
+    name = "browser"
+
+    def __init__(self, pool, html=None):
+        self.pool = pool
+        self.html = html
+
+    def resolve(self, url, log=print):
+        """
+        Find the first file behind a shared link.
+
+        Returns:
+            Tuple of (file name or None, direct download URL)
+        """
+        if is_file_link(url):
+            return None, to_download_url(url)
+        return self.resolve_html(url, log) or self.render(url, log)
+
+    def resolve_html(self, url, log=print):
+        """
+        Read a folder's first file from its HTML over plain HTTP, without a browser.
+
+        Returns:
+            Tuple of (file name, direct download URL), or None if there is
+            no HtmlResolver or the page has to be rendered
+        """
+        if self.html is None:
+            return None
+        return self.html.resolve(url, log)
+
+    def render(self, url, log=print):
+        """
+        Render a folder page in a pooled Chrome instance and read its first file.
+
+        Returns:
+            Tuple of (file name, direct download URL)
+        """
+        with self.pool.driver() as driver:
+            if self.pool.page_profile == "lean":
+                block_heavy_resources(driver, True)
+            return resolve_first_file(driver, url, log=log)
+
+    def fetch(self, download_url, dest_dir, log=print, validators=None, partial=None):
+        """
+        Download a direct link into dest_dir and return the file path.
+        Chrome cannot make conditional or ranged requests, so validators
+        and partial are ignored.
+        """
+        with self.pool.driver() as driver:
+            if self.pool.page_profile == "lean":
+                block_heavy_resources(driver, False)
+            return fetch_with_browser(driver, download_url, dest_dir, log=log)
+
+    def take_info(self, path):
+        """Content hash and HTTP validators recorded during fetch, if any"""
+        return None
+
+    def close(self):
+        self.pool.shutdown()
+        if self.html is not None:
+            self.html.close()
+
+
+class HttpEngine(BrowserEngine):
+    """Resolve with pooled Chrome instances, transfer over pooled HTTP connections"""
+    name = "http"
+
+    def __init__(self, pool, http, html=None):
+        super().__init__(pool, html)
+        self.http = http
+
+    def fetch(self, download_url, dest_dir, log=print, validators=None, partial=None):
+        return self.http.download(download_url, dest_dir, validators=validators, partial=partial)
+
+    def take_info(self, path):
+        return self.http.take_info(path)
+
+    def close(self):
+        super().close()
+        self.http.close()
@@ -0,0 +1,128 @@
+"""Classified download failures and how (and whether) to retry each kind"""
+
+import random
+
+import urllib3
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+
+class DownloadError(Exception):
+    """
+    Base class for classified download failures.
+
+    Class attributes describe the retry policy: whether the failure can
+    heal by itself (`retryable`), whether it means we are pushing Dropbox
+    too hard (`overload`), and the exponential backoff bounds in seconds.
+    """
+    kind = "unexpected"
+    retryable = True
+    overload = False
+    backoff_base = 5
+    backoff_max = 120
+
+    def backoff(self, attempt, rng=random):
+        """
+        Seconds to wait before retry number `attempt` (1-based): exponential,
+        capped, with jitter so failed items do not all come back at once.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay / 2 + rng.uniform(0, delay / 2)
+
+
+class ChromeLaunchError(DownloadError):
+    """Chrome (or chromedriver) could not be started"""
+    kind = "chrome_launch"
+    backoff_base = 10
+
+
+class BrowserError(DownloadError):
+    """The browser crashed or stopped answering mid-item"""
+    kind = "browser"
+
+
+class GridTimeoutError(DownloadError, TimeoutError):
+    """The shared folder's file grid never appeared"""
+    kind = "grid_timeout"
+    overload = True
+    backoff_base = 15
+    backoff_max = 300
+
+
+class NoCardsError(DownloadError):
+    """The folder loaded but has no file, or its first file has no link"""
+    kind = "no_cards"
+    retryable = False
+
+
+class DownloadTimeoutError(DownloadError, TimeoutError):
+    """The file transfer did not finish in time"""
+    kind = "download_timeout"
+    overload = True
+    backoff_base = 10
+    backoff_max = 300
+
+
+class NetworkError(DownloadError):
+    """Connection refused, reset or timed out below HTTP"""
+    kind = "network"
+
+
+class RateLimitedError(DownloadError):
+    """Dropbox answered with its rate-limit page instead of content"""
+    kind = "rate_limited"
+    overload = True
+    backoff_base = 60
+    backoff_max = 900
+
+
+class AuthExpiredError(DownloadError):
+    """Dropbox wants a login; the session in cookies.txt needs refreshing"""
+    kind = "auth_expired"
+    retryable = False
+
+
+# Statuses worth retrying: timeouts, rate limits and server-side errors
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class HttpError(DownloadError):
+    """Raised when a download request does not return the file"""
+    kind = "http"
+
+    def __init__(self, status, url, reason=""):
+        self.status = status
+        self.url = url
+        super().__init__(f"HTTP {status} for {url}" + (f" ({reason})" if reason else ""))
+
+    @property
+    def retryable(self):
+        return self.status in RETRYABLE_STATUSES
+
+    @property
+    def overload(self):
+        return self.status in (429, 503)
+
+    @property
+    def backoff_base(self):
+        return 60 if self.status == 429 else 5
+
+
+def classify(error):
+    """
+    Map any exception raised while processing an item to a DownloadError.
+    Already classified errors are returned unchanged.
+    """
+    if isinstance(error, DownloadError):
+        return error
+    if isinstance(error, TimeoutException):
+        classified = GridTimeoutError(error.msg or "Timed out waiting for the page")
+    elif isinstance(error, TimeoutError):
+        classified = DownloadTimeoutError(str(error) or "Download did not finish in time")
+    elif isinstance(error, (urllib3.exceptions.HTTPError, ConnectionError)):
+        classified = NetworkError(str(error))
+    elif isinstance(error, WebDriverException):
+        classified = BrowserError(error.msg or type(error).__name__)
+    else:
+        classified = DownloadError(f"{type(error).__name__}: {error}")
+    classified.__cause__ = error
+    return classified
@@ -0,0 +1,116 @@
+"""Structured run output written as it happens: a JSONL event log and a CSV of failed rows"""
+
+import csv
+import io
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+
+class BufferedWriter:
+    """
+    Append text to a file from a background thread.
+
+    write() only queues the text, so callers on the event loop never wait
+    on the disk. The thread writes whatever has queued up since its last
+    write in one append, which keeps writes few under load and the file
+    current when the run is quiet. Each append is a single O_APPEND write,
+    so shard processes can share one file without interleaving lines.
+
+    The queue is bounded: if the disk cannot keep up, write() blocks rather
+    than buffering without limit.
+    """
+    def __init__(self, path, max_pending=10000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._thread = threading.Thread(target=self._run, name=f"writer-{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        self._queue.put(text)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = [text for text in batch if text is not None]
+            data = "".join(batch).encode("utf-8")
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+
+    def close(self):
+        """Write everything still queued and close the file"""
+        self._queue.put(None)
+        self._thread.join()
+        os.close(self._fd)
+
+
+class EventLog(BufferedWriter):
+    """
+    One JSON object per line: {"time": ..., "event": ..., <fields>}.
+
+    Events written by the pipeline: "run_start", "item" (status done,
+    skipped or failed, with the message, error kind, attempts and seconds),
+    "retry" and "run_end" (the run's counters). In serve mode every event
+    carries the job id, and each job adds "job_start" and "job_end".
+    """
+    def emit(self, event, **fields):
+        record = {"time": round(time.time(), 3), "event": event}
+        record.update(fields)
+        self.write(json.dumps(record, default=str) + "\n")
+
+
+class FailureCsv:
+    """
+    Append each failed row to a CSV as soon as it fails: the input row's
+    own columns followed by ERROR and KIND, so the file can be fed back in
+    as input. An existing file is appended to and keeps its header.
+
+    Rows that fail in one pass and succeed on a later retry stay in the
+    file; --export-failed writes the final list from the journal instead.
+
+    Args:
+        path: CSV file to append to
+        columns: Input columns, used for the header of a new file
+    """
+    def __init__(self, path, columns=None):
+        self.path = Path(path)
+        self.columns = self._existing_header()
+        if self.columns is None:
+            self.columns = [c for c in (columns or ["UPC", "IMAGES LINK"]) if c not in ("ERROR", "KIND")]
+            self.columns += ["ERROR", "KIND"]
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(self.columns)
+        self._writer = BufferedWriter(self.path)
+
+    def _existing_header(self):
+        try:
+            with open(self.path, newline="", encoding="utf-8-sig") as f:
+                return next(csv.reader(f), None)
+        except OSError:
+            return None
+
+    def add(self, upc, url, error, row_data=None, kind=None):
+        row = dict(row_data) if row_data else {"UPC": upc, "IMAGES LINK": url}
+        row["ERROR"] = error
+        row["KIND"] = kind
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, self.columns, restval="", extrasaction="ignore").writerow(row)
+        self._writer.write(buffer.getvalue())
+
+    def close(self):
+        self._writer.close()
@@ -0,0 +1,89 @@
+"""Where each saved file came from and its HTTP validators, for --refresh"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class FileMetadata:
+    """
+    Sidecar record per saved file, keyed by its path relative to the output
+    directory: source link, resolved file name, download URL, ETag,
+    Last-Modified, size and content hash.
+
+    --refresh sends the stored ETag / Last-Modified back as a conditional
+    request, so only files that changed upstream are transferred again.
+    Stored in <output_dir>/.file_meta.sqlite, shared by shard processes.
+    """
+    FIELDS = ("url", "file_name", "download_url", "etag", "last_modified", "size", "digest")
+
+    def __init__(self, output_dir, commit_every=50):
+        self.root = Path(output_dir)
+        self.commit_every = commit_every
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.root / ".file_meta.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                url TEXT,
+                file_name TEXT,
+                download_url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER,
+                digest TEXT,
+                saved_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _key(self, path):
+        path = Path(path)
+        try:
+            return path.relative_to(self.root).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def get(self, path):
+        """Stored record of a saved file as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM files WHERE path = ?", (self._key(path),)
+            ).fetchone()
+        return dict(zip(self.FIELDS, row)) if row is not None else None
+
+    def put(self, path, **fields):
+        """Record (or replace) what is known about a saved file"""
+        values = [fields.get(name) for name in self.FIELDS]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO files (path, {', '.join(self.FIELDS)}, saved_at) "
+                f"VALUES (?, {', '.join('?' * len(self.FIELDS))}, ?)",
+                [self._key(path)] + values + [time.time()],
+            )
+            self._mark_dirty()
+
+    def forget(self, path):
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self._key(path),))
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._conn.commit()
+            self._pending = 0
+
+    def commit(self):
+        """Write pending records now instead of at the next batch boundary"""
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
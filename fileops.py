@@ -0,0 +1,53 @@
+"""File placement helpers: hardlink, reflink or copy a finished download"""
+
+import os
+import shutil
+import sys
+
+# ioctl request number for FICLONE on Linux (btrfs, XFS, overlay on those)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """
+    Create dst as a copy-on-write clone of src.
+    Raises OSError if the platform or filesystem does not support it.
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflink is only supported on Linux")
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def link_or_copy(src, dst, allow_hardlink=True):
+    """
+    Place src at dst as cheaply as the filesystem allows.
+
+    Tries a hardlink first (unless allow_hardlink is False), then a reflink,
+    then a regular copy.
+
+    Returns:
+        "hardlink", "reflink" or "copy"
+    """
+    src, dst = str(src), str(dst)
+    if os.path.lexists(dst):
+        raise FileExistsError(f"{dst} already exists")
+    if allow_hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    try:
+        reflink(src, dst)
+        return "reflink"
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+    return "copy"
@@ -0,0 +1,304 @@
+"""
+Find the first file of a shared folder from its HTML, without rendering it.
+
+The folder page is fetched over plain HTTP with the session cookies. File
+links are read from server-rendered grid cards, or from grid markup
+embedded as a string in the page's scripts. When neither is found the
+caller falls back to rendering the page in Chrome.
+
+Run as a script to see what the parser finds in saved pages or live links:
+
+    python html_resolver.py saved_folder.html https://www.dropbox.com/scl/fo/...
+
+or to save real folder pages together with the first file Chrome shows, and
+check the parser against every page saved so far (tests/test_html_resolver.py
+runs the same check over tests/fixtures/folder_pages):
+
+    python html_resolver.py --save tests/fixtures/folder_pages https://www.dropbox.com/scl/fo/...
+    python html_resolver.py --check tests/fixtures/folder_pages
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sys
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from download_dropbox import to_download_url
+from errors import RateLimitedError, AuthExpiredError
+from http_download import HttpDownloader
+from metrics import metrics
+
+# The same cards find_first_card reads: li._sl-card_to1nz_25 > [data-testid="grid-link"]
+CARD_CLASS = "_sl-card_to1nz_25"
+GRID_LINK = "grid-link"
+
+# JSON string literals inside scripts
+_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+
+class _GridParser(HTMLParser):
+    """Collect (name, href) of grid-link anchors inside file cards, in page order"""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.files = []
+        self.scripts = []
+        self._card_li = 0  # open <li> elements inside the current card, 0 outside cards
+        self._link = None
+        self._script = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "li" and self._card_li:
+            self._card_li += 1
+        elif tag == "li" and CARD_CLASS in (attrs.get("class") or "").split():
+            self._card_li = 1
+        elif tag == "a" and self._card_li and attrs.get("data-testid") == GRID_LINK:
+            self._link = [attrs.get("href"), ""]
+        elif tag == "script":
+            self._script = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._link is not None:
+            href, text = self._link
+            if href:
+                self.files.append((text.strip(), href))
+            self._link = None
+        elif tag == "script" and self._script is not None:
+            self.scripts.append("".join(self._script))
+            self._script = None
+        elif tag == "li" and self._card_li:
+            self._card_li -= 1
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._link[1] += data
+        if self._script is not None:
+            self._script.append(data)
+
+
+def _script_strings(script):
+    """Every JSON string literal in a script long enough to hold markup, decoded"""
+    for match in _JSON_STRING.finditer(script):
+        try:
+            text = json.loads(match.group(0))
+        except ValueError:
+            continue
+        if isinstance(text, str) and len(text) > 20:
+            yield text
+
+
+def parse_file_list(html, base_url):
+    """
+    Ordered (file name, absolute link) pairs of the files in a shared folder page.
+
+    Looks, in order, at: grid cards in the markup; grid markup embedded as
+    a string in a script. File lists kept as JSON data (e.g. prefetched
+    entries) are not used: their order is not necessarily the grid's.
+
+    Returns:
+        List of (name, href); empty if the page has none of these
+    """
+    parser = _GridParser()
+    parser.feed(html)
+    parser.close()
+    files = parser.files
+    if not files:
+        for script in parser.scripts:
+            for value in _script_strings(script):
+                if GRID_LINK in value and CARD_CLASS in value:
+                    inner = _GridParser()
+                    inner.feed(value)
+                    inner.close()
+                    files = inner.files
+                if files:
+                    break
+            if files:
+                break
+    return [(name, urljoin(base_url, href)) for name, href in files]
+
+
+class HtmlResolver:
+    """
+    Resolve a shared folder's first file with one HTTP request.
+
+    resolve() returns None whenever the page cannot be understood, so the
+    caller can render it in Chrome instead; rate limits and login pages
+    raise the same errors the browser path would.
+
+    Args:
+        http: HttpDownloader whose connection pool, cookies and user agent
+            are used (a small one is created if omitted)
+    """
+    def __init__(self, http=None):
+        self.http = http or HttpDownloader(max_connections=4)
+        self.hits = 0
+        self.fallbacks = 0
+
+    def fetch_page(self, url):
+        """Folder page HTML and the URL it was served from"""
+        response = self.http.http.request("GET", url, headers=dict(self.http.headers_for(url), Accept="text/html"))
+        # geturl() may be just the path of the last redirect
+        final_url = urljoin(url, response.geturl() or url)
+        if response.status == 429:
+            raise RateLimitedError("Dropbox is rate limiting this link")
+        if "/login" in urlsplit(final_url).path:
+            raise AuthExpiredError("Dropbox asked to log in; refresh the session with setup_session.py")
+        if response.status >= 400:
+            return None, final_url
+        return response.data.decode("utf-8", errors="replace"), final_url
+
+    def resolve(self, url, log=print):
+        """
+        Returns:
+            Tuple of (file name, direct download URL), or None to fall back
+        """
+        with metrics.timer("html_resolve"):
+            try:
+                html, final_url = self.fetch_page(url)
+            except (RateLimitedError, AuthExpiredError):
+                raise
+            except Exception as e:
+                log(f"HTML resolve of {url} failed ({e}), rendering instead")
+                html = None
+            files = parse_file_list(html, final_url) if html else []
+        if not files:
+            self.fallbacks += 1
+            log(f"No file list in the HTML of {url}, rendering instead")
+            return None
+        self.hits += 1
+        name, href = files[0]
+        log(f"First file found without rendering: {name}")
+        return name, to_download_url(href)
+
+    def close(self):
+        self.http.close()
+
+
+def save_fixtures(urls, directory, log=print):
+    """
+    Save each folder page as the resolver fetches it, next to the first
+    file Chrome shows for the same link.
+
+    Each folder gets <key>.html (the page HTML) and <key>.json with the
+    link, the URL the page was served from and the browser's first file.
+
+    Returns:
+        Number of folders saved
+    """
+    from driver_pool import DriverPool
+    from download_dropbox import resolve_first_file
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    resolver = HtmlResolver()
+    pool = DriverPool(1, max_uses=0, profile_prefix="chrome-fixtures")
+    saved = 0
+    try:
+        for url in urls:
+            key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+            try:
+                html, base_url = resolver.fetch_page(url)
+                with pool.driver() as driver:
+                    first_name, first_url = resolve_first_file(driver, url, log=lambda msg: None)
+            except Exception as e:
+                log(f"✗ {url}: {type(e).__name__}: {e}")
+                continue
+            if html is None:
+                log(f"✗ {url}: the page could not be fetched over HTTP")
+                continue
+            (directory / f"{key}.html").write_text(html, encoding="utf-8")
+            fixture = {"url": url, "base_url": base_url, "first_file": [first_name, first_url]}
+            (directory / f"{key}.json").write_text(json.dumps(fixture, indent=2) + "\n", encoding="utf-8")
+            saved += 1
+            log(f"✓ {url}: saved as {key}, Chrome shows {first_name} first")
+    finally:
+        pool.shutdown()
+        resolver.close()
+    return saved
+
+
+def check_fixtures(directory, log=print):
+    """
+    Parse every saved folder page and compare its first file with the one
+    Chrome showed when it was saved. Pages with no file list are fine (the
+    resolver would hand them to Chrome); a different first file is not.
+
+    Returns:
+        Tuple of (agreed, fell back, mismatches)
+    """
+    agreed = fallbacks = mismatches = 0
+    for path in sorted(Path(directory).glob("*.json")):
+        fixture = json.loads(path.read_text(encoding="utf-8"))
+        html = path.with_suffix(".html").read_text(encoding="utf-8", errors="replace")
+        files = parse_file_list(html, fixture["base_url"])
+        expected = tuple(fixture["first_file"])
+        if not files:
+            fallbacks += 1
+            log(f"⊘ {path.stem}: no file list, left to Chrome")
+            continue
+        got = (files[0][0], to_download_url(files[0][1]))
+        if got == expected:
+            agreed += 1
+            log(f"✓ {path.stem}: {got[0]}")
+        else:
+            mismatches += 1
+            log(f"✗ {path.stem}: resolved to {got[0]}, Chrome shows {expected[0]} first ({fixture['url']})")
+    return agreed, fallbacks, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show the file list (and first file) the HTML resolver finds in saved pages or live links"
+    )
+    parser.add_argument("sources", nargs="*", help="Saved .html files or shared folder URLs")
+    parser.add_argument("--base-url", default="https://www.dropbox.com/",
+                        help="URL saved pages are resolved against (default: https://www.dropbox.com/)")
+    parser.add_argument("--save", metavar="DIR",
+                        help="Save the given folder URLs to DIR with the first file Chrome shows")
+    parser.add_argument("--check", metavar="DIR",
+                        help="Compare the first file parsed from every page saved in DIR with Chrome's")
+    args = parser.parse_args()
+
+    if args.save:
+        saved = save_fixtures(args.sources, args.save)
+        sys.exit(0 if saved == len(args.sources) else 1)
+    if args.check:
+        agreed, fallbacks, mismatches = check_fixtures(args.check)
+        total = agreed + fallbacks + mismatches
+        if not total:
+            print(f"⊘ No saved folder pages in {args.check}; save some with --save first")
+            sys.exit(1)
+        print(f"{agreed}/{total} read from HTML, {fallbacks} left to Chrome, {mismatches} different from Chrome")
+        sys.exit(1 if mismatches else 0)
+    if not args.sources:
+        parser.error("give saved pages or folder URLs, or --check DIR")
+
+    resolver = None
+    found_all = True
+    for source in args.sources:
+        if source.startswith(("http://", "https://")):
+            resolver = resolver or HtmlResolver()
+            html, base_url = resolver.fetch_page(source)
+            html = html or ""
+        else:
+            html, base_url = Path(source).read_text(errors="replace"), args.base_url
+        files = parse_file_list(html, base_url)
+        print(f"{source}: {len(files)} files")
+        for position, (name, href) in enumerate(files[:10], 1):
+            print(f"  {position}. {name}  {href}")
+        if files:
+            print(f"  ✓ First file: {files[0][0]}")
+        else:
+            found_all = False
+            print("  ✗ No file list found; the browser would be used for this page")
+    if resolver is not None:
+        resolver.close()
+    sys.exit(0 if found_all else 1)
+
+
+if __name__ == "__main__":
+    main()
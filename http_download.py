@@ -0,0 +1,268 @@
+"""Browserless download of Dropbox files over a pooled HTTP session"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
+
+import urllib3
+
+from blob_store import HASH_NAME
+from cookie_loader import read_json_cookies, cookie_header
+from errors import HttpError, AuthExpiredError, DownloadTimeoutError
+
+
+def is_file_link(url):
+    """
+    Check whether a shared link points at a single file rather than a folder.
+    File links can be fetched directly with dl=1, no first-file lookup needed.
+    """
+    path = urlsplit(url).path
+    return path.startswith("/scl/fi/") or path.startswith("/s/")
+
+
+# Query parameters that change how a link opens but not what it points to
+IGNORED_QUERY_PARAMS = {"dl", "st", "e", "raw", "preview"}
+
+
+def normalize_shared_url(url):
+    """
+    Reduce a shared link to a canonical form so the same folder compares equal.
+    Drops view-only parameters like dl= and st=, keeps access keys like rlkey=.
+    """
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in IGNORED_QUERY_PARAMS)
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+
+class NotModified(Exception):
+    """A conditional download found the file unchanged (HTTP 304)"""
+
+
+def discard_response(response, limit=64 * 1024):
+    """
+    Hand a response's connection back to the pool without reading the rest
+    of it into the caller.
+
+    A body left unread would be taken as the reply to the next request on
+    that connection, so small bodies (error pages, 304s) are drained first;
+    anything larger, of unknown length, or abandoned mid-transfer has its
+    connection closed instead, and the pool opens a new one.
+    """
+    try:
+        length = int(response.headers.get("Content-Length", ""))
+    except ValueError:
+        length = None
+    if response.status in (204, 304) or (length is not None and length <= limit):
+        response.drain_conn()
+    else:
+        response.close()
+    response.release_conn()
+
+
+def filename_from_response(response, url):
+    """Pick a file name from Content-Disposition, falling back to the URL path"""
+    disposition = response.headers.get("Content-Disposition", "")
+    match = re.search(r"filename\*=UTF-8''([^;]+)", disposition, re.IGNORECASE)
+    if match:
+        return Path(unquote(match.group(1).strip())).name
+    match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+    if match:
+        return Path(match.group(1).strip()).name
+    return Path(unquote(urlsplit(url).path)).name or "download"
+
+
+class HttpDownloader:
+    """
+    Stream Dropbox `dl=1` responses straight to disk over keep-alive connections.
+
+    Cookies from cookies.txt and the user agent from useragent.txt are sent
+    with every request so private links behave as they do in the browser.
+    A single instance is safe to share between threads.
+
+    Each file is hashed as it streams in; take_info() hands the digest and
+    the response's ETag, Last-Modified and size to the caller, so the blob
+    store and the metadata store do not read the file a second time.
+    """
+    def __init__(self, max_connections=10, cookie_file="cookies.txt", user_agent_file="useragent.txt", timeout=60, chunk_size=1 << 16,
+                 min_rate=4096, rate_window=30):
+        self.chunk_size = chunk_size
+        self.min_rate = min_rate
+        self.rate_window = rate_window
+        self._info = {}  # downloaded path -> digest and validators
+        self._info_lock = threading.Lock()
+        self.cookies = read_json_cookies(cookie_file)
+        self.user_agent = None
+        user_agent_path = Path(user_agent_file)
+        if user_agent_path.exists():
+            self.user_agent = user_agent_path.read_text().strip() or None
+        self.http = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=max_connections,
+            block=True,
+            timeout=urllib3.Timeout(connect=15, read=timeout),
+            retries=urllib3.Retry(total=2, connect=2, read=0, redirect=5, backoff_factor=0.5),
+        )
+
+    def headers_for(self, url, validators=None):
+        """
+        Request headers for a URL, including matching session cookies and,
+        given the validators of a stored copy, conditional request headers
+        """
+        parts = urlsplit(url)
+        headers = {"Accept": "*/*"}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        if self.user_agent:
+            headers["User-Agent"] = self.user_agent
+        cookies = cookie_header(self.cookies, parts.hostname or "", secure=parts.scheme == "https")
+        if cookies:
+            headers["Cookie"] = cookies
+        return headers
+
+    def _resume_state(self, partial, url):
+        """Validators saved for a partial download of url, or None if it cannot be resumed"""
+        state_path = partial.with_name(partial.name + ".json")
+        try:
+            state = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or not (state.get("etag") or state.get("last_modified")):
+            return None
+        if not partial.exists() or partial.stat().st_size == 0:
+            return None
+        return state
+
+    def download(self, url, output_dir, file_name=None, validators=None, partial=None):
+        """
+        Download a file and write it into output_dir.
+
+        With `partial`, bytes are streamed into that file, which survives a
+        failed or interrupted transfer. The next download of the same URL to
+        the same partial path asks only for the missing bytes (Range with
+        If-Range, so a changed file starts over).
+
+        There is no cap on the total time; a transfer fails when no data
+        arrives for the read timeout, or when its throughput over
+        `rate_window` seconds drops below `min_rate` bytes per second.
+
+        Args:
+            url: Direct download URL (dl=1)
+            output_dir: Directory to save the file
+            file_name: Optional name to save as; defaults to the server's name
+            validators: Optional {"etag", "last_modified"} of a stored copy;
+                the file is only sent if it changed since
+            partial: Optional stable path to keep the partial transfer in
+
+        Returns:
+            Path to the downloaded file
+
+        Raises:
+            NotModified: If validators were given and the file is unchanged
+            HttpError: If the server answers with an error status
+            AuthExpiredError: If the server answers with a web page (usually
+                a login page) instead of the file
+            DownloadTimeoutError: If the transfer is slower than min_rate
+        """
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        headers = self.headers_for(url, validators)
+        state = None
+        if partial is not None:
+            partial = Path(partial)
+            partial.parent.mkdir(parents=True, exist_ok=True)
+            state = self._resume_state(partial, url)
+            if state is not None:
+                headers["Range"] = f"bytes={partial.stat().st_size}-"
+                headers["If-Range"] = state.get("etag") or state["last_modified"]
+
+        response = self.http.request("GET", url, headers=headers, preload_content=False)
+        complete = False
+        try:
+            if response.status == 304:
+                # No body to read; the finally block hands the connection back
+                raise NotModified(url)
+            if response.status == 416 and state is not None:
+                # The saved part is no longer a prefix of the file; start over
+                discard_response(response)
+                partial.unlink(missing_ok=True)
+                return self.download(url, output_dir, file_name, validators, partial)
+            if response.status >= 400:
+                raise HttpError(response.status, url)
+            if response.headers.get("Content-Type", "").startswith("text/html"):
+                # Dropbox answers expired sessions and missing files with a page, not a file
+                raise AuthExpiredError(f"Got a web page instead of a file for {url} (session expired or link removed)")
+
+            resumed = response.status == 206 and state is not None
+            name = file_name or (state["name"] if resumed else filename_from_response(response, url))
+            final_path = output_path / name
+            part_path = partial if partial is not None else output_path / f"{name}.part"
+            etag = response.headers.get("ETag") or (state["etag"] if resumed else None)
+            last_modified = response.headers.get("Last-Modified") or (state["last_modified"] if resumed else None)
+            if partial is not None:
+                partial.with_name(partial.name + ".json").write_text(json.dumps(
+                    {"url": url, "name": name, "etag": etag, "last_modified": last_modified}))
+
+            digest = hashlib.new(HASH_NAME)
+            size = 0
+            if resumed:
+                # Hash the bytes we already have so the digest covers the whole file
+                with open(part_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+                        size += len(chunk)
+            resumed_from = size
+            window_start = time.monotonic()
+            window_bytes = 0
+            with open(part_path, "ab" if resumed else "wb") as f:
+                for chunk in response.stream(self.chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                    window_bytes += len(chunk)
+                    elapsed = time.monotonic() - window_start
+                    if elapsed >= self.rate_window:
+                        if window_bytes / elapsed < self.min_rate:
+                            raise DownloadTimeoutError(
+                                f"Transfer of {name} slowed to {window_bytes / elapsed / 1024:.1f} KB/s "
+                                f"after {size / (1024 * 1024):.1f} MB; will resume from there")
+                        window_start = time.monotonic()
+                        window_bytes = 0
+            complete = True
+            part_path.replace(final_path)
+            if partial is not None:
+                partial.with_name(partial.name + ".json").unlink(missing_ok=True)
+            with self._info_lock:
+                self._info[str(final_path)] = {
+                    "digest": digest.hexdigest(),
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "size": size,
+                    "resumed_from": resumed_from,
+                }
+            return final_path
+        finally:
+            if complete:
+                response.release_conn()
+            else:
+                discard_response(response)
+
+    def take_info(self, path):
+        """
+        Digest and validators recorded while downloading path, or None;
+        each is handed out once
+        """
+        with self._info_lock:
+            return self._info.pop(str(path), None)
+
+    def close(self):
+        """Close all pooled connections"""
+        self.http.clear()
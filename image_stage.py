@@ -0,0 +1,152 @@
+"""
+Optional post-download stage: resize and transcode each saved image into
+web-ready variants in a process pool, overlapped with the downloads.
+"""
+
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from metrics import metrics
+
+# Output formats -> (Pillow format name, file extension)
+FORMATS = {"jpeg": ("JPEG", ".jpg"), "jpg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+
+
+def pillow_available():
+    return importlib.util.find_spec("PIL") is not None
+
+
+def parse_variants(spec):
+    """
+    Parse a variant list like "webp:1600,jpeg:800" into
+    [("webp", 1600), ("jpeg", 800)]; the number is the longest side in pixels.
+
+    Raises:
+        ValueError: If an entry has an unknown format or a bad size
+    """
+    variants = []
+    for entry in spec.split(","):
+        entry = entry.strip().lower()
+        if not entry:
+            continue
+        fmt, _, size = entry.partition(":")
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format {fmt!r} (use {', '.join(sorted(FORMATS))})")
+        if not size.isdigit() or int(size) <= 0:
+            raise ValueError(f"{entry!r} needs a size in pixels, e.g. {fmt}:1200")
+        variants.append(("jpeg" if fmt == "jpg" else fmt, int(size)))
+    if not variants:
+        raise ValueError("no variants given")
+    return variants
+
+
+def variant_dir(source, category=None):
+    """
+    Directory for a saved file's variants: .web/<category>/ in the output
+    directory, or .web/ itself for rows without a category (dot-prefixed
+    so the output index does not take it for a category)
+    """
+    parent = Path(source).parent
+    return parent.parent / ".web" / parent.name if category else parent / ".web"
+
+
+def variant_paths(source, upc, variants, category=None):
+    out_dir = variant_dir(source, category)
+    return [out_dir / f"{upc}_{size}{FORMATS[fmt][1]}" for fmt, size in variants]
+
+
+def render_variants(source, targets, variants, quality=85):
+    """
+    Write every variant of one image. Runs in a worker process.
+
+    Returns:
+        Seconds of CPU-side work, for the metrics
+    """
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        for target, (fmt, size) in zip(targets, variants):
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            if fmt == "jpeg" and variant.mode not in ("RGB", "L"):
+                variant = variant.convert("RGB")
+            target = Path(target)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            variant.save(temp_path, FORMATS[fmt][0], quality=quality)
+            temp_path.replace(target)
+    return time.perf_counter() - started
+
+
+class ImageStage:
+    """
+    Feed saved files to a ProcessPoolExecutor that renders their variants.
+
+    At most `queue_size` files are queued or being processed at once;
+    submit() waits for room, so a slow stage slows the downloads down
+    instead of piling up work. Variants that already exist and are newer
+    than their source are not rendered again. A file that cannot be
+    processed is reported but does not fail its row.
+    """
+    def __init__(self, variants, workers=None, queue_size=None, quality=85, log=print):
+        self.variants = variants
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or self.workers * 2
+        self.quality = quality
+        self.log = log
+        self.processed = 0
+        self.failed = 0
+        self._executor = None
+        self._slots = None
+        self._pending = set()
+
+    def _up_to_date(self, source, targets):
+        try:
+            source_mtime = os.stat(source).st_mtime
+            return all(os.stat(target).st_mtime >= source_mtime for target in targets)
+        except OSError:
+            return False
+
+    async def submit(self, source, upc, category=None):
+        """Queue a saved file, waiting while the queue is full"""
+        if self._executor is None:
+            # Spawned workers: the parent has threads (and browsers) running
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._slots = asyncio.Semaphore(self.queue_size)
+        targets = variant_paths(source, upc, self.variants, category)
+        if self._up_to_date(source, targets):
+            return
+        waited = time.perf_counter()
+        await self._slots.acquire()
+        metrics.observe("process_wait", time.perf_counter() - waited)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, render_variants, str(source), [str(t) for t in targets],
+                                      self.variants, self.quality)
+        self._pending.add(future)
+        future.add_done_callback(lambda f: self._done(f, upc))
+
+    def _done(self, future, upc):
+        self._pending.discard(future)
+        self._slots.release()
+        try:
+            metrics.observe("process", future.result())
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            self.log(f"⚠ {upc}: could not make web variants ({type(e).__name__}: {e})")
+
+    async def drain(self):
+        """Wait for every queued file"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,218 @@
+"""Crash-safe SQLite journal of per-row download state, used for --resume"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from pipeline import Item
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# States that need no more work on resume
+FINISHED_STATES = (DONE, SKIPPED)
+
+
+class Journal:
+    """
+    Record every row's state (pending/running/done/skipped/failed), attempt
+    count, last error and timings as the pipeline works through a sheet.
+
+    Writes are committed in batches (every `commit_every` updates or
+    `commit_interval` seconds), so a killed run loses at most one batch.
+    Rows caught mid-flight stay "running" and are simply redone on resume.
+
+    Rows are keyed by their position in the sheet, but a row only counts as
+    finished on resume if its UPC and link are still the ones journaled, so
+    editing the sheet between runs redoes the rows that changed or moved.
+
+    Safe to call from several threads (the pipeline writes from its
+    executor, so a lock wait never blocks the event loop).
+    """
+    def __init__(self, path, commit_every=200, commit_interval=2.0):
+        self.path = Path(path)
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._finished = {}  # idx -> (upc, url) of rows already finished
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS rows (
+                idx INTEGER PRIMARY KEY,
+                upc TEXT NOT NULL,
+                url TEXT NOT NULL,
+                category TEXT,
+                row_json TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                started_at REAL,
+                finished_at REAL,
+                duration REAL
+            );
+            CREATE INDEX IF NOT EXISTS rows_state ON rows (state);
+        """)
+        self._conn.commit()
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def input_file(self):
+        """Input file the journal was started for"""
+        return self._get_meta("input_file")
+
+    def start(self, input_file):
+        """Begin a fresh run for input_file, discarding any previous state"""
+        with self._lock:
+            self._conn.execute("DELETE FROM rows")
+            self._set_meta("input_file", str(Path(input_file).resolve()))
+            self._set_meta("started_at", str(time.time()))
+            self._conn.commit()
+            self._finished = {}
+
+    def resume(self, input_file):
+        """
+        Continue a previous run of input_file.
+
+        Returns:
+            Number of rows already finished, or None if the journal belongs
+            to a different input (a fresh run is started in that case)
+        """
+        if self.input_file != str(Path(input_file).resolve()):
+            self.start(input_file)
+            return None
+        return self.load_finished()
+
+    def load_finished(self):
+        """Load which rows are already finished; returns how many"""
+        with self._lock:
+            placeholders = ",".join("?" for _ in FINISHED_STATES)
+            self._finished = {
+                idx: (upc, url) for idx, upc, url in self._conn.execute(
+                    f"SELECT idx, upc, url FROM rows WHERE state IN ({placeholders})", FINISHED_STATES)
+            }
+            return len(self._finished)
+
+    def is_finished(self, item):
+        """True if a resumed run already completed this row, with the same UPC and link"""
+        return self._finished.get(item.index) == (item.upc, item.url)
+
+    def add_pending(self, item):
+        """Record a row as pending unless the journal already has it (with the same UPC and link)"""
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO rows (idx, upc, url, category, row_json, state)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (idx) DO UPDATE SET
+                    upc = excluded.upc,
+                    url = excluded.url,
+                    category = excluded.category,
+                    row_json = excluded.row_json,
+                    state = excluded.state,
+                    attempts = 0,
+                    last_error = NULL
+                WHERE rows.upc != excluded.upc OR rows.url != excluded.url
+            """, (item.index, item.upc, item.url, item.category,
+                  json.dumps(item.row_data, default=str) if item.row_data is not None else None,
+                  PENDING))
+            self._maybe_commit()
+
+    def mark_running(self, item):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO rows (idx, upc, url, category, row_json, state, attempts, started_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (idx) DO UPDATE SET
+                    upc = excluded.upc,
+                    url = excluded.url,
+                    category = excluded.category,
+                    row_json = excluded.row_json,
+                    state = excluded.state,
+                    last_error = CASE WHEN rows.upc = excluded.upc AND rows.url = excluded.url
+                                      THEN rows.last_error END,
+                    attempts = CASE WHEN rows.upc = excluded.upc AND rows.url = excluded.url
+                                    THEN rows.attempts + 1 ELSE 1 END,
+                    started_at = excluded.started_at
+            """, (item.index, item.upc, item.url, item.category,
+                  json.dumps(item.row_data, default=str) if item.row_data is not None else None,
+                  RUNNING, time.time()))
+            self._maybe_commit()
+
+    def mark_retry(self, item, error):
+        """Count another attempt at a row that is being retried in place"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE rows SET attempts = attempts + 1, last_error = ? WHERE idx = ?", (error, item.index)
+            )
+            self._maybe_commit()
+
+    def mark_finished(self, item, state, error=None):
+        with self._lock:
+            now = time.time()
+            self._conn.execute("""
+                UPDATE rows SET state = ?, last_error = ?, finished_at = ?, duration = ? - started_at
+                WHERE idx = ?
+            """, (state, error, now, now, item.index))
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+            self._last_commit = time.monotonic()
+
+    def count(self, state):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows WHERE state = ?", (state,)).fetchone()[0]
+
+    def failed_items(self):
+        """Yield pipeline Items for every failed row, in sheet order"""
+        with self._lock:
+            self.commit()
+            rows = self._conn.execute(
+                "SELECT idx, upc, url, category, row_json FROM rows WHERE state = ? ORDER BY idx", (FAILED,)
+            ).fetchall()
+        for idx, upc, url, category, row_json in rows:
+            yield Item(idx, upc, url, category, row_data=json.loads(row_json) if row_json else None)
+
+    def failed_rows(self):
+        """Original row data of every failed row, with the last error attached"""
+        with self._lock:
+            self.commit()
+            rows = self._conn.execute(
+                "SELECT upc, url, row_json, last_error FROM rows WHERE state = ? ORDER BY idx", (FAILED,)
+            ).fetchall()
+        result = []
+        for upc, url, row_json, last_error in rows:
+            row = json.loads(row_json) if row_json else {'UPC': upc, 'IMAGES LINK': url}
+            row['ERROR'] = last_error
+            result.append(row)
+        return result
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self._conn.close()
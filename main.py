@@ -4,23 +4,48 @@ Batch download images from Dropbox shared folders using Excel file input.
 """
 
 import argparse
+import asyncio
+import os
+import socket
 import sys
+import threading
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from datetime import datetime
-import shutil
 from tqdm import tqdm
-from download_dropbox import download_first_file
+from image_stage import parse_variants, pillow_available
+from event_log import FailureCsv
+from journal import Journal
+from resources import RunResources
+from row_source import RowSource, RowSourceError, SUPPORTED_SUFFIXES
+from metrics import metrics, MetricsExporter
+from shards import shard_of, run_shards
+from cluster import Coordinator, CoordinatorClient, LeaseReporter, leased_items
+from daemon import JobServer
+from profile_template import template_status
+
+
+# Retries per row for transient failures when --retry is not given
+DEFAULT_RETRIES = 2
+
+# Failed rows listed in the summary; beyond that they are only counted
+# (every failure is in the journal, and in --failed-csv / --events if given)
+SUMMARY_FAILURES = 20
 
 
 class DownloadStats:
-    """Track download statistics and failures"""
+    """Track download statistics and the first few failures"""
     def __init__(self):
         self.total = 0
         self.completed = 0
         self.skipped = 0
-        self.failed = []
+        self.deduplicated = 0
+        self.retried = {}  # error kind -> retries scheduled
+        self.processed = 0  # files rendered into web variants
+        self.process_failed = 0
+        self.failed = 0
+        self.failed_kinds = {}  # error kind -> rows failed
+        self.failures = []  # the first SUMMARY_FAILURES failed rows
         
     def add_completed(self):
         self.completed += 1
@@ -28,13 +53,32 @@ class DownloadStats:
     def add_skipped(self):
         self.skipped += 1
         
-    def add_failed(self, upc, url, error, row_data=None):
-        self.failed.append({
-            'upc': upc,
-            'url': url,
-            'error': str(error),
-            'row_data': row_data
-        })
+    def add_deduplicated(self):
+        """Count a completed item that reused another row's download"""
+        self.deduplicated += 1
+        
+    def add_retry(self, kind):
+        self.retried[kind] = self.retried.get(kind, 0) + 1
+        
+    def add_failed(self, upc, url, error, kind=None):
+        self.failed += 1
+        if kind:
+            self.failed_kinds[kind] = self.failed_kinds.get(kind, 0) + 1
+        if len(self.failures) < SUMMARY_FAILURES:
+            self.failures.append({'upc': upc, 'url': url, 'error': str(error)})
+    
+    def merge(self, other):
+        """Add the counters of another DownloadStats, given as vars() of it"""
+        for name in ("total", "completed", "skipped", "deduplicated", "processed", "process_failed", "failed"):
+            setattr(self, name, getattr(self, name) + other[name])
+        for counts, theirs in ((self.retried, other["retried"]), (self.failed_kinds, other["failed_kinds"])):
+            for kind, count in theirs.items():
+                counts[kind] = counts.get(kind, 0) + count
+        self.failures.extend(other["failures"][:SUMMARY_FAILURES - len(self.failures)])
+    
+    @staticmethod
+    def _by_kind(counts):
+        return ", ".join(f"{kind}: {n}" for kind, n in sorted(counts.items(), key=lambda kv: -kv[1]))
         
     def print_summary(self):
         print("\n" + "="*60)
@@ -42,129 +86,25 @@ class DownloadStats:
         print("="*60)
         print(f"Total items:     {self.total}")
         print(f"Downloaded:      {self.completed}")
+        if self.deduplicated:
+            print(f"  Shared links:  {self.deduplicated} (network fetches saved)")
         print(f"Skipped:         {self.skipped}")
-        print(f"Failed:          {len(self.failed)}")
+        if self.retried:
+            print(f"Retried:         {sum(self.retried.values())} ({self._by_kind(self.retried)})")
+        print(f"Failed:          {self.failed}" + (f" ({self._by_kind(self.failed_kinds)})" if self.failed_kinds else ""))
+        if self.processed or self.process_failed:
+            print(f"Web variants:    {self.processed} files" + (f" ({self.process_failed} could not be processed)" if self.process_failed else ""))
         print("="*60)
         
-        if self.failed:
+        if self.failures:
             print("\nFAILED DOWNLOADS:")
-            for item in self.failed:
+            for item in self.failures:
                 print(f"  UPC: {item['upc']}")
                 print(f"  URL: {item['url']}")
                 print(f"  Error: {item['error']}")
                 print()
-
-
-def check_existing_file(output_dir, upc, category=None):
-    """
-    Check if a file with the given UPC already exists in the output directory.
-    If category is provided, checks in the category subdirectory.
-    Returns the file path if found, None otherwise.
-    """
-    if category:
-        output_path = Path(output_dir) / category
-    else:
-        output_path = Path(output_dir)
-    
-    if not output_path.exists():
-        return None
-    
-    # Check for files starting with the UPC
-    for file in output_path.iterdir():
-        if file.is_file() and file.stem == str(upc):
-            return file
-    
-    return None
-
-
-def download_and_rename(upc, image_url, output_dir, debug=False, thread_id=0, progress_bar=None, category=None):
-    """
-    Download the first image from a Dropbox folder and rename it with the UPC.
-    
-    Args:
-        upc: UPC code to use as filename
-        image_url: Dropbox shared folder URL
-        output_dir: Directory to save the file
-        debug: Enable debug output
-        thread_id: Thread identifier for unique Chrome profiles
-        progress_bar: Optional tqdm progress bar instance
-        category: Optional category to organize files into subdirectories
-        
-    Returns:
-        Tuple of (success: bool, message: str)
-    """
-    try:
-        # Determine the target directory (with category subfolder if provided)
-        if category:
-            target_dir = Path(output_dir) / category
-            target_dir.mkdir(parents=True, exist_ok=True)
-        else:
-            target_dir = Path(output_dir)
-            target_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Check if file already exists
-        existing = check_existing_file(output_dir, upc, category)
-        if existing:
-            return (True, f"Skipped (already exists: {existing.name})")
-        
-        # Create a unique temp directory for this download
-        temp_dir = Path(output_dir) / f".tmp_{thread_id}_{upc}"
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Use a unique Chrome profile per thread and process
-        # On Windows, use temp directory; on Unix, use /tmp
-        import platform
-        import tempfile
-        if platform.system() == "Windows":
-            base_temp = tempfile.gettempdir()
-            user_data_dir = f"{base_temp}\\chrome-download-{thread_id}-{upc}"
-        else:
-            user_data_dir = f"/tmp/chrome-download-{thread_id}"
-        
-        try:
-            # Download the file
-            downloaded_file = download_first_file(
-                url=image_url,
-                output_dir=str(temp_dir),
-                debug=debug,
-                use_alt_method=False,
-                user_data_dir=user_data_dir,
-                progress_bar=progress_bar,
-                file_label=str(upc)
-            )
-            
-            if not downloaded_file or not downloaded_file.exists():
-                return (False, "Download failed - no file returned")
-            
-            # Get the file extension
-            extension = downloaded_file.suffix
-            
-            # Rename and move to target directory (category subfolder if applicable)
-            final_path = target_dir / f"{upc}{extension}"
-            shutil.move(str(downloaded_file), str(final_path))
-            
-            # Clean up temp directory
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir)
-            
-            # Clean up Chrome user data directory to prevent accumulation
-            user_data_path = Path(user_data_dir)
-            if user_data_path.exists():
-                shutil.rmtree(user_data_path, ignore_errors=True)
-            
-            return (True, f"Downloaded as {final_path.name}")
-            
-        finally:
-            # Clean up temp directory even if download failed
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir, ignore_errors=True)
-            # Clean up Chrome user data directory
-            user_data_path = Path(user_data_dir)
-            if user_data_path.exists():
-                shutil.rmtree(user_data_path, ignore_errors=True)
-        
-    except Exception as e:
-        return (False, f"Error: {str(e)}")
+            if self.failed > len(self.failures):
+                print(f"  ... and {self.failed - len(self.failures)} more (--failed-csv or --export-failed lists them all)")
 
 
 def create_failed_excel(df_failed, output_dir, excel_file):
@@ -222,161 +162,448 @@ def remove_successful_from_failed_excel(failed_excel_path, successful_upcs):
         print(f"\n⚠ Warning: Could not update failed Excel file: {e}")
 
 
-def process_excel(excel_file, output_dir, threads=1, debug=False):
+def run_pipeline(items, output_path, stats, progress_bar, journal, options):
     """
-    Process Excel file and download images.
+    Download items with freshly opened RunResources (browsers, engine,
+    caches and stores), then close them.
     
     Args:
-        excel_file: Path to Excel file with UPC and "IMAGES LINK" columns
-        output_dir: Directory to save downloaded files
-        threads: Number of parallel download threads
-        debug: Enable debug output
+        items: Iterable of pipeline Items
+        output_path: Output directory (Path)
+        stats: DownloadStats to record results in
+        progress_bar: tqdm bar, or anything with update() and write()
+            (and set_postfix() for quiet runs)
+        journal: Optional Journal
+        options: Dict of run settings (threads, engine, downloads, ...),
+            see process_excel
+        
+    Returns:
+        Dict with successful UPCs, browser and cache counters, and the
+        adaptive concurrency summary
     """
-    # Read Excel file
-    print(f"Reading Excel file: {excel_file}")
+    resources = RunResources(output_path, options, log=progress_bar.write)
+    if resources.events is not None:
+        resources.events.emit("run_start", engine=options["engine"], threads=options["threads"],
+                              downloads=resources.downloads, shard=options.get("shard"), output=str(output_path))
+    pipeline = resources.pipeline(stats, progress_bar, journal)
     try:
-        df = pd.read_excel(excel_file)
-    except Exception as e:
-        print(f"✗ Error reading Excel file: {e}")
-        sys.exit(1)
+        asyncio.run(pipeline.run(items))
+    finally:
+        if journal is not None:
+            journal.commit()
+        if resources.events is not None:
+            resources.events.emit("run_end", shard=options.get("shard"), completed=stats.completed,
+                                  skipped=stats.skipped, failed=stats.failed, failed_kinds=stats.failed_kinds,
+                                  retried=stats.retried)
+        resources.close()
+        if resources.post:
+            stats.processed += resources.post.processed
+            stats.process_failed += resources.post.failed
+    
+    concurrency = []
+    if options["adaptive"]:
+        for limit in (pipeline.resolve_limit, pipeline.html_limit, pipeline.download_limit):
+            if limit is None:
+                continue
+            concurrency.extend(limit.summary_lines())
+    report = resources.counters()
+    report["successful_upcs"] = pipeline.successful_upcs
+    report["concurrency"] = concurrency
+    return report
+
+
+def run_shard(shard, processes, excel_file, output_dir, journal_path, retry_only, options, progress):
+    """
+    Entry point of one --processes worker: stream the input, keep only this
+    shard's rows, download them and send the results back to the parent.
+    """
+    stats = DownloadStats()
+    # Shards share the journal: commit every write so no shard holds the
+    # write lock while it waits out a backoff or a slow transfer
+    journal = Journal(journal_path, commit_every=1) if journal_path else None
+    options = dict(options, profile_prefix=f"chrome-download-shard{shard}", shard=shard)
+    # Counters and timings so far, sent with progress so the parent can export them
+    progress.state = lambda: {
+        "counters": {"completed": stats.completed, "skipped": stats.skipped, "failed": stats.failed},
+        "metrics": metrics.state(),
+    }
+    try:
+        if journal is not None:
+            journal.load_finished()
+        source = journal.failed_items() if retry_only else RowSource(excel_file)
+        
+        def rows():
+            for item in source:
+                if shard_of(item.upc, processes) != shard:
+                    continue
+                if journal is not None and not retry_only and journal.is_finished(item):
+                    progress.update(1)
+                    continue
+                stats.total += 1
+                yield item
+        
+        report = run_pipeline(rows(), Path(output_dir), stats, progress, journal, options)
+    finally:
+        if journal is not None:
+            journal.close()
+    report["successful_upcs"] = list(report["successful_upcs"])
+    report["stats"] = vars(stats)
+    report["metrics"] = metrics.state()
+    progress.finish(report)
+
+
+def process_excel(excel_file, output_dir, threads=1, debug=False, recycle_after=50, engine="browser", downloads=8, cache_ttl=168, dedupe="link", journal=None, retry_only=False, export_failed=False, page_profile="lean", metrics_file=None, metrics_interval=15, adaptive=False, processes=1, retries=DEFAULT_RETRIES, refresh=False, derivatives=None, process_workers=None, process_queue=None, resolver="browser", events_file=None, failed_csv=None, quiet=False):
+    """
+    Process an input sheet and download images.
     
-    # Check if this is a retry of a failed Excel file
+    Args:
+        excel_file: Path to the input (.xlsx, .xls, .csv, .jsonl or .parquet)
+            with UPC and "IMAGES LINK" columns
+        output_dir: Directory to save downloaded files
+        threads: Number of browsers resolving folders in parallel (per process)
+        debug: Enable debug output
+        recycle_after: Restart each pooled browser after this many items
+        engine: "browser" to download with Chrome, "http" to only resolve the
+            first file with Chrome and stream it over HTTP
+        downloads: Number of concurrent HTTP transfers (http engine only, per process)
+        cache_ttl: Hours a resolved folder stays cached, 0 to disable the cache
+        dedupe: How rows sharing a link get their file: "link" (hardlink,
+            falling back to reflink/copy, with identical downloads stored
+            once in <output_dir>/.blobs), "copy" (reflink or copy) or "off"
+            (download every row separately)
+        journal: Optional Journal recording each row's state. Rows a resumed
+            journal already finished are not processed again.
+        retry_only: Process only the rows the journal has marked as failed
+            instead of reading the input file
+        export_failed: Also write the failed rows to failed_<output_dir>.xlsx
+        page_profile: "lean" blocks images, fonts, media and trackers while
+            resolving folders; "full" renders the page normally
+        metrics_file: Write per-phase timings here every metrics_interval
+            seconds (.prom for Prometheus text format, otherwise JSON)
+        adaptive: Tune resolve/download concurrency while running, with
+            threads and downloads as the ceilings
+        processes: Split rows across this many worker processes by a hash
+            of the UPC, each with its own browsers and downloads
+        retries: Times a row with a transient failure is retried during the
+            run, after a backoff (-1 for no limit, 0 to disable)
+        refresh: Check rows whose file already exists with a conditional
+            request and download them again only if they changed upstream
+        derivatives: Optional list of (format, size) web variants to render
+            from every saved file, e.g. [("webp", 1600), ("jpeg", 800)]
+        process_workers: Processes rendering variants (default: CPU count,
+            split between --processes shards)
+        process_queue: Files waiting for or in rendering before downloads
+            are held back (default: twice process_workers)
+        resolver: "browser" to render every folder in Chrome, "html" to read
+            each folder's first file from its HTML and render only when that fails
+        events_file: Optional JSONL file every outcome and retry is appended to
+        failed_csv: Optional CSV file failed rows are appended to as they fail
+        quiet: Show running counts on the progress bar instead of a line per row
+        
+    Returns:
+        Number of rows that failed
+    """
     excel_path = Path(excel_file)
     is_retry = excel_path.name.startswith('failed_')
-    if is_retry:
-        print("📝 Retrying failed downloads...")
-    
-    # Validate columns
-    required_cols = ['UPC', 'IMAGES LINK']
-    if not all(col in df.columns for col in required_cols):
-        print("✗ Error: Excel file must contain 'UPC' and 'IMAGES LINK' columns")
-        print(f"  Found columns: {', '.join(df.columns)}")
-        sys.exit(1)
-    
-    # Check if CATEGORY column exists
-    has_category = 'CATEGORY' in df.columns
-    if has_category:
-        print("✓ CATEGORY column found - files will be organized by category")
     
-    # Filter out rows with missing data
-    filter_cols = ['UPC', 'IMAGES LINK']
-    df = df.dropna(subset=filter_cols)
+    if retry_only:
+        # Retry passes come straight from the journal; the input is not re-read
+        source = list(journal.failed_items())
+        total_hint = len(source)
+        print(f"📝 Retrying {total_hint} failed downloads...")
+    else:
+        # Open the input; rows are read lazily as the pipeline pulls them
+        print(f"Reading input file: {excel_file}")
+        try:
+            source = RowSource(excel_file)
+        except RowSourceError as e:
+            print(f"✗ Error: {e}")
+            sys.exit(1)
+        total_hint = source.total_hint
+        
+        # Check if this is a retry of a failed Excel file
+        if is_retry:
+            print("📝 Retrying failed downloads...")
+        
+        # Check if CATEGORY column exists
+        if source.has_category:
+            print("✓ CATEGORY column found - files will be organized by category")
     
     # Create output directory
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
     stats = DownloadStats()
-    stats.total = len(df)
-    successful_upcs = set()  # Track successful UPCs for retry scenario
     
-    print(f"Found {stats.total} items to process")
+    if total_hint is not None and not retry_only:
+        print(f"Found about {total_hint} rows to process")
     print(f"Output directory: {output_path.resolve()}")
-    print(f"Threads: {threads}")
+    if processes > 1:
+        print(f"Processes: {processes}")
+    print(f"Threads: {threads}" + (" per process" if processes > 1 else "") + (" (adaptive ceiling)" if adaptive else ""))
+    print(f"Engine: {engine}" + (f" ({downloads} concurrent downloads)" if engine == "http" else ""))
     print()
     
+    options = {
+        "threads": threads,
+        "debug": debug,
+        "recycle_after": recycle_after,
+        "engine": engine,
+        "downloads": downloads,
+        "cache_ttl": cache_ttl,
+        "dedupe": dedupe,
+        "page_profile": page_profile,
+        "adaptive": adaptive,
+        "retries": retries,
+        "refresh": refresh,
+        "derivatives": derivatives,
+        "process_workers": max(1, (process_workers or os.cpu_count() or 1) // processes),
+        "process_queue": process_queue,
+        "resolver": resolver,
+        "events_file": events_file,
+        "failed_csv": failed_csv,
+        "quiet": quiet,
+        "columns": source.columns if not retry_only else _row_columns(source),
+    }
+    if failed_csv:
+        # Shard processes append to it, so its header must exist before they start
+        FailureCsv(failed_csv, options["columns"]).close()
+    
+    # Per-phase timings accumulate across passes; export them while running.
+    # Running shards report their latest state, which replaces the one before
+    # and is dropped (under the same lock) once their result has been merged
+    running_shards = {}
+    shards_lock = threading.Lock()
+    
+    def export_counters():
+        with shards_lock:
+            counters = {"completed": stats.completed, "skipped": stats.skipped, "failed": stats.failed}
+            for state in running_shards.values():
+                for name, value in state["counters"].items():
+                    counters[name] += value
+        return counters
+    
+    def export_states():
+        with shards_lock:
+            return [metrics.state()] + [state["metrics"] for state in running_shards.values()]
+    
+    exporter = None
+    if metrics_file:
+        exporter = MetricsExporter(metrics_file, interval=metrics_interval, counters=export_counters,
+                                   states=export_states if processes > 1 else None).start()
+    
     # Process downloads
-    if threads == 1:
-        # Single-threaded processing with progress bar
-        with tqdm(total=stats.total, desc="Processing", unit="file", position=0) as pbar:
-            for idx, row in df.iterrows():
-                upc = str(row['UPC']).strip()
-                url = str(row['IMAGES LINK']).strip()
-                category = str(row['CATEGORY']).strip() if has_category and pd.notna(row.get('CATEGORY')) else None
-                
-                pbar.set_description(f"Processing {upc}")
+    with tqdm(total=total_hint, desc="Processing", unit="file") as pbar:
+        try:
+            if processes > 1:
+                report = {"successful_upcs": set(), "launches": 0, "recycles": 0,
+                          "cache_hits": 0, "cache_misses": 0, "html_hits": 0, "html_fallbacks": 0, "blobs_stored": 0, "blobs_reused": 0,
+                          "bytes_saved": 0, "concurrency": []}
                 
-                success, message = download_and_rename(upc, url, output_dir, debug, thread_id=0, progress_bar=pbar, category=category)
+                def merge(shard, result):
+                    with shards_lock:
+                        stats.merge(result["stats"])
+                        metrics.merge_state(result["metrics"])
+                        running_shards.pop(shard, None)
+                    report["successful_upcs"].update(result["successful_upcs"])
+                    for key in ("launches", "recycles", "cache_hits", "cache_misses", "html_hits", "html_fallbacks",
+                                "blobs_stored", "blobs_reused", "bytes_saved"):
+                        report[key] += result[key]
+                    if result["concurrency"]:
+                        report["concurrency"].append(f"  shard {shard}:")
+                        report["concurrency"].extend("  " + line for line in result["concurrency"])
                 
-                if success:
-                    if "Skipped" in message:
-                        stats.add_skipped()
-                        pbar.write(f"⊘ {upc}: {message}")
-                    else:
-                        stats.add_completed()
-                        successful_upcs.add(upc)
-                        pbar.write(f"✓ {upc}: {message}")
-                else:
-                    stats.add_failed(upc, url, message, row_data=row.to_dict())
-                    pbar.write(f"✗ {upc}: {message}")
+                def shard_state(shard, state):
+                    with shards_lock:
+                        running_shards[shard] = state
                 
-                pbar.update(1)
-    else:
-        # Multi-threaded processing with overall progress bar
-        with tqdm(total=stats.total, desc="Overall Progress", unit="file") as overall_pbar:
-            with ThreadPoolExecutor(max_workers=threads) as executor:
-                # Submit all tasks
-                future_to_item = {}
-                for idx, row in df.iterrows():
-                    upc = str(row['UPC']).strip()
-                    url = str(row['IMAGES LINK']).strip()
-                    category = str(row['CATEGORY']).strip() if has_category and pd.notna(row.get('CATEGORY')) else None
-                    
-                    thread_id = idx % threads
-                    
-                    future = executor.submit(
-                        download_and_rename,
-                        upc, url, output_dir, debug, 
-                        thread_id=thread_id,
-                        progress_bar=None,  # Don't pass progress bar in multi-threaded mode
-                        category=category
-                    )
-                    future_to_item[future] = (idx, upc, url)
+                if journal is not None:
+                    journal.commit()
+                crashed = run_shards(
+                    run_shard, processes,
+                    (str(excel_path), str(output_path), str(journal.path) if journal is not None else None, retry_only, options),
+                    pbar, merge, on_state=shard_state, state_interval=metrics_interval if metrics_file else None
+                )
+                for shard, exit_code in sorted(crashed.items()):
+                    message = f"Shard {shard} exited unexpectedly (exit code {exit_code}); its unfinished rows are picked up by --resume"
+                    pbar.write(f"✗ {message}")
+                    stats.add_failed(f"shard {shard}", "", message)
+            else:
+                def rows():
+                    for item in source:
+                        if journal is not None and not retry_only and journal.is_finished(item):
+                            pbar.update(1)
+                            continue
+                        stats.total += 1
+                        yield item
                 
-                # Process completed tasks
-                for future in as_completed(future_to_item):
-                    idx, upc, url = future_to_item[future]
-                    
-                    try:
-                        success, message = future.result()
-                        
-                        # Get the row data from the original dataframe
-                        row_data = df.loc[idx].to_dict()
-                        
-                        if success:
-                            if "Skipped" in message:
-                                stats.add_skipped()
-                                overall_pbar.write(f"⊘ {upc}: {message}")
-                            else:
-                                stats.add_completed()
-                                successful_upcs.add(upc)
-                                overall_pbar.write(f"✓ {upc}: {message}")
-                        else:
-                            stats.add_failed(upc, url, message, row_data=row_data)
-                            overall_pbar.write(f"✗ {upc}: {message}")
-                            
-                    except Exception as e:
-                        row_data = df.loc[idx].to_dict()
-                        stats.add_failed(upc, url, str(e), row_data=row_data)
-                        overall_pbar.write(f"✗ {upc}: Exception: {str(e)}")
-                    
-                    overall_pbar.update(1)
+                report = run_pipeline(rows(), output_path, stats, pbar, journal, options)
+        finally:
+            if exporter:
+                exporter.stop()
+    successful_upcs = report["successful_upcs"]
+    
+    if debug:
+        print(f"Browser launches: {report['launches']} ({report['recycles']} recycled)")
+        if cache_ttl:
+            print(f"Resolution cache: {report['cache_hits']} hits, {report['cache_misses']} misses")
+        if report["html_hits"] or report["html_fallbacks"]:
+            print(f"HTML resolver: {report['html_hits']} folders read without rendering, "
+                  f"{report['html_fallbacks']} rendered in Chrome")
+        if dedupe == "link":
+            print(f"Blob store: {report['blobs_stored']} stored, {report['blobs_reused']} already stored "
+                  f"({report['bytes_saved'] / (1024 * 1024):.1f} MB not written again)")
     
     # Print summary
     stats.print_summary()
+    if report["concurrency"]:
+        print("\nCONCURRENCY (adaptive, time→limit):")
+        print("\n".join(report["concurrency"]))
+    if debug or metrics_file:
+        phase_lines = metrics.summary_lines()
+        if phase_lines:
+            print("\nTIME BY PHASE (seconds):")
+            print("\n".join(phase_lines))
+        if metrics_file:
+            print(f"\n📋 Metrics written to: {metrics_file}")
     
-    # Handle failed downloads
-    if stats.failed:
-        # Create DataFrame from failed rows
-        failed_rows = [item['row_data'] for item in stats.failed]
-        df_failed = pd.DataFrame(failed_rows)
-        
-        # Create failed Excel file
+    # Optionally export the failed rows from the journal
+    if stats.failed and export_failed and journal is not None:
+        df_failed = pd.DataFrame(journal.failed_rows())
         failed_excel_path = create_failed_excel(df_failed, output_dir, excel_file)
-        
         if failed_excel_path:
             print(f"\n📋 Failed downloads saved to: {failed_excel_path}")
-            print(f"\n💡 To retry failed downloads only, run:")
-            print(f"   python main.py {failed_excel_path.name} {output_dir}")
-            if threads > 1:
-                print(f"   python main.py {failed_excel_path.name} {output_dir} --threads {threads}")
     
     # If this was a retry, update the failed Excel file
     if is_retry and successful_upcs:
         remove_successful_from_failed_excel(excel_path, successful_upcs)
     
-    # Return the failed Excel path for retry option
-    return failed_excel_path if stats.failed else None
+    return stats.failed
+
+
+def run_coordinator(excel_file, journal, port, batch_size=50, lease_timeout=300, export_failed=False):
+    """
+    Serve leases on the sheet's rows to --worker processes until every row
+    has a result, then print the usual summary.
+    
+    Returns:
+        Number of rows that failed
+    """
+    print(f"Reading input file: {excel_file}")
+    try:
+        source = RowSource(excel_file)
+    except RowSourceError as e:
+        print(f"✗ Error: {e}")
+        sys.exit(1)
+    
+    stats = DownloadStats()
+    print(f"📡 Coordinator listening on port {port} ({batch_size} rows per lease, {lease_timeout}s lease timeout)")
+    print(f"💡 Start workers with: python main.py --worker http://{socket.gethostname()}:{port} <output_dir>")
+    print()
+    
+    with tqdm(total=source.total_hint, desc="Processing", unit="file") as pbar:
+        def rows():
+            for item in source:
+                if journal.is_finished(item):
+                    pbar.update(1)
+                    continue
+                stats.total += 1
+                yield item
+        
+        coordinator = Coordinator(journal, stats, progress_bar=pbar, batch_size=batch_size, lease_timeout=lease_timeout)
+        coordinator.serve(port, rows())
+    
+    stats.print_summary()
+    if coordinator.reissued:
+        print(f"🔄 {coordinator.reissued} rows were re-issued after their worker's lease expired")
+    
+    if stats.failed and export_failed:
+        df_failed = pd.DataFrame(journal.failed_rows())
+        failed_excel_path = create_failed_excel(df_failed, Path(journal.path).parent, excel_file)
+        if failed_excel_path:
+            print(f"\n📋 Failed downloads saved to: {failed_excel_path}")
+    return stats.failed
+
+
+def run_worker(coordinator_url, output_dir, options, batch_size=None):
+    """
+    Download rows leased from a coordinator until it has no more work,
+    reporting each row's result back to it.
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    client = CoordinatorClient(coordinator_url)
+    stats = DownloadStats()
+    reporter = LeaseReporter(client)
+    
+    print(f"Worker {client.worker} pulling from {coordinator_url}")
+    print(f"Output directory: {output_path.resolve()}")
+    print()
+    
+    with tqdm(desc="Processing", unit="file") as pbar:
+        def log(msg):
+            if options["debug"]:
+                pbar.write(msg)
+        
+        async def rows():
+            async for item in leased_items(client, reporter, batch_size, log=log):
+                stats.total += 1
+                yield item
+        
+        try:
+            run_pipeline(rows(), output_path, stats, pbar, reporter, options)
+        finally:
+            reporter.close()
+    
+    stats.print_summary()
+    return stats.failed
+
+
+def run_server(output_dir, options, port, inbox=None, warm=1):
+    """
+    Keep browsers, connections, caches and the output index open and run
+    jobs submitted over HTTP on localhost:PORT (or dropped into `inbox`)
+    until interrupted.
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    resources = RunResources(output_path, options)
+    server = JobServer(resources, DownloadStats, inbox=inbox, quiet=options.get("quiet", False))
+    
+    print(f"Output directory: {output_path.resolve()}")
+    print(f"Indexed {len(resources.index)} existing files")
+    if warm:
+        try:
+            resources.pool.warm(warm)
+            print(f"✓ {min(warm, options['threads'])} browser(s) started and waiting for jobs")
+        except Exception as e:
+            print(f"⚠ Could not start Chrome ahead of the first job ({type(e).__name__}: {e})")
+    print(f"📡 Accepting jobs on http://127.0.0.1:{port}/jobs" + (f" and from {inbox}" if inbox else ""))
+    print(f"💡 Submit one with: curl -d '{{\"sheet\": \"/path/to/products.xlsx\"}}' http://127.0.0.1:{port}/jobs")
+    print()
+    
+    try:
+        asyncio.run(server.serve(port))
+    except KeyboardInterrupt:
+        print("\n👋 Stopped. Inbox files whose jobs had not finished run again on the next start")
+    finally:
+        resources.close()
+
+
+def _row_columns(items):
+    """Input columns of journaled items (a retry pass), from the first with row data"""
+    for item in items:
+        if item.row_data:
+            return list(item.row_data)
+    return None
+
+
+def variants_arg(value):
+    """argparse type for --derivatives"""
+    try:
+        return parse_variants(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def main():
@@ -391,126 +618,368 @@ Examples:
   # Multi-threaded download with 4 threads
   python main.py products.xlsx output/ --threads 4
 
-  # Auto-retry failed downloads until all succeed
+  # Stream files over HTTP, using Chrome only to find the first file
+  python main.py products.xlsx output/ --threads 4 --engine http
+
+  # Make 1600px WebP and 800px JPEG copies of every image while downloading
+  python main.py products.xlsx output/ --engine http --derivatives webp:1600,jpeg:800
+
+  # Pick up photos that changed upstream since the last run
+  python main.py products.xlsx output/ --engine http --refresh
+
+  # Read folder pages over HTTP first, rendering only what cannot be parsed
+  python main.py products.xlsx output/ --engine http --resolver html
+
+  # 4 browsers resolving folders, 64 HTTP transfers in flight
+  python main.py products.xlsx output/ --threads 4 --engine http --downloads 64
+
+  # Keep retrying transient failures (with backoff) until they succeed
   python main.py products.xlsx output/ --retry
 
-  # Auto-retry up to 3 times before giving up
-  python main.py products.xlsx output/ --retry 3
+  # Retry each transient failure up to 5 times, then exit without asking
+  python main.py products.xlsx output/ --retry 5
 
-  # Auto-retry with debug output
+  # Show every retry and why it happened
   python main.py products.xlsx output/ --retry --debug
 
-  # Retry a previous failed download file
-  python main.py failed_output.xlsx output/ --threads 4
+  # Continue an interrupted or partly failed run where it stopped
+  python main.py products.xlsx output/ --resume
+
+  # Write failed rows to failed_output.xlsx as well
+  python main.py products.xlsx output/ --export-failed
+
+  # 4 processes with 2 browsers each, for big sheets on many-core machines
+  python main.py products.xlsx output/ --processes 4 --threads 2
+
+  # Let the run find its own pace, up to 8 browsers
+  python main.py products.xlsx output/ --threads 8 --adaptive
+
+  # Split one sheet across machines: a coordinator and any number of workers
+  python main.py products.xlsx output/ --coordinator 8800
+  python main.py --worker http://coordinator-host:8800 output/ --threads 4
+
+  # 100k-row sheet: counts only on screen, outcomes and failures streamed to files
+  python main.py products.csv output/ --quiet --events run.jsonl --failed-csv failed.csv
+
+  # Stay running with warm browsers; take jobs over HTTP and from a folder
+  python main.py --serve 8765 output/ --engine http --inbox inbox/
+  curl -d '{"sheet": "/path/to/products.xlsx"}' http://127.0.0.1:8765/jobs
 
-Excel file format:
+  # Export per-phase timings for Prometheus' textfile collector every 30s
+  python main.py products.xlsx output/ --metrics-file metrics/dropbox.prom --metrics-interval 30
+
+Input file format (.xlsx, .xls, .csv, .jsonl or .parquet):
   Required columns:
     - UPC: Product UPC code (used as filename)
     - IMAGES LINK: Dropbox shared folder URL
 
 Notes:
   - Files are saved as <UPC>.<extension> in the output directory
-  - Failed downloads are saved to failed_<output_dir>.xlsx for retry
-  - Existing files are automatically skipped
+  - Every row's state is journaled in <output_dir>/.journal.sqlite; use
+    --resume to pick up where a killed or failed run stopped
+  - The summary lists the first 20 failed rows; --failed-csv and --events
+    record all of them while the run is going, --export-failed at the end
+  - Existing files are automatically skipped; with --refresh they are
+    checked upstream and replaced only if they changed
+  - Each thread keeps one Chrome instance open for the whole run
+  - Chrome profiles are cloned from the template saved by setup_session.py
+    and kept between runs until the session is set up again
+  - Folders are resolved by rendering them in Chrome; --resolver html reads
+    the page HTML over plain HTTP first (check it against saved pages with
+    python html_resolver.py --check DIR before relying on it)
+  - Folder pages load without images, fonts, media or trackers; use
+    --page-profile full if a folder fails to resolve
+  - Resolved folders are cached in <output_dir>/.resolve_cache.sqlite so
+    later runs and retries skip loading the folder page
+  - Interrupted HTTP transfers are kept in <output_dir>/.partial and
+    resumed where they stopped (and removed when a row fails for good or
+    after a week untouched); downloads are only given up when they stop
+    making progress, not after a fixed time
+  - Rows with the same IMAGES LINK are downloaded once and hardlinked to
+    every UPC (see --dedupe)
+  - Identical files from different links are stored once in
+    <output_dir>/.blobs and hardlinked to each UPC, across runs too
+    (a stored file goes away when no output file links to it any more)
         """
     )
     
-    parser.add_argument('excel_file', 
-                       help='Path to Excel file (.xlsx) containing UPC and IMAGES LINK columns')
-    parser.add_argument('output_dir', 
+    parser.add_argument('excel_file', nargs='?',
+                       help='Path to input file (.xlsx, .xls, .csv, .jsonl or .parquet) containing UPC and IMAGES LINK columns (omit with --worker)')
+    parser.add_argument('output_dir', nargs='?',
                        help='Output directory for downloaded files')
     parser.add_argument('-t', '--threads', type=int, default=1,
                        metavar='N',
-                       help='Number of parallel download threads (default: 1)')
-    parser.add_argument('-r', '--retry', nargs='?', const=-1, type=int, default=0,
+                       help='Number of browsers working in parallel (default: 1)')
+    parser.add_argument('-r', '--retry', nargs='?', const=-1, type=int, default=None,
                        metavar='N',
-                       help='Auto-retry failed downloads. Use without value for unlimited retries, or specify max retry attempts (e.g., --retry 3)')
+                       help='Retry transient failures (timeouts, rate limits, 5xx, browser crashes) during the run with '
+                            'exponential backoff: up to N times per row, or without a value until they succeed. '
+                            'Without --retry, rows get 2 retries and you are asked about leftovers at the end. '
+                            'Permanent failures (empty folder, expired session) are never retried')
     parser.add_argument('-d', '--debug', action='store_true',
                        help='Enable verbose debug output for troubleshooting')
+    parser.add_argument('-e', '--engine', choices=['browser', 'http'], default='browser',
+                       help='browser: Chrome downloads each file; http: Chrome only finds the first file and it is streamed over HTTP (default: browser)')
+    parser.add_argument('--downloads', type=int, default=8,
+                       metavar='N',
+                       help='Number of concurrent HTTP transfers with --engine http (default: 8)')
+    parser.add_argument('--resolver', choices=['html', 'browser'], default='browser',
+                       help='How to find the first file of a folder: always render in Chrome (browser), or read the page '
+                            'HTML over HTTP and render in Chrome only if that fails (html) (default: browser)')
+    parser.add_argument('--cache-ttl', type=float, default=168,
+                       metavar='HOURS',
+                       help='Hours to remember which file comes first in each folder, 0 to always resolve live (default: 168)')
+    parser.add_argument('--dedupe', choices=['link', 'copy', 'off'], default='link',
+                       help='Rows with the same link are fetched once and placed by hardlink (link), reflink/copy (copy), or downloaded separately (off). '
+                            'With link, files with identical contents are also kept once in output_dir/.blobs (default: link)')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Re-check files that already exist with a conditional request (ETag / Last-Modified) and '
+                            'download only the ones that changed upstream. Needs --engine http')
+    parser.add_argument('--derivatives', type=variants_arg, metavar='SPEC',
+                       help='Also render web variants of every saved file while downloading, e.g. "webp:1600,jpeg:800" '
+                            '(format:longest side in pixels). Written to .web/<category>/<UPC>_<size>.<ext> (.web/ without a category). Needs Pillow')
+    parser.add_argument('--process-workers', type=int, metavar='N',
+                       help='Processes rendering --derivatives (default: number of CPUs)')
+    parser.add_argument('--process-queue', type=int, metavar='N',
+                       help='Files queued for --derivatives before downloads wait for the renderer (default: 2 x --process-workers)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Continue the previous run of this input in output_dir, skipping rows it already finished')
+    parser.add_argument('--export-failed', action='store_true',
+                       help='Also write failed rows to failed_<output_dir>.xlsx')
+    parser.add_argument('--page-profile', choices=['lean', 'full'], default='lean',
+                       help='lean: skip images, fonts, media and trackers when loading folder pages; full: render everything (default: lean)')
+    parser.add_argument('-p', '--processes', type=int, default=1, metavar='P',
+                       help='Split rows across P worker processes by UPC, each with its own --threads browsers and --downloads transfers (default: 1)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Start with fewer browsers/downloads and adjust while running: grow while pages stay fast, halve on timeouts and rate limits. --threads and --downloads become the ceilings')
+    parser.add_argument('--coordinator', type=int, metavar='PORT',
+                       help='Do not download; hand out batches of rows to --worker processes over HTTP on PORT')
+    parser.add_argument('--worker', metavar='URL',
+                       help='Download rows leased from the coordinator at URL instead of reading an input file')
+    parser.add_argument('--batch-size', type=int, default=50, metavar='N',
+                       help='Rows per lease in coordinator mode (default: 50)')
+    parser.add_argument('--lease-timeout', type=int, default=300, metavar='SECONDS',
+                       help='Re-issue a lease when its worker has not reported for this long (default: 300)')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                       help='Keep browsers and caches warm and run jobs submitted to http://127.0.0.1:PORT/jobs (needs only an output directory)')
+    parser.add_argument('--inbox', metavar='DIR',
+                       help='With --serve, also run sheets (or .json row lists) dropped into DIR')
+    parser.add_argument('--warm', type=int, default=1, metavar='N',
+                       help='With --serve, browsers to start before the first job (default: 1)')
+    parser.add_argument('--metrics-file', metavar='PATH',
+                       help='Periodically write per-phase latency histograms to PATH (.prom for Prometheus textfile format, otherwise JSON)')
+    parser.add_argument('--metrics-interval', type=float, default=15, metavar='SECONDS',
+                       help='How often --metrics-file is rewritten (default: 15)')
+    parser.add_argument('--events', metavar='PATH',
+                       help='Append every row outcome and retry to PATH as JSON lines while running')
+    parser.add_argument('--failed-csv', metavar='PATH',
+                       help='Append failed rows (input columns plus ERROR and KIND) to PATH as they fail')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                       help='No line per row; show running done/skipped/failed counts on the progress bar')
+    parser.add_argument('--recycle-after', type=int, default=50,
+                       metavar='N',
+                       help='Restart each worker\'s browser after N items, 0 to never recycle (default: 50)')
     
     args = parser.parse_args()
     
     # Validate inputs
-    excel_path = Path(args.excel_file)
-    if not excel_path.exists():
-        print(f"✗ Error: Excel file not found: {excel_path}")
+    if args.threads < 1:
+        print(f"✗ Error: Threads must be at least 1")
         sys.exit(1)
     
-    if not excel_path.suffix.lower() in ['.xlsx', '.xls']:
-        print(f"✗ Error: File must be an Excel file (.xlsx or .xls)")
+    if args.processes < 1:
+        print(f"✗ Error: Processes must be at least 1")
         sys.exit(1)
     
-    if args.threads < 1:
-        print(f"✗ Error: Threads must be at least 1")
+    if args.downloads < 1:
+        print(f"✗ Error: --downloads must be at least 1")
+        sys.exit(1)
+    
+    if args.cache_ttl < 0:
+        print(f"✗ Error: --cache-ttl must be 0 or a positive number")
+        sys.exit(1)
+    
+    if args.metrics_interval <= 0:
+        print(f"✗ Error: --metrics-interval must be a positive number")
         sys.exit(1)
     
-    if args.retry < -1:
+    if args.recycle_after < 0:
+        print(f"✗ Error: --recycle-after must be 0 or a positive number")
+        sys.exit(1)
+    
+    if args.batch_size < 1 or args.lease_timeout < 1:
+        print(f"✗ Error: --batch-size and --lease-timeout must be at least 1")
+        sys.exit(1)
+    
+    if args.derivatives and not pillow_available():
+        print("✗ Error: --derivatives needs Pillow (pip install Pillow)")
+        sys.exit(1)
+    
+    if (args.process_workers is not None and args.process_workers < 1) or (args.process_queue is not None and args.process_queue < 1):
+        print("✗ Error: --process-workers and --process-queue must be at least 1")
+        sys.exit(1)
+    
+    if args.refresh and args.engine != "http":
+        parser.error("--refresh needs --engine http (Chrome downloads cannot be made conditional)")
+    
+    if args.retry is not None and args.retry < -1:
         print(f"✗ Error: Retry value must be -1 (unlimited), 0 (disabled), or a positive number")
         sys.exit(1)
     
-    # Process the Excel file
-    current_file = str(excel_path)
-    retry_count = 0
-    max_retries = args.retry  # -1 = unlimited, 0 = disabled, >0 = specific limit
-    
-    while True:
-        failed_excel_path = process_excel(
-            excel_file=current_file,
-            output_dir=args.output_dir,
-            threads=args.threads,
-            debug=args.debug
-        )
-        
-        # If no failures, we're done
-        if not failed_excel_path:
-            print("\n✅ All downloads completed successfully!")
-            break
-        
-        # Check if auto-retry is enabled
-        if max_retries != 0:
-            # Auto-retry mode
-            retry_count += 1
+    if template_status() == "stale":
+        print("⚠ cookies.txt or the other session files changed since the last setup; "
+              "run setup_session.py to refresh the browser profile template")
+    
+    if args.inbox and not args.serve:
+        parser.error("--inbox needs --serve")
+    
+    # Options of a pipeline that is not tied to one input file
+    standalone_options = {
+        "threads": args.threads,
+        "debug": args.debug,
+        "recycle_after": args.recycle_after,
+        "engine": args.engine,
+        "downloads": args.downloads,
+        "cache_ttl": args.cache_ttl,
+        "dedupe": args.dedupe,
+        "page_profile": args.page_profile,
+        "adaptive": args.adaptive,
+        "retries": DEFAULT_RETRIES if args.retry is None else args.retry,
+        "refresh": args.refresh,
+        "derivatives": args.derivatives,
+        "process_workers": args.process_workers or os.cpu_count() or 1,
+        "process_queue": args.process_queue,
+        "resolver": args.resolver,
+        "events_file": args.events,
+        "failed_csv": args.failed_csv,
+        "quiet": args.quiet,
+    }
+    
+    if args.serve:
+        # Serve mode takes only an output directory
+        args.output_dir = args.output_dir or args.excel_file
+        if not args.output_dir:
+            parser.error("--serve needs an output directory")
+        if args.worker or args.coordinator:
+            parser.error("--serve cannot be combined with --worker or --coordinator")
+        run_server(args.output_dir, standalone_options, args.serve, inbox=args.inbox, warm=args.warm)
+        return
+    
+    if args.worker:
+        # Workers take only an output directory
+        args.output_dir = args.output_dir or args.excel_file
+        if not args.output_dir:
+            parser.error("--worker needs an output directory")
+        if args.coordinator:
+            parser.error("--worker and --coordinator cannot be combined")
+        failed = run_worker(args.worker, args.output_dir, standalone_options)
+        sys.exit(1 if failed else 0)
+    
+    if not args.excel_file or not args.output_dir:
+        parser.error("the input file and output directory are required")
+    
+    excel_path = Path(args.excel_file)
+    if not excel_path.exists():
+        print(f"✗ Error: Input file not found: {excel_path}")
+        sys.exit(1)
+    
+    if not excel_path.suffix.lower() in SUPPORTED_SUFFIXES:
+        print(f"✗ Error: Input must be one of: {', '.join(SUPPORTED_SUFFIXES)}")
+        sys.exit(1)
+    
+    # Every row's state goes into a journal in the output directory
+    output_path = Path(args.output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    journal = Journal(output_path / ".journal.sqlite")
+    if args.resume:
+        finished = journal.resume(excel_path)
+        if finished is None:
+            print(f"⚠ No earlier run of {excel_path.name} found in {args.output_dir}, starting from the beginning")
+        else:
+            print(f"⏯ Resuming: {finished} rows already finished")
+    else:
+        journal.start(excel_path)
+    
+    if args.coordinator:
+        try:
+            run_coordinator(excel_path, journal, args.coordinator, batch_size=args.batch_size,
+                            lease_timeout=args.lease_timeout, export_failed=args.export_failed)
+        finally:
+            journal.close()
+        return
+    
+    resume_hint = (f"python main.py {excel_path} {args.output_dir} --resume"
+                   + (f" --processes {args.processes}" if args.processes > 1 else "")
+                   + (f" --threads {args.threads}" if args.threads > 1 else ""))
+    
+    # Retries happen per row inside the run; -1 = unlimited, 0 = disabled
+    retries = DEFAULT_RETRIES if args.retry is None else args.retry
+    retry_only = False
+    
+    try:
+        while True:
+            failed = process_excel(
+                excel_file=str(excel_path),
+                output_dir=args.output_dir,
+                threads=args.threads,
+                debug=args.debug,
+                recycle_after=args.recycle_after,
+                engine=args.engine,
+                downloads=args.downloads,
+                cache_ttl=args.cache_ttl,
+                dedupe=args.dedupe,
+                journal=journal,
+                retry_only=retry_only,
+                export_failed=args.export_failed,
+                page_profile=args.page_profile,
+                metrics_file=args.metrics_file,
+                metrics_interval=args.metrics_interval,
+                adaptive=args.adaptive,
+                processes=args.processes,
+                retries=retries,
+                refresh=args.refresh,
+                derivatives=args.derivatives,
+                process_workers=args.process_workers,
+                process_queue=args.process_queue,
+                resolver=args.resolver,
+                events_file=args.events,
+                failed_csv=args.failed_csv,
+                quiet=args.quiet
+            )
             
-            # Check if we've reached the retry limit
-            if max_retries > 0 and retry_count > max_retries:
-                print(f"\n⚠️  Reached maximum retry limit ({max_retries} attempts)")
-                print(f"📋 Remaining failures saved to: {failed_excel_path.name}")
-                print(f"\n💡 To continue retrying, run:")
-                print(f"   python main.py {failed_excel_path.name} {args.output_dir}")
-                if args.threads > 1:
-                    print(f"   python main.py {failed_excel_path.name} {args.output_dir} --threads {args.threads}")
+            # If no failures, we're done
+            if not failed:
+                print("\n✅ All downloads completed successfully!")
                 break
             
-            # Auto-retry
-            if max_retries == -1:
-                print(f"\n🔄 Auto-retry #{retry_count} - Retrying failed downloads...\n")
-            else:
-                print(f"\n🔄 Auto-retry {retry_count}/{max_retries} - Retrying failed downloads...\n")
-            
-            current_file = str(failed_excel_path)
-            continue
-        
-        # Interactive mode - ask user if they want to retry
-        print("\n" + "="*60)
-        while True:
-            response = input("Would you like to retry the failed downloads now? (Y/N/D): ").strip().upper()
-            if response in ['Y', 'YES']:
-                print("\n🔄 Retrying failed downloads...\n")
-                current_file = str(failed_excel_path)
-                break
-            elif response in ['D', 'DEBUG']:
-                print("\n🔍 Retrying failed downloads with DEBUG mode enabled...\n")
-                current_file = str(failed_excel_path)
-                args.debug = True  # Enable debug mode for retry
+            # With an explicit --retry the run already retried what it could
+            if args.retry is not None:
+                print(f"\n⚠️  {failed} rows still failed after retrying")
+                print(f"\n💡 To try them again, run:")
+                print(f"   {resume_hint}")
                 break
-            elif response in ['N', 'NO']:
-                print("\n👋 Exiting. You can retry later by running:")
-                print(f"   python main.py {failed_excel_path.name} {args.output_dir}")
-                if args.threads > 1:
-                    print(f"   python main.py {failed_excel_path.name} {args.output_dir} --threads {args.threads}")
-                return
-            else:
-                print("   Please enter Y (yes), N (no), or D (debug mode).")
+            
+            # Interactive mode - ask user if they want to retry
+            print("\n" + "="*60)
+            while True:
+                response = input("Would you like to retry the failed downloads now? (Y/N/D): ").strip().upper()
+                if response in ['Y', 'YES']:
+                    print("\n🔄 Retrying failed downloads...\n")
+                    retry_only = True
+                    break
+                elif response in ['D', 'DEBUG']:
+                    print("\n🔍 Retrying failed downloads with DEBUG mode enabled...\n")
+                    retry_only = True
+                    args.debug = True  # Enable debug mode for retry
+                    break
+                elif response in ['N', 'NO']:
+                    print("\n👋 Exiting. You can retry later by running:")
+                    print(f"   {resume_hint}")
+                    return
+                else:
+                    print("   Please enter Y (yes), N (no), or D (debug mode).")
+    finally:
+        journal.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,261 @@
+"""Per-phase latency histograms shared by every worker, with JSON / Prometheus export"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Phases in the order they happen to an item, used to order reports
+PHASES = (
+    "chrome_launch",  # Starting a pooled browser
+    "session_inject", # Loading cookies and storage into a new browser
+    "resolve_wait",   # Waiting for a free browser to resolve a folder
+    "html_resolve",   # Reading the first file from the folder page's HTML
+    "page_load",      # driver.get of the folder page
+    "grid_wait",      # Waiting for the file grid to render
+    "cookie_wait",    # Looking for (and accepting) the cookie banner
+    "card_lookup",    # Finding the first card and reading its link
+    "resolve",        # Whole resolve stage in a browser
+    "download_wait",  # Waiting for a free download slot
+    "transfer",       # Fetching the file into the temp directory
+    "finalize",       # Moving or linking the file into place
+    "process_wait",   # Waiting for room in the image processing queue
+    "process",        # Rendering web variants in a worker process
+    "item",           # Whole item, start to finish
+)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style)"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other):
+        """Add another histogram's observations (same buckets) into this one"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if bucket_count and seen + bucket_count >= target:
+                estimate = lower + (upper - lower) * (target - seen) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            seen += bucket_count
+            lower = upper
+        return self.max
+
+    def cumulative(self):
+        """(upper bound label, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        result = []
+        for i, bucket_count in enumerate(self.counts):
+            total += bucket_count
+            result.append((str(self.buckets[i]) if i < len(self.buckets) else "+Inf", total))
+        return result
+
+
+class Metrics:
+    """
+    Thread-safe registry of one Histogram per phase.
+
+    Workers record time with `with metrics.timer("phase"):` or
+    metrics.observe(); reports and exports read a consistent snapshot.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self.started_at = time.time()
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        """Time a with-block (including ones that raise) under a phase name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def state(self):
+        """Picklable copy of every histogram, for merging across processes"""
+        with self._lock:
+            return {name: vars(h).copy() for name, h in self._histograms.items()}
+
+    def merge_state(self, state):
+        """Merge histograms produced by state() in another process"""
+        with self._lock:
+            for name, values in state.items():
+                other = Histogram()
+                vars(other).update(values)
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram()
+                histogram.merge(other)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self.started_at = time.time()
+
+    def _ordered(self):
+        names = sorted(self._histograms, key=lambda p: (PHASES.index(p) if p in PHASES else len(PHASES), p))
+        return [(name, self._histograms[name]) for name in names]
+
+    def snapshot(self, counters=None):
+        """Plain-dict view of every phase, ready for json.dumps"""
+        with self._lock:
+            phases = {}
+            for name, h in self._ordered():
+                phases[name] = {
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "mean": round(h.sum / h.count, 6),
+                    "min": round(h.min, 6),
+                    "max": round(h.max, 6),
+                    "p50": round(h.quantile(0.50), 6),
+                    "p95": round(h.quantile(0.95), 6),
+                    "p99": round(h.quantile(0.99), 6),
+                    "buckets": dict(h.cumulative()),
+                }
+        return {
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "counters": dict(counters or {}),
+            "phases": phases,
+        }
+
+    def to_prometheus(self, counters=None):
+        """Prometheus text exposition format, for the node_exporter textfile collector"""
+        lines = [
+            "# HELP dropbox_phase_seconds Time spent in each phase of an item.",
+            "# TYPE dropbox_phase_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in self._ordered():
+                for bound, total in h.cumulative():
+                    lines.append(f'dropbox_phase_seconds_bucket{{phase="{name}",le="{bound}"}} {total}')
+                lines.append(f'dropbox_phase_seconds_sum{{phase="{name}"}} {h.sum:.6f}')
+                lines.append(f'dropbox_phase_seconds_count{{phase="{name}"}} {h.count}')
+        if counters:
+            lines.append("# HELP dropbox_items Items by outcome so far.")
+            lines.append("# TYPE dropbox_items gauge")
+            for state, value in counters.items():
+                lines.append(f'dropbox_items{{state="{state}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """Human-readable table of the phases seen so far"""
+        snapshot = self.snapshot()["phases"]
+        if not snapshot:
+            return []
+        lines = [f"  {'Phase':<14} {'Count':>7} {'Total s':>9} {'Mean':>7} {'p50':>7} {'p95':>7} {'p99':>7}"]
+        for name, h in snapshot.items():
+            lines.append(
+                f"  {name:<14} {h['count']:>7} {h['sum']:>9.1f} {h['mean']:>7.2f} "
+                f"{h['p50']:>7.2f} {h['p95']:>7.2f} {h['p99']:>7.2f}"
+            )
+        return lines
+
+
+# Registry shared by the whole process
+metrics = Metrics()
+
+
+class MetricsExporter:
+    """
+    Periodically write a metrics snapshot to a file from a background thread.
+
+    Files ending in .prom get the Prometheus text format, anything else JSON.
+    Each write goes to a temp file that replaces the target, so readers
+    never see a half-written file. A final write happens on stop().
+
+    With `states`, each write reports the merge of the state() dicts it
+    returns (e.g. the registry's own plus those of shard processes still
+    running) instead of the registry alone; the registry is not changed.
+    """
+    def __init__(self, path, registry=metrics, interval=15.0, counters=None, states=None):
+        self.path = Path(path)
+        self.registry = registry
+        self.interval = interval
+        self.counters = counters or (lambda: {})
+        self.states = states
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _combined(self):
+        if self.states is None:
+            return self.registry
+        combined = Metrics()
+        combined.started_at = self.registry.started_at
+        for state in self.states():
+            combined.merge_state(state)
+        return combined
+
+    def write(self):
+        counters = self.counters()
+        registry = self._combined()
+        if self.path.suffix == ".prom":
+            content = registry.to_prometheus(counters)
+        else:
+            content = json.dumps(registry.snapshot(counters), indent=2)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        temp_path.write_text(content)
+        temp_path.replace(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
@@ -0,0 +1,66 @@
+"""In-memory index of files already in the output directory"""
+
+import os
+import threading
+from pathlib import Path
+
+
+class OutputIndex:
+    """
+    Map UPC (file stem) -> path for the output directory and each category
+    subdirectory.
+
+    The tree is scanned once up front; afterwards lookups are dictionary hits
+    and finished downloads are added as they land, so skip checks never
+    touch the filesystem again. Hidden entries (temp dirs, caches) are ignored.
+    """
+    def __init__(self, output_dir):
+        self.root = Path(output_dir)
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self.scan()
+
+    @staticmethod
+    def _scan_dir(path):
+        entries = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    stem = os.path.splitext(entry.name)[0]
+                    entries.setdefault(stem, Path(entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def scan(self):
+        """(Re)build the index from the output directory and its subdirectories"""
+        dirs = {None: self._scan_dir(self.root)}
+        if self.root.exists():
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.is_dir() and not entry.name.startswith("."):
+                        dirs[entry.name] = self._scan_dir(entry.path)
+        with self._lock:
+            self._dirs = dirs
+
+    def __len__(self):
+        return sum(len(files) for files in self._dirs.values())
+
+    def find(self, upc, category=None):
+        """Return the existing file for a UPC in a category (or the root), or None"""
+        key = category or None
+        files = self._dirs.get(key)
+        if files is None:
+            # Nested or newly created category directory: scan it once
+            files = self._scan_dir(self.root / category) if category else {}
+            with self._lock:
+                files = self._dirs.setdefault(key, files)
+        return files.get(str(upc))
+
+    def add(self, path, category=None):
+        """Record a file that was just written"""
+        path = Path(path)
+        with self._lock:
+            self._dirs.setdefault(category or None, {})[path.stem] = path
@@ -0,0 +1,512 @@
+"""asyncio download pipeline: resolve, download and finalize with per-stage limits"""
+
+import asyncio
+import functools
+import shutil
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from blob_store import hash_file
+from concurrency import AdaptiveLimit
+from errors import DownloadError, classify
+from fileops import link_or_copy
+from http_download import NotModified, is_file_link, normalize_shared_url
+from metrics import metrics
+from output_index import OutputIndex
+
+# Partial transfers untouched for this long are removed when a run starts
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
+
+class Item:
+    """One row of work: a UPC, its shared link and where the file should go"""
+    __slots__ = ("index", "upc", "url", "category", "row_data")
+
+    def __init__(self, index, upc, url, category=None, row_data=None):
+        self.index = index
+        self.upc = upc
+        self.url = url
+        self.category = category
+        self.row_data = row_data
+
+
+class Pipeline:
+    """
+    Run items through three stages, each with its own concurrency limit:
+
+    1. resolve:  shared folder URL -> direct file URL (browser bound)
+    2. download: direct file URL -> temp file (network bound)
+    3. finalize: rename into <output>/<category>/<UPC><ext> (disk bound),
+       or with a BlobStore, store the contents once and hardlink them there
+
+    Blocking engine calls run on a private thread pool so hundreds of
+    transfers can be in flight while only a few browsers resolve folders.
+    Items are pulled from the input lazily, so only a bounded number are
+    scheduled at any time.
+
+    With a ResolutionCache, folders resolved in earlier runs skip the
+    resolve stage; a cached link that fails is resolved live and retried.
+
+    Rows that share a link (after normalization) are fetched once: the
+    first row downloads, the rest wait for it and get the file placed via
+    hardlink, reflink or copy (`dedupe` = "link", "copy" or "off").
+
+    With adaptive=True the resolve and download limits are AIMD controlled
+    (see AdaptiveLimit): they start low, grow while latency and failure
+    rate stay healthy, and halve on timeouts and rate limits. The worker
+    counts given are then the ceilings.
+
+    When the engine reads folder HTML over HTTP first, those requests have
+    their own limit (`html_workers`, sized to the resolver's connection
+    pool), and a browser slot is taken only for pages that still have to
+    be rendered.
+
+    Time spent waiting for and inside each stage is recorded in the shared
+    metrics registry (see metrics.py).
+
+    Skip checks use an OutputIndex built once up front (or the one passed
+    in) and kept current as files are written.
+
+    With a Journal, each item is recorded as running when it starts and
+    done/skipped/failed when it finishes.
+
+    With a FileMetadata store, each saved file's source link and HTTP
+    validators are recorded. With refresh=True, rows whose file already
+    exists are fetched again with a conditional request and only replaced
+    when the file changed upstream.
+
+    HTTP transfers stream into <output>/.partial/<UPC>_<row>_<link hash>.part
+    (the row number keeps duplicate rows apart), which outlives a failed attempt, so the retry (or a later run) resumes
+    with a Range request instead of starting from byte zero. It is deleted
+    when the row fails permanently, and partials left untouched for
+    PARTIAL_MAX_AGE are pruned when a run starts.
+
+    With an ImageStage (`post`), every saved or already present file is
+    handed to it after its row succeeds; rendering runs in other processes
+    while downloads continue, and a full queue holds the row until there
+    is room.
+
+    With an EventLog, every outcome and retry is also written as a JSON
+    line; with a FailureCsv, failed rows are appended to it as they fail.
+    With quiet=True no line is printed per row: the progress bar shows
+    running done / skipped / failed counts instead.
+
+    Failures are classified (see errors.py). Retryable ones wait out a
+    per-class exponential backoff with jitter, without holding a scheduling
+    slot, and then go through the stages again, up to `retries` times (-1
+    for no limit). Permanent failures are reported at once.
+    """
+    def __init__(self, engine, output_dir, stats, resolve_workers=1, download_workers=1, html_workers=None, finalize_workers=2, progress_bar=None, debug=False, cache=None, dedupe="link", index=None, journal=None, adaptive=False, retries=2, blobs=None, metadata=None, refresh=False, post=None, events=None, failures=None, quiet=False):
+        self.engine = engine
+        self.events = events
+        self.failures = failures
+        self.quiet = quiet
+        self._counts_shown = 0.0
+        self.post = post
+        self.blobs = blobs
+        self.metadata = metadata
+        self.refresh = refresh
+        self.retries = retries
+        self.resolve_limit = AdaptiveLimit("resolve", resolve_workers, adaptive=adaptive)
+        self.download_limit = AdaptiveLimit("download", download_workers, adaptive=adaptive)
+        self.html_workers = 0
+        self.html_limit = None
+        if getattr(engine, "html", None) is not None:
+            self.html_workers = html_workers or resolve_workers
+            self.html_limit = AdaptiveLimit("html", self.html_workers, adaptive=adaptive)
+        self.journal = journal
+        self.index = index if index is not None else OutputIndex(output_dir)
+        self.cache = cache
+        self.dedupe = dedupe
+        self.output_dir = Path(output_dir)
+        self.stats = stats
+        self.resolve_workers = resolve_workers
+        self.download_workers = download_workers
+        self.finalize_workers = finalize_workers
+        self.progress_bar = progress_bar
+        self.debug = debug
+        self.successful_upcs = set()
+
+    def _write(self, msg):
+        if self.progress_bar is not None:
+            self.progress_bar.write(msg)
+        else:
+            print(msg)
+
+    def _log(self, msg):
+        if self.debug:
+            self._write(msg)
+
+    def _report(self, item, success, message, kind=None):
+        """Record one finished item in the stats and on the progress bar"""
+        if success:
+            if "Skipped" in message:
+                self.stats.add_skipped()
+                line = f"⊘ {item.upc}: {message}"
+            else:
+                self.stats.add_completed()
+                self.successful_upcs.add(item.upc)
+                line = f"✓ {item.upc}: {message}"
+        else:
+            self.stats.add_failed(item.upc, item.url, message, kind=kind)
+            if self.failures is not None:
+                self.failures.add(item.upc, item.url, message, row_data=item.row_data, kind=kind)
+            line = f"✗ {item.upc}: {message}"
+        if not self.quiet:
+            self._write(line)
+        if self.progress_bar is not None:
+            self.progress_bar.update(1)
+            if self.quiet:
+                self._show_counts()
+
+    def _show_counts(self, every=0.5):
+        """Put the running counts on the progress bar, at most every `every` seconds"""
+        now = time.monotonic()
+        if now - self._counts_shown < every:
+            return
+        self._counts_shown = now
+        self.progress_bar.set_postfix(done=self.stats.completed, skipped=self.stats.skipped,
+                                      failed=self.stats.failed, refresh=False)
+
+    def _target_dir(self, item):
+        target_dir = self.output_dir / item.category if item.category else self.output_dir
+        target_dir.mkdir(parents=True, exist_ok=True)
+        return target_dir
+
+    def _finalize(self, downloaded_file, target_dir, upc, digest=None):
+        """Move (or store and link) a download into place; returns (path, already stored)"""
+        final_path = target_dir / f"{upc}{downloaded_file.suffix}"
+        if self.blobs is not None:
+            return self.blobs.place(downloaded_file, final_path, digest)
+        shutil.move(str(downloaded_file), str(final_path))
+        return final_path, False
+
+    async def _blocking(self, func, *args, **kwargs):
+        if kwargs:
+            func = functools.partial(func, **kwargs)
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    async def _resolve(self, item, use_cache=True):
+        """Return (file name, download URL, came from cache) for an item's link"""
+        if use_cache and self.cache is not None:
+            cached = await self._blocking(self.cache.get, item.url)
+            if cached:
+                self._log(f"{item.upc}: first file {cached[0]} (cached)")
+                return cached[0], cached[1], True
+
+        if is_file_link(item.url):
+            # Direct file links resolve without a browser
+            file_name, download_url = self.engine.resolve(item.url, self._log)
+            return file_name, download_url, False
+
+        resolved = None
+        if self.html_limit is not None:
+            # Plain HTTP: bounded by the resolver's connections, not the browsers
+            async with self.html_limit:
+                started = time.perf_counter()
+                try:
+                    resolved = await self._blocking(self.engine.resolve_html, item.url, self._log)
+                except Exception as e:
+                    self.html_limit.record(time.perf_counter() - started, e)
+                    raise
+                self.html_limit.record(time.perf_counter() - started)
+
+        if resolved is not None:
+            file_name, download_url = resolved
+        else:
+            waited = time.perf_counter()
+            async with self.resolve_limit:
+                started = time.perf_counter()
+                metrics.observe("resolve_wait", started - waited)
+                try:
+                    file_name, download_url = await self._blocking(self.engine.render, item.url, self._log)
+                except Exception as e:
+                    self.resolve_limit.record(time.perf_counter() - started, e)
+                    raise
+                finally:
+                    metrics.observe("resolve", time.perf_counter() - started)
+                self.resolve_limit.record(time.perf_counter() - started)
+        if file_name:
+            self._log(f"{item.upc}: first file is {file_name}")
+            if self.cache is not None:
+                await self._blocking(self.cache.put, item.url, file_name, download_url)
+        return file_name, download_url, False
+
+    async def _fetch(self, download_url, temp_dir, validators=None, partial=None):
+        waited = time.perf_counter()
+        async with self.download_limit:
+            started = time.perf_counter()
+            metrics.observe("download_wait", started - waited)
+            try:
+                downloaded_file = await self._blocking(self.engine.fetch, download_url, str(temp_dir), self._log, validators, partial)
+            except NotModified:
+                self.download_limit.record(time.perf_counter() - started)
+                raise
+            except Exception as e:
+                self.download_limit.record(time.perf_counter() - started, e)
+                raise
+            finally:
+                metrics.observe("transfer", time.perf_counter() - started)
+            self.download_limit.record(time.perf_counter() - started)
+            return downloaded_file
+
+    async def _process(self, item):
+        existing = self.index.find(item.upc, item.category)
+        if existing and self.refresh:
+            return await self._refresh(item, existing)
+        if self.dedupe == "off":
+            if existing:
+                return (True, f"Skipped (already exists: {existing.name})")
+            success, message, _ = await self._download(item)
+            return (success, message)
+
+        key = normalize_shared_url(item.url)
+        shared = self._fetches.get(key)
+        if existing:
+            # An existing file can serve later rows with the same link
+            if shared is None:
+                shared = self._loop.create_future()
+                shared.set_result(existing)
+                self._fetches[key] = shared
+            return (True, f"Skipped (already exists: {existing.name})")
+
+        if shared is not None:
+            source = await shared
+            async with self._finalize_sem:
+                target_dir = self._target_dir(item)
+                final_path = target_dir / f"{item.upc}{source.suffix}"
+                if final_path == source:
+                    # Duplicate row for the same UPC and link
+                    return (True, f"Skipped (already exists: {source.name})")
+                with metrics.timer("finalize"):
+                    method = await self._blocking(link_or_copy, source, final_path, self.dedupe == "link")
+                self.index.add(final_path, item.category)
+                record = await self._blocking(self.metadata.get, source) if self.metadata is not None else None
+                if record is not None:
+                    await self._blocking(self.metadata.put, final_path, **record)
+            self.stats.add_deduplicated()
+            return (True, f"Downloaded as {final_path.name} ({method} of {source.name})")
+
+        # First row with this link: fetch it and let later rows reuse the result
+        shared = self._loop.create_future()
+        self._fetches[key] = shared
+        try:
+            success, message, final_path = await self._download(item)
+        except Exception as e:
+            del self._fetches[key]
+            shared.set_exception(e)
+            shared.exception()  # Mark as retrieved when no other row is waiting
+            raise
+        if success:
+            shared.set_result(final_path)
+        else:
+            del self._fetches[key]
+            shared.set_exception(RuntimeError(message))
+            shared.exception()
+        return (success, message)
+
+    def _partial_path(self, item):
+        """
+        Where an interrupted transfer for this row and link is kept. Rows
+        repeating a UPC and link (--dedupe off, or --refresh, which fetches
+        every row itself) each get their own file.
+        """
+        key = zlib.crc32(normalize_shared_url(item.url).encode("utf-8"))
+        return self.output_dir / ".partial" / f"{item.upc}_{item.index}_{key:08x}.part"
+
+    def _discard_partial(self, item):
+        """Remove a row's partial transfer and its resume state"""
+        partial = self._partial_path(item)
+        partial.unlink(missing_ok=True)
+        partial.with_name(partial.name + ".json").unlink(missing_ok=True)
+
+    def _prune_partials(self):
+        """Remove partial transfers (and their resume state) nothing has touched in PARTIAL_MAX_AGE"""
+        cutoff = time.time() - PARTIAL_MAX_AGE
+        directory = self.output_dir / ".partial"
+        if not directory.is_dir():
+            return
+        for path in directory.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    async def _refresh(self, item, existing):
+        """Fetch an existing file again only if it changed upstream"""
+        record = await self._blocking(self.metadata.get, existing) if self.metadata is not None else None
+        try:
+            success, message, final_path = await self._download(item, existing, record)
+        except NotModified:
+            return (True, f"Skipped (unchanged upstream: {existing.name})")
+        if success and final_path != existing and "Skipped" not in message:
+            # The new version has a different extension; drop the old one (and its blob)
+            if self.blobs is not None:
+                await self._blocking(self.blobs.release, existing)
+            await self._blocking(existing.unlink, True)
+            if self.metadata is not None:
+                await self._blocking(self.metadata.forget, existing)
+        return (success, message)
+
+    async def _download(self, item, existing=None, previous=None):
+        """
+        Resolve, fetch and finalize one item; returns (success, message, final path).
+
+        When refreshing, `existing` is the file already saved for the row and
+        `previous` its metadata record; the fetch is conditional on its
+        validators and raises NotModified if the file has not changed.
+        """
+        file_name, download_url, from_cache = await self._resolve(item)
+        validators = previous if previous and (previous["etag"] or previous["last_modified"]) else None
+
+        # Each item downloads into its own temp directory; partial transfers
+        # live outside it under a stable name so a retry or a later run resumes them
+        temp_dir = self.output_dir / f".tmp_{item.index}_{item.upc}"
+        partial = self._partial_path(item)
+        try:
+            try:
+                downloaded_file = await self._fetch(download_url, temp_dir, validators, partial)
+            except NotModified:
+                raise
+            except Exception as e:
+                if not from_cache:
+                    raise
+                # The folder may have changed since it was cached; look it up again
+                self._log(f"{item.upc}: cached link failed ({e}), resolving again")
+                await self._blocking(self.cache.invalidate, item.url)
+                file_name, download_url, _ = await self._resolve(item, use_cache=False)
+                downloaded_file = await self._fetch(download_url, temp_dir, validators, partial)
+            if not downloaded_file or not downloaded_file.exists():
+                raise DownloadError("Download failed - no file returned")
+            info = self.engine.take_info(downloaded_file) or {}
+            if info.get("resumed_from"):
+                self._log(f"{item.upc}: resumed transfer at {info['resumed_from'] / (1024 * 1024):.1f} MB")
+            record = {
+                "url": item.url,
+                "file_name": file_name or downloaded_file.name,
+                "download_url": download_url,
+                "etag": info.get("etag"),
+                "last_modified": info.get("last_modified"),
+                "size": info.get("size") or downloaded_file.stat().st_size,
+                "digest": info.get("digest"),
+            }
+
+            if existing:
+                # Transferred again (no validators to ask with); keep the file if it is identical.
+                # Files saved before metadata was recorded have no digest yet, so hash them
+                if not record["digest"]:
+                    record["digest"] = await self._blocking(hash_file, downloaded_file)
+                old_digest = previous["digest"] if previous and previous["digest"] else None
+                if old_digest is None and existing.exists():
+                    old_digest = await self._blocking(hash_file, existing)
+                if record["digest"] == old_digest:
+                    if self.metadata is not None:
+                        await self._blocking(self.metadata.put, existing, **record)
+                    return (True, f"Skipped (unchanged upstream: {existing.name})", existing)
+
+            async with self._finalize_sem:
+                target_dir = self._target_dir(item)
+                with metrics.timer("finalize"):
+                    final_path, reused = await self._blocking(self._finalize, downloaded_file, target_dir, item.upc, record["digest"])
+                self.index.add(final_path, item.category)
+                if self.metadata is not None:
+                    await self._blocking(self.metadata.put, final_path, **record)
+            note = " (contents already stored)" if reused else ""
+            verb = "Updated" if existing else "Downloaded as"
+            return (True, f"{verb} {final_path.name}{note}", final_path)
+        finally:
+            if temp_dir.exists():
+                await self._blocking(shutil.rmtree, temp_dir, True)
+
+    async def _run_item(self, item):
+        if self.journal is not None:
+            await self._blocking(self.journal.mark_running, item)
+        attempt = 1
+        kind = None
+        permanent = False
+        started = time.perf_counter()
+        while True:
+            try:
+                with metrics.timer("item"):
+                    success, message = await self._process(item)
+                break
+            except Exception as e:
+                error = classify(e)
+                kind = error.kind
+                if not error.retryable or (self.retries >= 0 and attempt > self.retries):
+                    success, message = False, f"{error.kind}: {error}"
+                    permanent = not error.retryable
+                    break
+            delay = error.backoff(attempt)
+            self._log(f"🔄 {item.upc}: {error.kind} ({error}), retry {attempt} in {delay:.0f}s")
+            self.stats.add_retry(error.kind)
+            if self.events is not None:
+                self.events.emit("retry", upc=item.upc, kind=error.kind, error=str(error),
+                                 attempt=attempt, delay=round(delay, 1))
+            if self.journal is not None:
+                await self._blocking(self.journal.mark_retry, item, f"{error.kind}: {error}")
+            # Let other items use the scheduling slot while this one backs off
+            self._in_flight.release()
+            await asyncio.sleep(delay)
+            await self._in_flight.acquire()
+            attempt += 1
+        if permanent:
+            # Nothing will resume it; a transient failure keeps it for --resume
+            await self._blocking(self._discard_partial, item)
+        if success and self.post is not None:
+            saved = self.index.find(item.upc, item.category)
+            if saved is not None:
+                await self.post.submit(saved, item.upc, item.category)
+        self._report(item, success, message, kind=None if success else kind)
+        status = "failed" if not success else "skipped" if "Skipped" in message else "done"
+        if self.events is not None:
+            self.events.emit("item", upc=item.upc, url=item.url, category=item.category, status=status,
+                             message=message, kind=None if success else kind, attempts=attempt,
+                             seconds=round(time.perf_counter() - started, 3))
+        if self.journal is not None:
+            await self._blocking(self.journal.mark_finished, item, status, None if success else message)
+
+    async def run(self, items):
+        """Process every item from an iterable (or async iterable) and wait for all to finish"""
+        self._loop = asyncio.get_running_loop()
+        self._finalize_sem = asyncio.Semaphore(self.finalize_workers)
+        self._fetches = {}  # normalized link -> future of the file fetched for it
+        total_workers = self.resolve_workers + self.html_workers + self.download_workers + self.finalize_workers
+        self._executor = ThreadPoolExecutor(max_workers=total_workers + 1, thread_name_prefix="pipeline")
+
+        await self._blocking(self._prune_partials)
+
+        # Bound how many items are scheduled at once instead of queueing every row up front
+        in_flight = self._in_flight = asyncio.Semaphore(total_workers * 2)
+        tasks = set()
+
+        def done(task):
+            tasks.discard(task)
+            in_flight.release()
+
+        async def schedule(item):
+            await in_flight.acquire()
+            task = asyncio.create_task(self._run_item(item))
+            tasks.add(task)
+            task.add_done_callback(done)
+
+        try:
+            if hasattr(items, "__aiter__"):
+                # Async sources (e.g. leases from a coordinator) may wait for work
+                async for item in items:
+                    await schedule(item)
+            else:
+                for item in items:
+                    await schedule(item)
+            if tasks:
+                await asyncio.gather(*tasks)
+            if self.post is not None:
+                await self.post.drain()
+            if self.quiet and self.progress_bar is not None:
+                self._counts_shown = 0.0
+                self._show_counts()
+        finally:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,145 @@
+"""
+Golden Chrome profile: a snapshot of the session profile set up by
+setup_session.py that worker slots clone instead of starting empty.
+"""
+
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+# Profile setup_session.py logs into
+SESSION_PROFILE = Path(tempfile.gettempdir()) / "chrome-debug"
+
+# Snapshot of SESSION_PROFILE that worker slots are cloned from
+TEMPLATE_DIR = Path(tempfile.gettempdir()) / "chrome-template"
+
+# Written into the template and every clone; clones whose stamp differs
+# from the template's are replaced on the next launch
+STAMP_FILE = "template-stamp.json"
+
+# Session files exported from the browser; a change means the template is stale
+SESSION_FILES = ("cookies.txt", "localstorage.json", "sessionstorage.json", "useragent.txt")
+
+# Per-run state Chrome must not find in a copied profile
+SKIP_NAMES = {
+    "SingletonLock", "SingletonSocket", "SingletonCookie", "lockfile",
+    "Crashpad", "Crash Reports", "BrowserMetrics", "ShaderCache", "GrShaderCache",
+}
+
+
+def session_hash(base_dir="."):
+    """Hash of the exported session files, or None if there are none"""
+    digest = hashlib.sha256()
+    found = False
+    for name in SESSION_FILES:
+        path = Path(base_dir) / name
+        if path.is_file():
+            found = True
+            digest.update(name.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest() if found else None
+
+
+def read_stamp(profile_dir):
+    """Stamp dict of a template or clone, or None if it has none"""
+    try:
+        return json.loads((Path(profile_dir) / STAMP_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _ignore(directory, names):
+    return [name for name in names if name in SKIP_NAMES]
+
+
+def _copy_tree(source, dest):
+    """
+    Copy a profile directory, sharing blocks with the source where the
+    filesystem can (reflinks on btrfs / XFS, clonefile on APFS) and falling
+    back to a plain copy elsewhere.
+    """
+    if sys.platform.startswith("linux"):
+        command = ["cp", "-a", "--reflink=auto", str(source), str(dest)]
+    elif sys.platform == "darwin":
+        command = ["cp", "-c", "-R", str(source), str(dest)]
+    else:
+        command = None
+    if command is not None:
+        try:
+            if subprocess.run(command, capture_output=True).returncode == 0:
+                # Chrome keeps all of these at the top of the profile
+                for name in SKIP_NAMES:
+                    path = dest / name
+                    if path.is_dir() and not path.is_symlink():
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif path.is_symlink() or path.exists():
+                        path.unlink()
+                return
+        except OSError:
+            pass
+        shutil.rmtree(dest, ignore_errors=True)
+    shutil.copytree(source, dest, symlinks=True, ignore=_ignore)
+
+
+def snapshot_template(profile_dir=SESSION_PROFILE, template_dir=TEMPLATE_DIR, base_dir="."):
+    """
+    Replace the golden template with a copy of a logged-in profile.
+    Chrome must not be running on profile_dir.
+
+    Returns:
+        The new stamp dict
+    """
+    template_dir = Path(template_dir)
+    staging = template_dir.with_name(f".{template_dir.name}.{uuid.uuid4().hex[:8]}")
+    _copy_tree(Path(profile_dir), staging)
+    stamp = {"id": uuid.uuid4().hex, "created": time.time(), "session": session_hash(base_dir)}
+    (staging / STAMP_FILE).write_text(json.dumps(stamp))
+    old = template_dir.with_name(f".{template_dir.name}.old")
+    shutil.rmtree(old, ignore_errors=True)
+    if template_dir.exists():
+        template_dir.rename(old)
+    staging.rename(template_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return stamp
+
+
+def prepare_profile(profile_dir, template_dir=TEMPLATE_DIR):
+    """
+    Make sure a worker slot's profile is a clone of the current template.
+
+    A clone with the template's stamp is kept as is, with the cache and
+    cookie consent from earlier runs; anything else is replaced. Without a
+    template the slot keeps whatever profile it has (usually none).
+
+    Returns:
+        True if the profile was (re)cloned
+    """
+    template = read_stamp(template_dir)
+    if template is None:
+        return False
+    profile_dir = Path(profile_dir)
+    current = read_stamp(profile_dir)
+    if current is not None and current.get("id") == template.get("id"):
+        return False
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    _copy_tree(Path(template_dir), profile_dir)
+    return True
+
+
+def template_status(template_dir=TEMPLATE_DIR, base_dir="."):
+    """
+    "missing", "stale" (session files changed since the snapshot) or "ok"
+    """
+    stamp = read_stamp(template_dir)
+    if stamp is None:
+        return "missing"
+    current = session_hash(base_dir)
+    if current is not None and stamp.get("session") != current:
+        return "stale"
+    return "ok"
@@ -0,0 +1,129 @@
+"""On-disk cache of shared folder URL -> first file, so folders are rendered once"""
+
+import sqlite3
+import threading
+import time
+
+# Cache hits whose last-used time is written at once, at the latest
+TOUCH_BATCH = 500
+
+
+class ResolutionCache:
+    """
+    Remember which file comes first in each shared folder.
+
+    Entries expire after `ttl` seconds. When the cache grows past
+    `max_entries`, the least recently used entries are evicted (checked
+    every `evict_every` puts and on close). The cache is a SQLite file so
+    several processes can share it safely.
+
+    A hit only reads: its last-used time is kept in memory and written
+    with the next write or commit, so lookups never wait on the write lock
+    other processes may hold.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=100000, commit_every=50, evict_every=1000):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._puts = 0
+        self._touched = {}  # url -> last use not written yet
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                url TEXT PRIMARY KEY,
+                file_name TEXT,
+                href TEXT NOT NULL,
+                resolved_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS resolutions_used_at ON resolutions (used_at)")
+        self._conn.commit()
+
+    def get(self, url):
+        """
+        Look up a folder URL.
+
+        Returns:
+            Tuple of (file name, direct download URL), or None if the folder
+            is not cached or its entry has expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, href, resolved_at FROM resolutions WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[2] > self.ttl):
+                if row is not None:
+                    self._conn.execute("DELETE FROM resolutions WHERE url = ?", (url,))
+                    self._mark_dirty()
+                self.misses += 1
+                return None
+            self._touched[url] = now
+            if len(self._touched) >= TOUCH_BATCH:
+                self._write()
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, url, file_name, href):
+        """Store the first file of a folder"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO resolutions (url, file_name, href, resolved_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (url, file_name, href, now, now),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._flush_touched()
+                self._evict()
+            self._mark_dirty()
+
+    def invalidate(self, url):
+        """Forget a folder, e.g. after its cached link stopped working"""
+        with self._lock:
+            self._conn.execute("DELETE FROM resolutions WHERE url = ?", (url,))
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self._write()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE resolutions SET used_at = ? WHERE url = ?",
+                                   [(used_at, url) for url, used_at in self._touched.items()])
+            self._touched = {}
+
+    def _write(self):
+        self._flush_touched()
+        self._conn.commit()
+        self._pending = 0
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM resolutions WHERE url IN (SELECT url FROM resolutions ORDER BY used_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def commit(self):
+        """Write pending entries now instead of at the next batch boundary"""
+        with self._lock:
+            self._write()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._evict()
+            self._write()
+            self._conn.close()
@@ -0,0 +1,157 @@
+"""Everything a pipeline run needs besides its rows, opened once and shared by its items"""
+
+from blob_store import BlobStore
+from driver_pool import DriverPool
+from engines import BrowserEngine, HttpEngine
+from event_log import EventLog, FailureCsv
+from file_meta import FileMetadata
+from html_resolver import HtmlResolver
+from http_download import HttpDownloader
+from image_stage import ImageStage
+from output_index import OutputIndex
+from pipeline import Pipeline
+from resolution_cache import ResolutionCache
+
+
+class RunResources:
+    """
+    Browser pool, engine, HTTP connection pools, output index, resolution
+    cache, blob store, file metadata, image stage, event log and failure CSV
+    for one output directory.
+
+    A normal run opens one set and closes it at the end; serve mode keeps
+    one open for every job, so browsers, connections and caches stay warm.
+
+    Args:
+        output_path: Output directory (Path)
+        options: Dict of run settings (threads, engine, downloads, ...),
+            see process_excel
+        log: Callable for messages, e.g. a progress bar's write
+    """
+    def __init__(self, output_path, options, log=print):
+        self.output_path = output_path
+        self.options = options
+        threads = options["threads"]
+        debug = options["debug"]
+
+        # One browser per worker slot, reused across rows and recycled as needed
+        self.pool = DriverPool(threads, max_uses=options["recycle_after"], debug=debug,
+                               profile_prefix=options.get("profile_prefix", "chrome-download"),
+                               page_profile=options["page_profile"], log=log)
+        # Read folder pages over HTTP first; Chrome renders only what that cannot parse.
+        # Those reads are plain requests, so they get as many connections as transfers
+        self.html = None
+        self.html_workers = None
+        if options.get("resolver", "browser") == "html":
+            self.html_workers = max(threads, options["downloads"])
+            self.html = HtmlResolver(HttpDownloader(max_connections=self.html_workers))
+        if options["engine"] == "http":
+            self.downloads = options["downloads"]
+            self.engine = HttpEngine(self.pool, HttpDownloader(max_connections=self.downloads), self.html)
+        else:
+            # Chrome does the transfer too, so downloads are bounded by the browser count
+            self.downloads = threads
+            self.engine = BrowserEngine(self.pool, self.html)
+
+        # One scan of the output tree up front; skip checks are lookups afterwards
+        self.index = OutputIndex(output_path)
+        if debug:
+            log(f"Indexed {len(self.index)} existing files")
+
+        # Shard processes share the SQLite stores: commit every write so no
+        # shard keeps the write lock while it waits on a transfer
+        commit_every = 1 if options.get("shard") is not None else 50
+
+        # Remember which file comes first in each folder across runs and retries
+        cache_ttl = options["cache_ttl"]
+        self.cache = None
+        if cache_ttl:
+            self.cache = ResolutionCache(output_path / ".resolve_cache.sqlite", ttl=cache_ttl * 3600,
+                                         commit_every=commit_every)
+
+        # With hardlink dedupe, identical files are also stored once by content;
+        # blobs whose files were deleted since the last run are dropped
+        self.blobs = None
+        if options["dedupe"] == "link":
+            self.blobs = BlobStore(output_path)
+            pruned = self.blobs.prune()
+            if debug and pruned:
+                log(f"Removed {pruned} stored files no output file uses any more")
+        # Source link and HTTP validators of every saved file, for --refresh
+        self.metadata = FileMetadata(output_path, commit_every=commit_every)
+
+        # Resize / transcode saved files in other processes while downloads continue
+        self.post = None
+        if options.get("derivatives"):
+            self.post = ImageStage(options["derivatives"], workers=options["process_workers"],
+                                   queue_size=options["process_queue"], log=log)
+
+        # Outcomes streamed to disk as they happen, instead of only the end-of-run summary
+        self.events = EventLog(options["events_file"]) if options.get("events_file") else None
+        self.failures = None
+        if options.get("failed_csv"):
+            self.failures = FailureCsv(options["failed_csv"], options.get("columns"))
+
+    def pipeline(self, stats, progress_bar, journal=None, events=None):
+        """
+        A Pipeline over these resources.
+
+        Args:
+            events: Event log to use instead of this set's own (serve mode
+                tags each job's events)
+        """
+        return Pipeline(
+            self.engine, self.output_path, stats,
+            resolve_workers=self.options["threads"],
+            download_workers=self.downloads,
+            html_workers=self.html_workers,
+            progress_bar=progress_bar,
+            debug=self.options["debug"],
+            cache=self.cache,
+            dedupe=self.options["dedupe"],
+            index=self.index,
+            journal=journal,
+            adaptive=self.options["adaptive"],
+            retries=self.options["retries"],
+            blobs=self.blobs,
+            metadata=self.metadata,
+            refresh=self.options.get("refresh", False),
+            post=self.post,
+            events=events if events is not None else self.events,
+            failures=self.failures,
+            quiet=self.options.get("quiet", False)
+        )
+
+    def counters(self):
+        """Browser, resolver, cache and blob store counters since these were opened"""
+        return {
+            "launches": self.pool.launches,
+            "recycles": self.pool.recycles,
+            "cache_hits": self.cache.hits if self.cache else 0,
+            "cache_misses": self.cache.misses if self.cache else 0,
+            "html_hits": self.html.hits if self.html else 0,
+            "html_fallbacks": self.html.fallbacks if self.html else 0,
+            "blobs_stored": self.blobs.stored if self.blobs else 0,
+            "blobs_reused": self.blobs.reused if self.blobs else 0,
+            "bytes_saved": self.blobs.bytes_saved if self.blobs else 0,
+        }
+
+    def commit(self):
+        """Write what the caches and stores hold in memory, without closing them"""
+        if self.cache:
+            self.cache.commit()
+        self.metadata.commit()
+
+    def close(self):
+        self.engine.close()
+        if self.cache:
+            self.cache.close()
+        if self.blobs:
+            self.blobs.close()
+        self.metadata.close()
+        if self.post:
+            self.post.close()
+        if self.failures is not None:
+            self.failures.close()
+        if self.events is not None:
+            self.events.close()
@@ -0,0 +1,154 @@
+"""Streaming readers for input sheets: .xlsx, .xls, .csv, .jsonl and .parquet"""
+
+import csv
+import json
+import math
+from pathlib import Path
+
+from pipeline import Item
+
+REQUIRED_COLUMNS = ['UPC', 'IMAGES LINK']
+SUPPORTED_SUFFIXES = ['.xlsx', '.xlsm', '.xls', '.csv', '.jsonl', '.ndjson', '.parquet']
+
+
+class RowSourceError(Exception):
+    """Raised when an input file cannot be read or lacks required columns"""
+
+
+def clean_value(value):
+    """
+    Normalize a cell to a stripped string, or None if it is empty.
+    Whole-number floats (how spreadsheets often store UPCs) lose their ".0".
+    """
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def _read_xlsx(path):
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    sheet = workbook.active
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, ())
+    columns = [str(h).strip() if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+    total_hint = sheet.max_row - 1 if sheet.max_row else None
+
+    def records():
+        try:
+            for values in rows:
+                if values is None or all(v is None for v in values):
+                    continue
+                yield dict(zip(columns, values))
+        finally:
+            workbook.close()
+    return columns, records(), total_hint
+
+
+def _read_xls(path):
+    # Legacy .xls has no streaming reader; fall back to pandas
+    import pandas as pd
+    df = pd.read_excel(path)
+    columns = [str(c).strip() for c in df.columns]
+    df.columns = columns
+    return columns, (row for row in df.to_dict('records')), len(df)
+
+
+def _read_csv(path):
+    f = open(path, newline='', encoding='utf-8-sig')
+    reader = csv.DictReader(f)
+    columns = [c.strip() for c in (reader.fieldnames or [])]
+    reader.fieldnames = columns
+
+    def records():
+        try:
+            yield from reader
+        finally:
+            f.close()
+    return columns, records(), None
+
+
+def _read_jsonl(path):
+    f = open(path, encoding='utf-8')
+    lines = (line for line in f if line.strip())
+    first = next(lines, None)
+    first_record = json.loads(first) if first else {}
+    columns = list(first_record.keys())
+
+    def records():
+        try:
+            if first:
+                yield first_record
+            for line in lines:
+                yield json.loads(line)
+        finally:
+            f.close()
+    return columns, records(), None
+
+
+def _read_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RowSourceError("Reading .parquet files requires pyarrow (pip install pyarrow)")
+    parquet_file = pq.ParquetFile(path)
+    columns = list(parquet_file.schema_arrow.names)
+
+    def records():
+        for batch in parquet_file.iter_batches(batch_size=1024):
+            yield from batch.to_pylist()
+    return columns, records(), parquet_file.metadata.num_rows
+
+
+READERS = {
+    '.xlsx': _read_xlsx,
+    '.xlsm': _read_xlsx,
+    '.xls': _read_xls,
+    '.csv': _read_csv,
+    '.jsonl': _read_jsonl,
+    '.ndjson': _read_jsonl,
+    '.parquet': _read_parquet,
+}
+
+
+class RowSource:
+    """
+    Lazily yield pipeline Items from an input file.
+
+    The header is read on construction so columns can be validated before
+    any work starts; data rows are only read as the pipeline pulls them.
+    `total_hint` is the row count when the format knows it cheaply, else None.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        reader = READERS.get(self.path.suffix.lower())
+        if reader is None:
+            raise RowSourceError(f"Unsupported input type '{self.path.suffix}' (supported: {', '.join(SUPPORTED_SUFFIXES)})")
+        try:
+            self.columns, self._records, self.total_hint = reader(self.path)
+        except RowSourceError:
+            raise
+        except Exception as e:
+            raise RowSourceError(f"Could not read {self.path.name}: {e}")
+
+        missing = [col for col in REQUIRED_COLUMNS if col not in self.columns]
+        if missing:
+            raise RowSourceError(
+                f"Input file must contain 'UPC' and 'IMAGES LINK' columns (found: {', '.join(self.columns)})"
+            )
+        self.has_category = 'CATEGORY' in self.columns
+
+    def __iter__(self):
+        for index, record in enumerate(self._records):
+            upc = clean_value(record.get('UPC'))
+            url = clean_value(record.get('IMAGES LINK'))
+            if not upc or not url:
+                continue
+            category = clean_value(record.get('CATEGORY')) if self.has_category else None
+            yield Item(index, upc, url, category, row_data=record)
@@ -7,6 +7,7 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 import time
 from cookie_loader import load_json_cookies, load_local_storage, load_session_storage
+from profile_template import SESSION_PROFILE, TEMPLATE_DIR, snapshot_template
 
 
 def main():
@@ -35,7 +36,7 @@ def main():
     chrome_options.add_argument("--remote-debugging-port=9222")
     
     # Use the same user data directory as download_dropbox.py to persist session
-    chrome_options.add_argument("--user-data-dir=/tmp/chrome-debug")
+    chrome_options.add_argument(f"--user-data-dir={SESSION_PROFILE}")
 
     # Initialize the driver
     print("Starting Chrome browser...")
@@ -79,6 +80,11 @@ def main():
         driver.quit()
         print("\nBrowser closed. Session has been saved!")
 
+    # Workers clone this snapshot instead of starting from an empty profile
+    print("Saving profile template for download workers...")
+    snapshot_template(SESSION_PROFILE, TEMPLATE_DIR)
+    print(f"✓ Profile template saved to {TEMPLATE_DIR}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+"""Split a run across worker processes by a stable hash of UPC"""
+
+import multiprocessing
+import queue
+import time
+import zlib
+
+
+def shard_of(upc, processes):
+    """Shard number of a UPC; stable across runs, machines and Python versions"""
+    return zlib.crc32(str(upc).encode("utf-8")) % processes
+
+
+class QueueProgress:
+    """
+    Stand-in for a tqdm bar inside a shard process: progress updates and
+    messages are sent to the parent, which owns the real bar.
+
+    With a state_interval, the shard's running state (whatever the `state`
+    callable set by the shard returns) goes along with progress updates at
+    most that often, so the parent can report on shards still running.
+    """
+    def __init__(self, messages, shard, state_interval=None):
+        self.messages = messages
+        self.shard = shard
+        self.state_interval = state_interval
+        self.state = None
+        self._state_sent = 0.0
+
+    def update(self, n=1):
+        self.messages.put(("update", self.shard, n))
+        if self.state is not None and self.state_interval:
+            now = time.monotonic()
+            if now - self._state_sent >= self.state_interval:
+                self._state_sent = now
+                self.messages.put(("state", self.shard, self.state()))
+
+    def write(self, msg):
+        self.messages.put(("write", self.shard, msg))
+
+    def set_postfix(self, refresh=True, **counts):
+        self.messages.put(("postfix", self.shard, counts))
+
+    def finish(self, result):
+        """Send the shard's final result; must be the last message"""
+        self.messages.put(("result", self.shard, result))
+
+
+def run_shards(target, processes, args, progress_bar, on_result, poll_interval=0.5, on_state=None, state_interval=None):
+    """
+    Run target(shard, processes, *args, progress) in one process per shard and
+    relay their progress into progress_bar until every shard has finished.
+
+    Processes are spawned (not forked), so target must be a module-level
+    function and args must be picklable.
+
+    Args:
+        on_result: Called with (shard, result) for each shard that finished
+        on_state: Called with (shard, state) for the running state shards
+            send every state_interval seconds; a shard's result comes after
+            its last state
+
+    Returns:
+        Dict of shard -> exit code for shards that died without a result
+    """
+    context = multiprocessing.get_context("spawn")
+    messages = context.Queue()
+    workers = {}
+    for shard in range(processes):
+        worker = context.Process(
+            target=target,
+            args=(shard, processes) + tuple(args) + (QueueProgress(messages, shard, state_interval),),
+            name=f"shard-{shard}",
+        )
+        worker.start()
+        workers[shard] = worker
+
+    finished = set()
+    postfixes = {}  # shard -> its latest counters, summed onto the bar
+    crashed = {}
+    silent_exits = {}
+    try:
+        while len(finished) + len(crashed) < processes:
+            try:
+                kind, shard, payload = messages.get(timeout=poll_interval)
+            except queue.Empty:
+                for shard, worker in workers.items():
+                    if shard in finished or shard in crashed or worker.is_alive():
+                        continue
+                    # A clean exit may still have its result in the pipe; give it one more poll
+                    silent_exits[shard] = silent_exits.get(shard, 0) + 1
+                    if worker.exitcode != 0 or silent_exits[shard] > 1:
+                        crashed[shard] = worker.exitcode
+                continue
+            if kind == "update":
+                progress_bar.update(payload)
+            elif kind == "write":
+                progress_bar.write(payload)
+            elif kind == "postfix":
+                postfixes[shard] = payload
+                totals = {}
+                for counts in postfixes.values():
+                    for name, value in counts.items():
+                        totals[name] = totals.get(name, 0) + value
+                progress_bar.set_postfix(refresh=False, **totals)
+            elif kind == "state":
+                if on_state is not None:
+                    on_state(shard, payload)
+            elif kind == "result":
+                finished.add(shard)
+                on_result(shard, payload)
+    finally:
+        for worker in workers.values():
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+    return crashed
@@ -0,0 +1,62 @@
+"""
+Blobs live only as long as some placed file links to them.
+"""
+
+import os
+
+import pytest
+
+from blob_store import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlobStore(tmp_path)
+    if not store._hardlinks_work():
+        pytest.skip("filesystem without hardlinks")
+    yield store
+    store.close()
+
+
+def download(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def blobs_in(store):
+    return sorted(path.name for path in store.root.glob("??/*"))
+
+
+def test_replacing_a_file_removes_its_last_blob(store, tmp_path):
+    final = tmp_path / "cat" / "123.jpg"
+    final.parent.mkdir()
+    store.place(download(tmp_path, "a.part", b"old"), final)
+    old = blobs_in(store)
+    store.place(download(tmp_path, "b.part", b"new"), final)
+    assert final.read_bytes() == b"new"
+    assert len(blobs_in(store)) == 1 and blobs_in(store) != old
+
+
+def test_shared_blob_is_kept(store, tmp_path):
+    (tmp_path / "cat").mkdir()
+    store.place(download(tmp_path, "a.part", b"same"), tmp_path / "cat" / "1.jpg")
+    store.place(download(tmp_path, "b.part", b"same"), tmp_path / "cat" / "2.jpg")
+    store.place(download(tmp_path, "c.part", b"new"), tmp_path / "cat" / "1.jpg")
+    assert (tmp_path / "cat" / "2.jpg").read_bytes() == b"same"
+    assert len(blobs_in(store)) == 2
+
+
+def test_prune_drops_blobs_of_deleted_files(store, tmp_path, monkeypatch):
+    (tmp_path / "cat").mkdir()
+    store.place(download(tmp_path, "a.part", b"gone"), tmp_path / "cat" / "1.jpg")
+    store.place(download(tmp_path, "b.part", b"kept"), tmp_path / "cat" / "2.jpg")
+    (tmp_path / "cat" / "1.jpg").unlink()
+    # Too recent: another process may be about to link it
+    assert store.prune() == 0
+    monkeypatch.setattr("blob_store.PRUNE_MIN_AGE", -1)
+    assert store.prune() == 1
+    assert len(blobs_in(store)) == 1
+    assert store.release(tmp_path / "cat" / "2.jpg")
+    assert blobs_in(store) == []
+    assert os.path.exists(tmp_path / "cat" / "2.jpg")
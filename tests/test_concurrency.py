@@ -0,0 +1,17 @@
+"""
+Nearest-rank percentiles used by the adaptive limit and bench.py.
+"""
+
+from concurrency import percentile
+
+
+def test_nearest_rank():
+    assert percentile(range(1, 21), 95) == 19
+    assert percentile(range(1, 101), 95) == 95
+    assert percentile(range(1, 101), 99) == 99
+    assert percentile([1, 2], 50) == 1
+    assert percentile([5], 99) == 5
+
+
+def test_empty():
+    assert percentile([], 95) is None
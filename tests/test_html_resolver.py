@@ -0,0 +1,48 @@
+"""
+Parity of the HTML resolver with the browser on saved folder pages.
+
+Each page in fixtures/folder_pages is stored with the first file the grid
+shows (`python html_resolver.py --save` writes real ones in the same
+format). The resolver may leave a page to Chrome, but it must never pick
+a different first file.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from download_dropbox import to_download_url
+from html_resolver import check_fixtures, parse_file_list
+
+PAGES = Path(__file__).parent / "fixtures" / "folder_pages"
+FIXTURES = sorted(PAGES.glob("*.json"))
+
+
+@pytest.mark.parametrize("fixture", FIXTURES, ids=lambda path: path.stem)
+def test_first_file_matches_grid(fixture):
+    expected = json.loads(fixture.read_text(encoding="utf-8"))
+    html = fixture.with_suffix(".html").read_text(encoding="utf-8")
+    files = parse_file_list(html, expected["base_url"])
+    if files:
+        name, href = files[0]
+        assert [name, to_download_url(href)] == expected["first_file"]
+
+
+def test_server_rendered_grids_are_read():
+    for stem in ("grid_cards", "grid_entities", "grid_nested_lists", "script_grid_markup"):
+        expected = json.loads((PAGES / f"{stem}.json").read_text(encoding="utf-8"))
+        html = (PAGES / f"{stem}.html").read_text(encoding="utf-8")
+        assert parse_file_list(html, expected["base_url"]), stem
+
+
+def test_json_entries_are_left_to_the_browser():
+    # Prefetched entries are sorted differently from the grid; guessing from them picks the wrong file
+    html = (PAGES / "script_entries_only.html").read_text(encoding="utf-8")
+    assert parse_file_list(html, "https://www.dropbox.com/") == []
+
+
+def test_check_fixtures_reports_no_mismatch():
+    agreed, fallbacks, mismatches = check_fixtures(PAGES, log=lambda msg: None)
+    assert mismatches == 0
+    assert agreed + fallbacks == len(FIXTURES)